@@ -0,0 +1,382 @@
+"""
+Measure extraction throughput without touching the network.
+
+The extractor's yt-dlp session is replaced by FakeYoutubeDL, which answers
+extract_info() with fixture info dicts after a configurable latency, with
+optional jitter and a failure rate. Fixtures are synthetic by default, or
+recorded info dicts loaded from a JSONL file with --fixtures (one
+`yt-dlp --dump-json` object per line).
+
+For every batch size x worker count x output format it reports URLs/second,
+p50/p99 per-URL latency and peak RSS. Each combination runs in a fresh
+interpreter so peak RSS is not inherited from earlier runs. A second pass
+times the output writers on their own (microseconds and bytes per row), and
+a third measures the memory each record keeps once yt-dlp's info dict is
+gone, as a slotted record and as a plain dict. Every pass is repeated for each
+field set in --field-sets (see records.FIELD_PRESETS). A last pass sends a
+burst of concurrent requests for a few popular videos through
+async_service.AsyncExtractor and counts the fetches that coalescing saved.
+Results are printed as JSON, so runs can be compared between commits:
+
+    python benchmarks/bench_extraction.py --sizes 100,1000 --workers 1,8 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'yt_data_extractor')
+sys.path.insert(0, PACKAGE_DIR)
+
+from async_service import AsyncExtractor  # noqa: E402
+from instrumentation import Metrics  # noqa: E402
+from output_writers import WRITERS, create_writer  # noqa: E402
+from records import FIELD_PRESETS, Projection  # noqa: E402
+from youtube_extractor import YouTubeExtractor  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as None there
+    resource = None
+
+
+class FakeDownloadError(Exception):
+    pass
+
+
+def synthetic_fixtures(count=1000, seed=0):
+    """Info dicts shaped like yt-dlp's, with realistic description and tag sizes."""
+    rng = random.Random(seed)
+    words = ['video', 'music', 'live', 'official', 'review', 'tutorial', 'news', 'gaming', 'vlog', 'remix']
+    fixtures = []
+    for i in range(count):
+        fixtures.append({
+            'id': f"fx{i:09d}",
+            'title': ' '.join(rng.choice(words) for _ in range(8)),
+            'upload_date': f"2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+            'view_count': rng.randint(0, 50000000),
+            'like_count': rng.randint(0, 1000000),
+            'duration': rng.randint(30, 7200),
+            'tags': [rng.choice(words) + str(n) for n in range(rng.randint(0, 30))],
+            'category': 'Entertainment',
+            'description': '\n'.join(
+                ' '.join(rng.choice(words) for _ in range(12)) for _ in range(rng.randint(5, 60))
+            ),
+        })
+    return fixtures
+
+
+def load_fixtures(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class FakeYoutubeDL:
+    """Stand-in for yt_dlp.YoutubeDL answering from fixtures after a simulated delay."""
+    def __init__(self, fixtures, latency=0.05, jitter=0.02, error_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            raise FakeDownloadError(f"ERROR: [fake] {url}: Video unavailable")
+        video_id = url.rsplit('=', 1)[-1]
+        info = dict(self.fixtures[int(video_id) % len(self.fixtures)])
+        info['id'] = video_id
+        return info
+
+    def close(self):
+        pass
+
+
+class BenchExtractor(YouTubeExtractor):
+    """YouTubeExtractor whose sessions come from FakeYoutubeDL."""
+    def __init__(self, output_dir, fake_options, **kwargs):
+        super().__init__(output_dir, **kwargs)
+        self.fake_options = fake_options
+        self._seed = 0
+        self._seed_lock = threading.Lock()
+
+    def _new_session(self):
+        with self._seed_lock:
+            self._seed += 1
+            seed = self._seed
+        return FakeYoutubeDL(seed=seed, **self.fake_options)
+
+
+def batch_urls(size):
+    return (f"https://www.youtube.com/watch?v={i:011d}" for i in range(size))
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_extraction(size, workers, output_format, fake_options, fields='default'):
+    """One benchmark run in this process. Returns: result dict"""
+    latencies = []
+    failed = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        metrics = Metrics()
+        extractor = BenchExtractor(output_dir, fake_options, output_format=output_format, dedupe=None,
+                                   metrics=metrics, fields=fields)
+        started = time.perf_counter()
+        try:
+            if workers > 1:
+                for result in extractor.extract_concurrent(batch_urls(size), workers=workers):
+                    latencies.append(result.elapsed)
+                    failed += not result.success
+            else:
+                last = time.perf_counter()
+                for _, success in extractor.extract_many(batch_urls(size)):
+                    now = time.perf_counter()
+                    latencies.append(now - last)
+                    last = now
+                    failed += not success
+        finally:
+            extractor.close()
+        wall = time.perf_counter() - started
+        output_bytes = sum(
+            os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+        )
+    return {
+        'size': size,
+        'workers': workers,
+        'format': output_format,
+        'fields': fields,
+        'failed': failed,
+        'wall_s': round(wall, 3),
+        'urls_per_s': round(size / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'output_bytes': output_bytes,
+        'peak_rss_mb': peak_rss_mb(),
+        'stage_mean_ms': {stage: stats['mean_ms'] for stage, stats in metrics.snapshot()['stages'].items()},
+    }
+
+
+def run_write_cost(size, output_format, fixtures, fields='default'):
+    """Time the writer alone on `size` records. Returns: result dict"""
+    extractor = YouTubeExtractor('.', fields=fields)
+    records = []
+    for i in range(min(size, 10000)):
+        info = dict(fixtures[i % len(fixtures)], id=f"{i:011d}")
+        records.append(extractor._build_metadata(info))
+    with tempfile.TemporaryDirectory() as output_dir:
+        writer = create_writer(output_dir, output_format=output_format)
+        started = time.perf_counter()
+        for i in range(size):
+            writer.write(records[i % len(records)])
+        writer.close()
+        elapsed = time.perf_counter() - started
+        size_bytes = os.path.getsize(writer.path)
+    return {
+        'size': size,
+        'format': output_format,
+        'fields': fields,
+        'us_per_row': round(elapsed / size * 1e6, 2),
+        'bytes_per_row': round(size_bytes / size, 1),
+    }
+
+
+def run_record_memory(count, fixtures, fields='default'):
+    """
+    Bytes each record keeps alive once its info dict is dropped, as a slotted
+    record and as the plain dict every record used to be. Returns: list of result dicts
+    """
+    projection = Projection(fields)
+    encoded = [json.dumps(fixture) for fixture in fixtures]
+    results = []
+    for representation in ('dict', 'slots'):
+        records = []
+        tracemalloc.start()
+        for i in range(count):
+            # Decoded afresh for every record, as yt-dlp returns them, so records share no strings
+            record = projection.build(json.loads(encoded[i % len(encoded)]))
+            records.append(record.to_dict() if representation == 'dict' else record)
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del records
+        results.append({
+            'fields': fields,
+            'representation': representation,
+            'bytes_per_record': round(retained / count, 1),
+        })
+    return results
+
+
+def run_burst(requests, videos, concurrency, fake_options):
+    """
+    Send `requests` concurrent get() calls spread over `videos` videos through
+    an AsyncExtractor, all at once. Returns: result dict
+    """
+    async def burst():
+        extractor = BenchExtractor(None, fake_options, output_mode='none')
+        async with AsyncExtractor(extractor, max_concurrency=concurrency) as service:
+            async def timed(url):
+                started = time.perf_counter()
+                try:
+                    await service.get(url)
+                except Exception:
+                    pass
+                latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                timed(f"https://www.youtube.com/watch?v={i % videos:011d}") for i in range(requests)
+            ))
+            wall = time.perf_counter() - started
+            return wall, service.stats()
+
+    latencies = []
+    wall, stats = asyncio.run(burst())
+    return {
+        'requests': requests,
+        'videos': videos,
+        'concurrency': concurrency,
+        'fetches': stats['fetches'],
+        'fetches_saved': stats['saved'],
+        'wall_s': round(wall, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_in_subprocess(args, size, workers, output_format, fields):
+    command = [
+        sys.executable, os.path.abspath(__file__), '--single',
+        '--sizes', str(size), '--workers', str(workers), '--formats', output_format, '--field-sets', fields,
+        '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+    ]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'size': size, 'workers': workers, 'format': output_format, 'fields': fields,
+                'error': result.stderr.strip()[-500:]}
+    return json.loads(result.stdout)
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PACKAGE_DIR, capture_output=True, text=True
+        )
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int_list, default=[100, 1000], help='comma-separated batch sizes')
+    parser.add_argument('--workers', type=int_list, default=[1, 4, 16], help='comma-separated worker counts')
+    parser.add_argument('--formats', default='csv', help=f"comma-separated output formats ({', '.join(WRITERS)})")
+    parser.add_argument('--latency', type=float, default=0.05, help='mean simulated request latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='latency varies uniformly by +/- this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--fixtures', metavar='FILE', help='JSONL file of recorded yt-dlp info dicts')
+    parser.add_argument('--field-sets', default='default,counts',
+                        help=f"comma-separated field presets ({', '.join(FIELD_PRESETS)})")
+    parser.add_argument('--write-rows', type=int, default=20000, help='rows for the writer-only pass (0 to skip)')
+    parser.add_argument('--memory-records', type=int, default=10000,
+                        help='records for the memory-per-record pass (0 to skip)')
+    parser.add_argument('--burst-requests', type=int, default=1000,
+                        help='concurrent requests in the service burst pass (0 to skip)')
+    parser.add_argument('--burst-videos', type=int, default=10, help='distinct videos the burst asks for')
+    parser.add_argument('--output', metavar='FILE', help='also write the JSON results here')
+    # Internal: run exactly one combination and print its result
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    formats = [item for item in args.formats.split(',') if item]
+    field_sets = [item for item in args.field_sets.split(',') if item]
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else synthetic_fixtures()
+    fake_options = {
+        'fixtures': fixtures, 'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+    }
+
+    if args.single:
+        print(json.dumps(run_extraction(args.sizes[0], args.workers[0], formats[0], fake_options, field_sets[0])))
+        return
+
+    extraction = []
+    for fields in field_sets:
+        for output_format in formats:
+            for size in args.sizes:
+                for workers in args.workers:
+                    result = run_in_subprocess(args, size, workers, output_format, fields)
+                    print(f"{fields} {output_format} size={size} workers={workers}: "
+                          f"{result.get('urls_per_s')} URLs/s", file=sys.stderr)
+                    extraction.append(result)
+
+    write_cost = []
+    if args.write_rows:
+        for fields in field_sets:
+            for output_format in formats:
+                try:
+                    write_cost.append(run_write_cost(args.write_rows, output_format, fixtures, fields))
+                except ImportError as e:
+                    write_cost.append({'format': output_format, 'fields': fields, 'error': str(e)})
+
+    record_memory = []
+    if args.memory_records:
+        for fields in field_sets:
+            record_memory.extend(run_record_memory(args.memory_records, fixtures, fields))
+
+    burst = []
+    if args.burst_requests:
+        for concurrency in args.workers:
+            burst.append(run_burst(args.burst_requests, args.burst_videos, concurrency, fake_options))
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+            'fixtures': args.fixtures or 'synthetic',
+        },
+        'extraction': extraction,
+        'write_cost': write_cost,
+        'record_memory': record_memory,
+        'burst': burst,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure how long the entry points take to start.
+
+Runs each command several times in a fresh interpreter and prints the median
+and best wall-clock time in milliseconds as JSON, so numbers can be compared
+between commits:
+
+    python benchmarks/startup_time.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+PACKAGE_DIR = os.path.join(SRC_DIR, 'yt_data_extractor')
+
+COMMANDS = {
+    # Bare interpreter, to subtract from the figures below
+    'python': ([sys.executable, '-c', 'pass'], SRC_DIR),
+    'cli --help': ([sys.executable, '-m', 'yt_data_extractor', '--help'], SRC_DIR),
+    'cli extract --help': ([sys.executable, '-m', 'yt_data_extractor', 'extract', '--help'], SRC_DIR),
+    # Importing main.py loads PySimpleGUI and tkinter but does not open a window
+    'gui import': ([sys.executable, '-c', 'import main'], PACKAGE_DIR),
+    'yt_dlp import': ([sys.executable, '-c', 'import yt_dlp'], SRC_DIR),
+}
+
+
+def time_command(command, cwd, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+        if result.returncode != 0:
+            return None
+    return {'median_ms': round(statistics.median(timings), 1), 'best_ms': round(min(timings), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    results = {}
+    for name, (command, cwd) in COMMANDS.items():
+        # None means the command failed, e.g. PySimpleGUI is not installed
+        results[name] = time_command(command, cwd, args.runs)
+    print(json.dumps({'python': sys.version.split()[0], 'runs': args.runs, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
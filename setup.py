@@ -1,3 +1,5 @@
+import argparse
+import hashlib
 import subprocess
 import os
 import sys
@@ -9,9 +11,64 @@ import logging
 # Configure logging
 logging.basicConfig(filename='setup.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Modules copied from src/yt_data_extractor into the installation
+SOURCE_FILES = [
+    'main.py',
+    'youtube_extractor.py',
+    'rate_control.py',
+    'output_writers.py',
+    'url_utils.py',
+    'metadata_cache.py',
+    'dedupe.py',
+    'run_control.py',
+    'batch_journal.py',
+    'batch_input.py',
+    'master_store.py',
+    'metrics_history.py',
+    'instrumentation.py',
+    'sharding.py',
+    'records.py',
+    'blob_store.py',
+    'search_index.py',
+    'raw_archive.py',
+    'async_service.py',
+    'pipeline.py',
+    'watchlist.py',
+    'install_paths.py',
+    'cli.py',
+    '__main__.py',
+]
+
+# Dependencies installed into the virtual environment
+REQUIREMENTS = "PySimpleGUI==4.60.5\nyt-dlp==2024.03.10\npyinstaller\n"
+# Written into the venv after a successful install. An upgrade skips pip while
+# it matches the hash of the requirements being installed.
+REQUIREMENTS_HASH_FILE = "requirements.sha256"
+
+# False when the installation is driven by options or environment variables;
+# the prompts then take their defaults (see parse_args)
+INTERACTIVE = True
+
 def clear_screen():
     """Clear the terminal screen based on the operating system."""
-    os.system('cls' if platform.system() == "Windows" else 'clear')
+    if INTERACTIVE:
+        os.system('cls' if platform.system() == "Windows" else 'clear')
+
+def pause(message="\nPress Enter to exit..."):
+    """Wait for Enter, unless running non-interactively."""
+    if INTERACTIVE:
+        input(message)
+
+def detect_os():
+    """Returns: 'linux' or 'windows' for the system this runs on"""
+    return "windows" if platform.system() == "Windows" else "linux"
+
+def requirements_hash(requirements):
+    return hashlib.sha256(requirements.encode('utf-8')).hexdigest()
+
+def venv_executable(directory, os_type, name):
+    """Path of a program (python, pip) in the installation's virtual environment."""
+    return Path(directory) / "venv" / ("Scripts" if os_type == "windows" else "bin") / name
 
 def get_os_from_user():
     """
@@ -32,21 +89,30 @@ def get_os_from_user():
             input("Press Enter to try again...")
             clear_screen()
 
-def check_existing_installation(directory):
+def check_existing_installation(directory, existing=None):
     """
     Check if an installation already exists and handle accordingly.
+    existing: 'upgrade', 'reinstall' or 'new' to choose without asking
     Returns: True if ready to proceed, new directory name if creating new, or False on error
     """
     if os.path.exists(directory):
         print(f"\nFound existing installation at: {directory}")
-        print("\nOptions:")
-        print("1. Remove existing and reinstall")
-        print("2. Create new installation with different name")
-        print("3. Exit")
+        if existing is None:
+            print("\nOptions:")
+            print("1. Upgrade in place (keeps data, and the virtual environment if dependencies are unchanged)")
+            print("2. Remove existing and reinstall")
+            print("3. Create new installation with different name")
+            print("4. Exit")
         
         while True:
-            choice = input("\nEnter choice (1/2/3): ").strip()
+            if existing is None:
+                choice = input("\nEnter choice (1/2/3/4): ").strip()
+            else:
+                choice = {"upgrade": "1", "reinstall": "2", "new": "3"}[existing]
             if choice == "1":
+                print("\nWill upgrade the installation in place")
+                return True
+            elif choice == "2":
                 try:
                     print("\nRemoving existing installation...")
                     shutil.rmtree(directory)
@@ -56,18 +122,18 @@ def check_existing_installation(directory):
                     print(f"Error removing existing installation: {e}")
                     logging.exception("Error removing existing installation")
                     return False
-            elif choice == "2":
+            elif choice == "3":
                 counter = 1
                 while os.path.exists(f"{directory}_{counter}"):
                     counter += 1
                 new_directory = f"{directory}_{counter}"
                 print(f"\nWill create new installation at: {new_directory}")
                 return new_directory
-            elif choice == "3":
+            elif choice == "4":
                 print("\nExiting installation...")
                 sys.exit(0)
             else:
-                print("Invalid choice. Please select 1, 2, or 3.")
+                print("Invalid choice. Please select 1, 2, 3, or 4.")
 
 def get_directory():
     """
@@ -113,6 +179,27 @@ and also subscribe to HEXW1N2
         input("Press Enter to try again...")
         clear_screen()
 
+def prepare_directory(directory, existing="upgrade"):
+    """
+    Non-interactive counterpart of get_directory: resolve directory, handle an
+    existing installation there as `existing` says and create it.
+    Returns: the directory to install in, or None on error
+    """
+    directory = os.path.abspath(os.path.expanduser(directory))
+    if os.path.exists(directory):
+        result = check_existing_installation(directory, existing)
+        if isinstance(result, str):
+            directory = result
+        elif not result:
+            return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        return directory
+    except Exception as e:
+        print(f"Error creating directory: {e}")
+        logging.exception("Error creating directory")
+        return None
+
 def check_directory_permissions(directory):
     """
     Check if we have the necessary permissions on the directory.
@@ -211,12 +298,26 @@ def check_packages(os_type):
             return False
 
 def create_virtual_environment(directory, os_type):
-    """Create a virtual environment in the specified directory."""
+    """
+    Create a virtual environment in the specified directory, or reuse the one
+    an earlier installation left there if its Python still runs.
+    """
+    python_path = venv_executable(directory, os_type, "python")
+    venv_dir = os.path.join(directory, "venv")
+    if os.path.exists(venv_dir):
+        try:
+            subprocess.run([str(python_path), "-c", "import sys"], check=True, capture_output=True)
+            print("✓ Reusing existing virtual environment")
+            return True
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("Existing virtual environment is broken, recreating it")
+            logging.error(f"Existing virtual environment is broken: {e}")
+            shutil.rmtree(venv_dir, ignore_errors=True)
     print("\nCreating virtual environment...")
     python_cmd = "python" if os_type == "windows" else "python3"
     try:
         result = subprocess.run(
-            [python_cmd, "-m", "venv", os.path.join(directory, "venv")],
+            [python_cmd, "-m", "venv", venv_dir],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
@@ -232,20 +333,32 @@ def create_virtual_environment(directory, os_type):
         logging.exception("Error creating virtual environment")
         return False
 
-def install_dependencies(directory, os_type):
-    """Install required Python packages in the virtual environment."""
+def install_dependencies(directory, os_type, requirements=REQUIREMENTS, wheelhouse=None):
+    """
+    Install required Python packages in the virtual environment. Skipped when
+    the venv already holds exactly these requirements. With a wheelhouse
+    (see build_wheelhouse), packages come from there and no network is used.
+    """
     print("\nInstalling dependencies...")
-    venv_path = Path(directory) / "venv"
-    pip_path = venv_path / ("Scripts" if os_type == "windows" else "bin") / "pip"
+    pip_path = venv_executable(directory, os_type, "pip")
+    hash_path = Path(directory) / "venv" / REQUIREMENTS_HASH_FILE
+    digest = requirements_hash(requirements)
     
     try:
+        if hash_path.exists() and hash_path.read_text().strip() == digest:
+            print("✓ Dependencies unchanged since the last install, skipping")
+            return True
+        
         # Create requirements.txt
         with open(Path(directory) / "requirements.txt", "w") as f:
-            f.write("PySimpleGUI==4.60.5\nyt-dlp==2024.03.10\npyinstaller\n")
+            f.write(requirements)
         
         # Install dependencies
+        command = [str(pip_path), "install", "-r", str(Path(directory) / "requirements.txt")]
+        if wheelhouse:
+            command += ["--no-index", "--find-links", os.path.abspath(wheelhouse)]
         result = subprocess.run(
-            [str(pip_path), "install", "-r", str(Path(directory) / "requirements.txt")],
+            command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
@@ -254,6 +367,7 @@ def install_dependencies(directory, os_type):
             print(f"Error: {result.stderr}")
             logging.error(f"Error installing dependencies: {result.stderr}")
             return False
+        hash_path.write_text(digest + "\n")
         print("✓ Dependencies installed successfully")
         return True
     except Exception as e:
@@ -261,6 +375,35 @@ def install_dependencies(directory, os_type):
         logging.exception("Error installing dependencies")
         return False
 
+def build_wheelhouse(wheelhouse, requirements=REQUIREMENTS):
+    """
+    Download or build a wheel of every requirement and its dependencies into
+    wheelhouse, for installing with --wheelhouse on machines without network.
+    Wheels are built for this machine's Python version and platform.
+    """
+    print(f"\nBuilding wheelhouse in: {wheelhouse}")
+    try:
+        os.makedirs(wheelhouse, exist_ok=True)
+        requirements_path = os.path.join(wheelhouse, "requirements.txt")
+        with open(requirements_path, "w") as f:
+            f.write(requirements)
+        result = subprocess.run(
+            [sys.executable, "-m", "pip", "wheel", "-r", requirements_path, "-w", wheelhouse],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        if result.returncode != 0:
+            print(f"Error: {result.stderr}")
+            logging.error(f"Error building wheelhouse: {result.stderr}")
+            return False
+        print("✓ Wheelhouse built successfully")
+        return True
+    except Exception as e:
+        print(f"Error building wheelhouse: {str(e)}")
+        logging.exception("Error building wheelhouse")
+        return False
+
 def create_directories(directory):
     """Create necessary project directories."""
     print("\nCreating project directories...")
@@ -300,7 +443,7 @@ def create_directories(directory):
 def create_package_structure(directory):
     """
     Create the Python package structure and copy source files.
-    This includes creating the src directory, __init__.py, and copying main.py and youtube_extractor.py
+    This includes creating the src directory, __init__.py, and copying every module in SOURCE_FILES
     """
     print("\nCreating package structure...")
     try:
@@ -316,9 +459,7 @@ def create_package_structure(directory):
         
         # Copy source files from setup directory
         setup_dir = os.path.dirname(os.path.abspath(__file__))
-        source_files = ['main.py', 'youtube_extractor.py']
-        
-        for filename in source_files:
+        for filename in SOURCE_FILES:
             source = os.path.join(setup_dir, 'src', 'yt_data_extractor', filename)
             dest = os.path.join(src_dir, filename)
             if os.path.exists(source):
@@ -347,7 +488,7 @@ def verify_installation(directory):
         
         # Verify package structure
         src_dir = os.path.join(directory, 'src', 'yt_data_extractor')
-        required_files = ['__init__.py', 'main.py', 'youtube_extractor.py']
+        required_files = ['__init__.py'] + SOURCE_FILES
         for file in required_files:
             if not os.path.exists(os.path.join(src_dir, file)):
                 print(f"✗ Required file missing: {file}")
@@ -364,46 +505,106 @@ def verify_installation(directory):
         logging.error(f"Python interpreter not found at {python_path}")
         return False
 
-def main():
+def parse_args(argv=None):
+    """
+    Options for unattended installs; each also has an environment variable.
+    Giving an installation directory skips every prompt.
+    """
+    env = os.environ.get
+    parser = argparse.ArgumentParser(
+        description="Install or upgrade the YouTube Tool. Without --dir, asks for everything interactively."
+    )
+    parser.add_argument("--dir", default=env("YTDE_INSTALL_DIR"),
+                        help="installation directory; installs without prompts ($YTDE_INSTALL_DIR)")
+    parser.add_argument("--os", choices=("linux", "windows"), default=env("YTDE_OS"),
+                        help="operating system (default: detected) ($YTDE_OS)")
+    parser.add_argument("--existing", choices=("upgrade", "reinstall", "new"),
+                        default=env("YTDE_EXISTING", "upgrade"),
+                        help="what to do with an installation already in --dir: upgrade it in place (default), "
+                             "remove it and reinstall, or install next to it ($YTDE_EXISTING)")
+    parser.add_argument("--wheelhouse", default=env("YTDE_WHEELHOUSE"),
+                        help="install dependencies offline from this directory of wheels ($YTDE_WHEELHOUSE)")
+    parser.add_argument("--build-wheelhouse", metavar="DIR",
+                        help="download and build wheels of every dependency into DIR, then install only if --dir "
+                             "is given")
+    parser.add_argument("--requirements", metavar="FILE", default=env("YTDE_REQUIREMENTS"),
+                        help="pinned requirements to install instead of the built-in ones (default: the "
+                             "wheelhouse's requirements.txt with --wheelhouse) ($YTDE_REQUIREMENTS)")
+    parser.add_argument("--skip-system-check", action="store_true",
+                        default=env("YTDE_SKIP_SYSTEM_CHECK", "") not in ("", "0"),
+                        help="do not check for python3-venv and python3-pip with dpkg ($YTDE_SKIP_SYSTEM_CHECK)")
+    return parser.parse_args(argv)
+
+def read_requirements(args):
+    """Returns: the requirements to install, as requirements.txt text"""
+    path = args.requirements
+    if path is None and args.wheelhouse and os.path.exists(os.path.join(args.wheelhouse, "requirements.txt")):
+        path = os.path.join(args.wheelhouse, "requirements.txt")
+    if path is None:
+        return REQUIREMENTS
+    with open(path) as f:
+        return f.read()
+
+def main(argv=None):
     """Main installation function."""
+    global INTERACTIVE
+    args = parse_args(argv)
+    INTERACTIVE = not args.dir
+    try:
+        requirements = read_requirements(args)
+    except OSError as e:
+        print(f"Error reading requirements: {e}")
+        logging.error(f"Error reading requirements: {e}")
+        sys.exit(1)
+    if args.build_wheelhouse:
+        if not build_wheelhouse(args.build_wheelhouse, requirements):
+            sys.exit(1)
+        if not args.dir:
+            return
+        args.wheelhouse = args.wheelhouse or args.build_wheelhouse
+
     clear_screen()
     print("YouTube Tool Setup Wizard")
     print("========================")
     
-    os_type = get_os_from_user()
-    if not check_packages(os_type):
-        input("\nPress Enter to exit...")
+    os_type = args.os or (get_os_from_user() if INTERACTIVE else detect_os())
+    if not args.skip_system_check and not check_packages(os_type):
+        pause()
         sys.exit(1)
         
-    directory = get_directory()
+    directory = get_directory() if INTERACTIVE else prepare_directory(args.dir, args.existing)
+    if directory is None:
+        sys.exit(1)
     if not check_directory_permissions(directory):
         print("\nPermission issues detected. Please fix permissions and try again.")
         print("You can fix this by running:")
         print(f"sudo chown -R $USER:$USER {directory}")
         print(f"chmod 755 {directory}")
-        input("\nPress Enter to exit...")
+        pause()
         sys.exit(1)
 
     print(f"\nInstalling in: {directory}")
     print(f"Operating System: {os_type.capitalize()}")
-    input("\nPress Enter to begin installation...")
+    if args.wheelhouse:
+        print(f"Dependencies from: {os.path.abspath(args.wheelhouse)} (offline)")
+    pause("\nPress Enter to begin installation...")
     
     steps = [
-        (create_virtual_environment, "Creating virtual environment"),
-        (install_dependencies, "Installing dependencies"),
-        (create_directories, "Creating directories"),
-        (create_package_structure, "Creating package structure"),
-        (verify_installation, "Verifying installation")
+        (lambda: create_virtual_environment(directory, os_type), "Creating virtual environment"),
+        (lambda: install_dependencies(directory, os_type, requirements, args.wheelhouse), "Installing dependencies"),
+        (lambda: create_directories(directory), "Creating directories"),
+        (lambda: create_package_structure(directory), "Creating package structure"),
+        (lambda: verify_installation(directory), "Verifying installation")
     ]
     
     for step_func, step_name in steps:
         print(f"\n{step_name}...")
-        success = step_func(directory, os_type) if 'os_type' in step_func.__code__.co_varnames else step_func(directory)
+        success = step_func()
         
         if not success:
             print(f"\nError during {step_name.lower()}. Installation failed.")
             logging.error(f"Error during {step_name.lower()}")
-            input("\nPress Enter to exit...")
+            pause()
             sys.exit(1)
         
         # Add explicit success message for each step
@@ -417,7 +618,7 @@ def main():
     else:
         print(f"    source {directory}/venv/bin/activate")
     
-    input("\nPress Enter to exit...")
+    pause()
 
 if __name__ == "__main__":
     try:
@@ -428,5 +629,5 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"\nUnexpected error: {str(e)}")
         logging.exception("Unexpected error")
-        input("\nPress Enter to exit...")
+        pause()
         sys.exit(1)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The package modules import each other by bare name (as main.py does when run
+# as a script), so make them importable when started with `python -m`.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
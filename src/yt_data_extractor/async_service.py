@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlparse
+
+from rate_control import PERMANENT, RATE_LIMITED, AdaptiveRateController, classify_error
+from records import as_dict
+from url_utils import canonical_url, video_id_from_url
+
+# HTTP status of a failed lookup, by rate_control error kind
+ERROR_STATUS = {PERMANENT: 404, RATE_LIMITED: 503}
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               502: 'Bad Gateway', 503: 'Service Unavailable'}
+
+
+def request_key(url):
+    """Requests with the same key are the same video: its ID, or the canonical URL."""
+    return video_id_from_url(url) or canonical_url(url)
+
+
+class AsyncExtractor:
+    """
+    asyncio front end to a YouTubeExtractor, for embedding in other applications:
+    `await service.get(url)` returns the video's record.
+
+    Concurrent requests for the same video share one fetch while it is in
+    flight, and a fetched record is memoised for memo_ttl seconds, so a burst
+    of requests for a popular video costs one fetch. Fetches run on a pool of
+    max_concurrency threads with their own yt-dlp sessions; further requests
+    wait their turn. The extractor's cache, raw archive and rate control apply
+    as in batch runs. Use from one event loop.
+    """
+    def __init__(self, extractor, max_concurrency=8, memo_ttl=30.0, memo_size=10000, max_rps=None):
+        self.extractor = extractor
+        self.max_concurrency = max_concurrency
+        self.memo_ttl = memo_ttl
+        self.memo_size = memo_size
+        if max_rps:
+            extractor.rate_controller = AdaptiveRateController(max_rps, max_retries=extractor.fetch_retries)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='service')
+        self._in_flight = {}
+        # key -> (expiry time, record), oldest first
+        self._memo = OrderedDict()
+        self.requests = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.memo_hits = 0
+        self.failures = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def get(self, url):
+        """
+        Returns: the record of the video at url
+        Raises: the fetch error, shared by every request that waited on the fetch
+        """
+        self.requests += 1
+        key = request_key(url)
+        memo = self._memo.get(key)
+        if memo is not None:
+            if memo[0] > time.monotonic():
+                self.memo_hits += 1
+                self.extractor.metrics.incr('memo_hits')
+                return memo[1]
+            del self._memo[key]
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, url))
+            # Retrieve the error even if every waiter was cancelled
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+            self.extractor.metrics.incr('coalesced')
+        # One caller giving up must not cancel the fetch the others wait on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, url):
+        self.fetches += 1
+        loop = asyncio.get_running_loop()
+        try:
+            record = await loop.run_in_executor(self._executor, self.extractor.get_record, url)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            del self._in_flight[key]
+        if self.memo_ttl > 0:
+            self._memo[key] = (time.monotonic() + self.memo_ttl, record)
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return record
+
+    def stats(self):
+        """Returns: dict of request counters; 'saved' is requests answered without a fetch of their own"""
+        return {
+            'requests': self.requests,
+            'fetches': self.fetches,
+            'coalesced': self.coalesced,
+            'memo_hits': self.memo_hits,
+            'saved': self.coalesced + self.memo_hits,
+            'failures': self.failures,
+            'in_flight': len(self._in_flight),
+        }
+
+    def close(self):
+        """Wait for running fetches, then close the extractor's sessions."""
+        self._executor.shutdown(wait=True)
+        self.extractor.close()
+
+
+class MetadataServer:
+    """
+    Minimal local HTTP/JSON service on top of an AsyncExtractor:
+
+        GET /video?url=<video URL>   the video's record
+        GET /video/<video ID>        the same, by ID
+        GET /stats                   AsyncExtractor.stats()
+
+    Failures answer {"error", "kind"} with 404 for videos that are gone, 503
+    when rate limited and 502 otherwise. When more than max_pending requests
+    are waiting, new ones get 503 straight away instead of queueing.
+    One request per connection.
+    """
+    def __init__(self, service, host='127.0.0.1', port=8765, max_pending=256):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.pending = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Headers are read and ignored
+            while (await reader.readline()).strip():
+                pass
+            status, body = await self._respond(request_line.decode('latin-1').split())
+        except Exception as e:
+            logging.error(f"Error handling request: {str(e)}")
+            status, body = 502, {'error': str(e)}
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _respond(self, request):
+        """Returns: (HTTP status, JSON-serialisable body)"""
+        if len(request) < 2:
+            return 400, {'error': 'malformed request'}
+        method, target = request[0], urlparse(request[1])
+        if method != 'GET':
+            return 405, {'error': 'only GET is supported'}
+        if target.path == '/stats':
+            return 200, self.service.stats()
+        if target.path == '/video':
+            url = parse_qs(target.query).get('url', [''])[0]
+        elif target.path.startswith('/video/'):
+            video_id = unquote(target.path[len('/video/'):])
+            url = f"https://www.youtube.com/watch?v={video_id}" if video_id else ''
+        else:
+            return 404, {'error': f"unknown path {target.path}"}
+        if not url:
+            return 400, {'error': 'give ?url=<video URL> or /video/<video ID>'}
+        if self.pending >= self.max_pending:
+            return 503, {'error': 'too many requests waiting', 'kind': RATE_LIMITED}
+        self.pending += 1
+        try:
+            record = await self.service.get(url)
+        except Exception as e:
+            kind = classify_error(e)
+            return ERROR_STATUS.get(kind, 502), {'error': str(e), 'kind': kind}
+        finally:
+            self.pending -= 1
+        return 200, as_dict(record)
@@ -0,0 +1,111 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Batch file formats, chosen from the file extension when not given
+INPUT_FORMATS = ('text', 'csv', 'jsonl')
+EXTENSION_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def detect_format(path):
+    """Guess the input format from a file name, ignoring a trailing .gz."""
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return EXTENSION_FORMATS.get(os.path.splitext(name)[1], 'text')
+
+
+class BatchSource:
+    """
+    Lazily reads the URLs of a batch from a file, or from stdin when path is '-'.
+
+    Plain text inputs have one URL per line; blank lines and lines starting with
+    '#' are skipped. CSV and JSONL inputs take the URL from `url_column`.
+    Gzip-compressed inputs are detected from their magic bytes.
+
+    Nothing is read ahead, so memory stays flat however large the input is.
+    Progress comes from the byte offset in the underlying (possibly compressed)
+    file rather than a line count, so there is no pre-count pass.
+    """
+    def __init__(self, path, input_format=None, url_column='url'):
+        self.path = path
+        self.input_format = input_format or ('text' if path == '-' else detect_format(path))
+        if self.input_format not in INPUT_FORMATS:
+            raise ValueError(f"Unknown input format: {self.input_format}")
+        self.url_column = url_column
+        self.total_bytes = None if path == '-' else os.path.getsize(path)
+        self.urls_read = 0
+        self._raw = None
+        # Offset at which reading stopped, once the input is closed
+        self._final_offset = 0
+
+    @property
+    def bytes_read(self):
+        if self._raw is None or self._raw.closed:
+            return self._final_offset
+        try:
+            return self._raw.tell()
+        except (OSError, ValueError):
+            return self._final_offset
+
+    def progress(self):
+        """Returns: fraction of the input consumed (0..1), or None when reading stdin"""
+        if not self.total_bytes:
+            return None
+        return min(self.bytes_read / self.total_bytes, 1.0)
+
+    def eta(self, elapsed):
+        """Returns: estimated seconds left given `elapsed` seconds so far, or None if unknown"""
+        fraction = self.progress()
+        if not fraction:
+            return None
+        return elapsed * (1 - fraction) / fraction
+
+    def __iter__(self):
+        if self.path == '-':
+            raw = sys.stdin.buffer
+        else:
+            raw = open(self.path, 'rb')
+        self._raw = raw
+        try:
+            stream = raw
+            if raw.peek(2)[:2] == GZIP_MAGIC:
+                stream = gzip.GzipFile(fileobj=raw, mode='rb')
+            text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline='')
+            for url in self._iter_urls(text):
+                self.urls_read += 1
+                yield url
+        finally:
+            self._final_offset = self.bytes_read
+            if raw is not sys.stdin.buffer:
+                raw.close()
+
+    def _iter_urls(self, text):
+        if self.input_format == 'csv':
+            reader = csv.DictReader(text)
+            if reader.fieldnames is None:
+                return
+            if self.url_column not in reader.fieldnames:
+                raise ValueError(f"CSV input has no '{self.url_column}' column")
+            for row in reader:
+                url = (row.get(self.url_column) or '').strip()
+                if url:
+                    yield url
+        elif self.input_format == 'jsonl':
+            for line in text:
+                line = line.strip()
+                if not line:
+                    continue
+                url = str(json.loads(line).get(self.url_column) or '').strip()
+                if url:
+                    yield url
+        else:
+            for line in text:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
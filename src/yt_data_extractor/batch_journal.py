@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import time
+
+# Journal line kinds
+DONE = 'D'
+FAILED = 'F'
+PERMANENT = 'P'
+CHECKPOINT = 'C'
+
+# _state value of a URL that failed permanently
+PERMANENT_STATE = -2
+
+
+def job_key(url):
+    """Short, fixed-size key for a job URL so huge journals load quickly."""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class BatchJournal:
+    """
+    Append-only record of a batch run, used to resume it after a crash.
+
+    Every finished URL appends a line, and every `checkpoint_every` URLs (or
+    `checkpoint_interval` seconds) the output writer is fsync'd and a checkpoint
+    line records how far the output file is durable. On resume only entries
+    before the last checkpoint are trusted. The output file is cut back to the
+    checkpointed position, so the resumed run produces the same rows as an
+    uninterrupted one. Failed URLs are retried until they have failed
+    `max_retries` times; permanent failures (private or removed videos, ...)
+    are never retried.
+
+    Line format (tab separated):
+        D <key>                  URL finished successfully
+        F <key>                  URL failed
+        P <key>                  URL failed permanently
+        C <position> <path>      output durable up to position in path
+    """
+    def __init__(self, path, max_retries=3, checkpoint_every=500, checkpoint_interval=10.0):
+        self.path = path
+        self.max_retries = max_retries
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        # key -> number of failures, -1 once the URL succeeded or PERMANENT_STATE
+        self._state = {}
+        # (output path, position) from the last checkpoint, if any
+        self.output = None
+        self.resumed = False
+        self.skipped = 0
+        # URLs this run retries after an earlier failure
+        self.retried = 0
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+        if os.path.exists(path):
+            self._load()
+            self.resumed = True
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8', buffering=1 << 16)
+
+    def _load(self):
+        tentative = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Torn write from a crash
+                    break
+                kind, _, rest = line[:-1].partition('\t')
+                if kind in (DONE, FAILED, PERMANENT):
+                    tentative.append((kind, rest))
+                elif kind == CHECKPOINT:
+                    position, _, output_path = rest.partition('\t')
+                    for entry_kind, key in tentative:
+                        self._apply(entry_kind, key)
+                    tentative = []
+                    self.output = (output_path, int(position)) if output_path else None
+        logging.info(f"Loaded journal {self.path}: {len(self._state)} URLs recorded")
+
+    def _apply(self, kind, key):
+        if kind == DONE:
+            self._state[key] = -1
+        elif kind == PERMANENT:
+            self._state[key] = PERMANENT_STATE
+        elif self._state.get(key, 0) >= 0:
+            self._state[key] = self._state.get(key, 0) + 1
+
+    def should_run(self, url):
+        """Returns: False if url already succeeded, failed permanently or has used up its retries"""
+        state = self._state.get(job_key(url), 0)
+        return state >= 0 and state < self.max_retries
+
+    def filter(self, jobs):
+        """Yield the (index, url) jobs that still need to run."""
+        for index, url in jobs:
+            if self.should_run(url):
+                if self._state.get(job_key(url), 0) > 0:
+                    self.retried += 1
+                yield index, url
+            else:
+                self.skipped += 1
+
+    def record(self, url, success, writer=None, sinks=(), permanent=False):
+        """Record a finished URL, checkpointing through writer (and sinks) when one is due."""
+        kind = DONE if success else (PERMANENT if permanent else FAILED)
+        key = job_key(url)
+        self._file.write(f"{kind}\t{key}\n")
+        self._apply(kind, key)
+        self._since_checkpoint += 1
+        if writer is not None and (
+            self._since_checkpoint >= self.checkpoint_every
+            or time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+        ):
+            self.checkpoint(writer, sinks)
+
+    def checkpoint(self, writer, sinks=()):
+        """Make the writer's output and any extra sinks durable, then record how far the output got."""
+        output_path, position = writer.checkpoint()
+        for sink in sinks:
+            sink.flush()
+        self._file.write(f"{CHECKPOINT}\t{position}\t{output_path or ''}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.output = (output_path, position) if output_path else None
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+    def permanent_failures(self):
+        """Returns: how many recorded URLs failed permanently"""
+        return sum(1 for state in self._state.values() if state == PERMANENT_STATE)
+
+    def retryable_failures(self):
+        """Returns: how many recorded URLs failed but still have retries left"""
+        return sum(1 for state in self._state.values() if 0 < state < self.max_retries)
+
+    def close(self, remove=False):
+        """Close the journal; remove=True deletes it once the run needs no resuming."""
+        self._file.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+# Default blob store file, next to the output files that reference it
+BLOB_STORE_NAME = 'blobs.sqlite3'
+
+# Record fields stored as blobs; rows hold <field>_ref instead
+BLOB_FIELDS = ('description', 'tags')
+
+# Kinds of blob: whole text, list of paragraph hashes, JSON list of strings
+TEXT, PARAGRAPHS, LIST = 't', 'p', 'l'
+PARAGRAPH_SEPARATOR = '\n\n'
+
+
+class BlobStore:
+    """
+    Content-addressed store for the long, repetitive parts of records.
+
+    Each distinct value is zlib-compressed and stored once in SQLite under the
+    hash of its content; rows of the output file hold that hash instead of the
+    value. With chunk_paragraphs=True a description is split at blank lines and
+    every paragraph is stored on its own, so a footer shared by a whole channel
+    is kept once however many descriptions end with it. Safe to share between
+    worker threads.
+
+    New blobs are held in memory and written commit_every at a time in one short
+    transaction, so several processes (e.g. shards) can share the same store;
+    each waits up to busy_timeout seconds for the others' transactions.
+    """
+    def __init__(self, path, chunk_paragraphs=True, commit_every=1000, cache_size=100000, busy_timeout=60.0):
+        self.path = path
+        self.chunk_paragraphs = chunk_paragraphs
+        self.commit_every = commit_every
+        self.cache_size = cache_size
+        # Characters referenced and characters newly stored by this session
+        self.chars_referenced = 0
+        self.chars_stored = 0
+        # Blobs not yet written: hash -> (kind, size, compressed data)
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Hashes known to be stored, and recently read values, newest last
+        self._known = OrderedDict()
+        self._values = OrderedDict()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "hash TEXT PRIMARY KEY, kind TEXT NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _put(self, kind, text):
+        """Store text once. Returns: its hash"""
+        data = text.encode('utf-8')
+        digest = hashlib.blake2b(kind.encode('ascii') + data, digest_size=16).hexdigest()
+        with self._lock:
+            if digest in self._known:
+                self._known.move_to_end(digest)
+                return digest
+            if digest not in self._pending:
+                self._pending[digest] = (kind, len(text), zlib.compress(data))
+                if len(self._pending) >= self.commit_every:
+                    self._commit()
+            self._remember(self._known, digest, True)
+        return digest
+
+    def _commit(self):
+        """Write the pending blobs in one transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        stored = 0
+        try:
+            with self._conn:
+                for digest, (kind, size, data) in pending.items():
+                    cursor = self._conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                                                (digest, kind, size, data))
+                    # Another process may have stored the same blob first
+                    if cursor.rowcount:
+                        stored += size
+        except Exception:
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+        self.chars_stored += stored
+
+    def put_text(self, text):
+        """Store a description. Returns: reference to pass to get(), or None for None"""
+        if text is None:
+            return None
+        with self._lock:
+            self.chars_referenced += len(text)
+        if not self.chunk_paragraphs or PARAGRAPH_SEPARATOR not in text:
+            return self._put(TEXT, text)
+        hashes = [self._put(TEXT, paragraph) for paragraph in text.split(PARAGRAPH_SEPARATOR)]
+        return self._put(PARAGRAPHS, ','.join(hashes))
+
+    def put_list(self, items):
+        """Store a list of strings such as tags. Returns: reference, or None for None"""
+        if items is None:
+            return None
+        text = json.dumps([str(item) for item in items], ensure_ascii=False)
+        with self._lock:
+            self.chars_referenced += len(text)
+        return self._put(LIST, text)
+
+    def get(self, ref):
+        """Returns: the text or list stored under ref (None for None)"""
+        if ref is None or ref == '':
+            return None
+        with self._lock:
+            if ref in self._values:
+                self._values.move_to_end(ref)
+                return self._values[ref]
+            if ref in self._pending:
+                row = (self._pending[ref][0], self._pending[ref][2])
+            else:
+                row = self._conn.execute("SELECT kind, data FROM blobs WHERE hash = ?", (ref,)).fetchone()
+        if row is None:
+            raise KeyError(f"Blob {ref} is missing from {self.path}")
+        kind, text = row[0], zlib.decompress(row[1]).decode('utf-8')
+        if kind == PARAGRAPHS:
+            value = PARAGRAPH_SEPARATOR.join(self.get(digest) for digest in text.split(','))
+        elif kind == LIST:
+            value = json.loads(text)
+        else:
+            value = text
+        with self._lock:
+            self._remember(self._values, ref, value)
+        return value
+
+    def dehydrate(self, record):
+        """Returns: a dict of record with every BLOB_FIELDS value replaced by a <field>_ref"""
+        row = {}
+        for name, value in record.items():
+            if name == 'description':
+                row['description_ref'] = self.put_text(value)
+            elif name == 'tags':
+                row['tags_ref'] = self.put_list(value)
+            else:
+                row[name] = value
+        return row
+
+    def rehydrate(self, row):
+        """Returns: the record a dehydrate()d row came from"""
+        record = {}
+        for name, value in row.items():
+            if name.endswith('_ref') and name[:-4] in BLOB_FIELDS:
+                record[name[:-4]] = self.get(value)
+            else:
+                record[name] = value
+        return record
+
+    def stats(self):
+        """Returns: dict with the number of blobs, their text size and their compressed size"""
+        with self._lock:
+            self._commit()
+            blobs, chars, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs"
+            ).fetchone()
+        return {'blobs': blobs, 'text_chars': chars, 'stored_bytes': stored}
+
+    def summary(self):
+        """Returns: a sentence on how much text this session referenced and how much was new, or None"""
+        if not self.chars_referenced:
+            return None
+        return (f"Blob store: {self.chars_referenced} characters of descriptions and tags, "
+                f"{self.chars_stored} of them new")
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._commit()
+                self._conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error closing blob store: {str(e)}")
+
+
+def has_refs(record):
+    return any(name.endswith('_ref') and name[:-4] in BLOB_FIELDS for name in record)
+
+
+def rehydrate_records(records, path, blob_store=None):
+    """
+    Yield records read from the output file at path with blob references
+    replaced by their values. Without a blob_store, the one next to path is used.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return
+    if not has_refs(first):
+        yield first
+        yield from records
+        return
+    owns_store = blob_store is None
+    if owns_store:
+        store_path = os.path.join(os.path.dirname(os.path.abspath(path)), BLOB_STORE_NAME)
+        if not os.path.exists(store_path):
+            raise ValueError(f"{path} references blobs but there is no {store_path}")
+        blob_store = BlobStore(store_path)
+    try:
+        yield blob_store.rehydrate(first)
+        for record in records:
+            yield blob_store.rehydrate(record)
+    finally:
+        if owns_store:
+            blob_store.close()
+
+
+class BlobRefWriter:
+    """
+    Wraps an output writer so descriptions and tags go to a BlobStore and the
+    file gets their references. Blobs are committed before every checkpoint,
+    so a resumed file never references a blob that was lost.
+    """
+    def __init__(self, writer, blob_store):
+        self.writer = writer
+        self.blob_store = blob_store
+
+    @property
+    def path(self):
+        return self.writer.path
+
+    @property
+    def rows_written(self):
+        return self.writer.rows_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        self.writer.write(self.blob_store.dehydrate(record))
+
+    def flush(self, fsync=False):
+        self.blob_store.flush()
+        self.writer.flush(fsync)
+
+    def checkpoint(self):
+        self.blob_store.flush()
+        return self.writer.checkpoint()
+
+    def resume(self, path, position):
+        self.writer.resume(path, position)
+
+    def close(self):
+        self.blob_store.flush()
+        self.writer.close()
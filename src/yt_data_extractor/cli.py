@@ -0,0 +1,859 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from install_paths import find_installation_dir
+
+# Only lightweight modules are imported here. The extractor, and yt-dlp behind
+# it, are imported inside the command that needs them so `--help` stays fast.
+# PySimpleGUI is never imported by the CLI. OUTPUT_FORMATS mirrors
+# output_writers.WRITERS for the same reason.
+OUTPUT_FORMATS = ('csv', 'jsonl', 'sqlite', 'parquet')
+
+
+def iter_input_urls(args, source):
+    """Yield URLs from the command line, then from the batch source."""
+    yield from args.urls
+    if source is not None:
+        yield from source
+
+
+def report_progress(source, processed, elapsed, pipeline_stats=None):
+    message = f"Progress: {processed} URLs in {elapsed:.0f}s"
+    fraction = source.progress()
+    if fraction is not None:
+        message += f", {fraction * 100:.1f}% of input read"
+        eta = source.eta(elapsed)
+        if eta is not None:
+            message += f", about {eta:.0f}s left"
+    print(message, file=sys.stderr)
+    if pipeline_stats:
+        from pipeline import pipeline_summary
+        print(f"Pipeline: {pipeline_summary(pipeline_stats)}", file=sys.stderr)
+
+
+def add_extract_arguments(parser):
+    parser.add_argument('urls', nargs='*', help='video, playlist or channel URLs')
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help="batch file (text, CSV or JSONL, optionally gzipped), or '-' for stdin")
+    parser.add_argument('--input-format', choices=('text', 'csv', 'jsonl'),
+                        help='batch file format (default: from the file extension)')
+    parser.add_argument('--url-column', default='url', help='column holding the URL in CSV/JSONL batch files')
+    parser.add_argument('-o', '--output-dir', help='output directory (default: <install>/data)')
+    parser.add_argument('--timestamp-subfolder', action='store_true',
+                        help='write into a new YYYYmmdd_HHMMSS subfolder of the output directory')
+    parser.add_argument('-f', '--format', default='csv', choices=OUTPUT_FORMATS, help='output format')
+    parser.add_argument('--per-url', action='store_true', help='legacy mode: one output file per video')
+    parser.add_argument('--fields', metavar='LIST',
+                        help="comma-separated fields and presets ('default', 'counts', 'all') to extract "
+                             "(extra fields include channel_id, comment_count and thumbnails)")
+    add_blobs_argument(parser)
+    parser.add_argument('-w', '--workers', type=int, default=4, help='concurrent extraction workers')
+    parser.add_argument('--transform-workers', type=int, default=1, help='threads building records')
+    parser.add_argument('--write-workers', type=int, default=1, help='threads writing records')
+    parser.add_argument('--queue-size', type=int, metavar='N',
+                        help='URLs waiting in front of each stage (default: twice its workers)')
+    parser.add_argument('--max-in-flight', type=int, metavar='N',
+                        help='URLs being processed at once across all stages (default: 4 per worker)')
+    parser.add_argument('--memory-limit', type=float, metavar='MB',
+                        help='hold back new fetches while resident memory is above this (Linux)')
+    parser.add_argument('--max-rps', type=float, default=0,
+                        help='maximum requests per second per host (0 = unlimited)')
+    parser.add_argument('--cache', metavar='PATH',
+                        help='metadata cache file (default: <install>/temp/metadata_cache.sqlite3)')
+    parser.add_argument('--cache-ttl', type=float, default=6 * 3600, help='cache freshness in seconds')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the metadata cache')
+    parser.add_argument('--force-refresh', action='store_true', help='ignore cached metadata')
+    parser.add_argument('--no-dedupe', action='store_true', help='fetch duplicate URLs again')
+    parser.add_argument('--playlist-limit', type=int, help='maximum videos taken from each playlist or channel')
+    parser.add_argument('--date-after', metavar='YYYYMMDD',
+                        help='skip playlist and channel videos uploaded before this date')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='record progress here and resume from it if the file already exists')
+    parser.add_argument('--max-retries', type=int, default=3,
+                        help='with --journal, how many runs may retry a failed URL')
+    parser.add_argument('--fetch-retries', type=int, default=3,
+                        help='retries of a transient or rate-limited failure within a run, with backoff')
+    parser.add_argument('--master', action='store_true',
+                        help='also upsert every record into the master dataset')
+    parser.add_argument('--master-dir', metavar='DIR', help='master dataset directory (default: <install>/master)')
+    parser.add_argument('--keep-history', action='store_true',
+                        help='with --master, keep superseded snapshots instead of only the latest')
+    parser.add_argument('--metrics', action='store_true',
+                        help='also record view/like counts in the metrics history')
+    parser.add_argument('--metrics-only', action='store_true',
+                        help='only record view/like counts; write no output file')
+    add_metrics_path_argument(parser)
+    parser.add_argument('--search-index', action='store_true',
+                        help='also add every record to the local search index')
+    add_search_path_argument(parser)
+    parser.add_argument('--archive', action='store_true',
+                        help="also keep yt-dlp's full info dict of every fetched video in the raw archive")
+    add_archive_dir_argument(parser)
+    parser.add_argument('--archive-exclude', metavar='KEYS',
+                        help="comma-separated info dict keys not to archive, e.g. 'formats,automatic_captions'")
+    parser.add_argument('--stats-json', metavar='PATH', help='write stage timings and counters here at the end')
+    parser.add_argument('--prometheus-file', metavar='PATH',
+                        help='write stage timings and counters here in Prometheus text format at the end')
+    parser.add_argument('--prometheus-port', type=int, metavar='PORT',
+                        help='serve live stage timings and counters at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--events', metavar='PATH',
+                        help="write one JSON event per finished URL to PATH ('-' for stderr)")
+    parser.add_argument('--shard', metavar='I/N',
+                        help='only process shard I of N (counted from 1), e.g. one machine of several')
+    parser.add_argument('--processes', type=int, default=1, metavar='N',
+                        help='split the batch into N shards run by N processes, then merge their output')
+    parser.add_argument('--keep-shards', action='store_true',
+                        help='with --processes, keep the per-shard output under <output>/shards')
+
+
+def build_metrics(args):
+    """Returns: (instrumentation.Metrics or None, events file to close or None)"""
+    if not (args.stats_json or args.prometheus_file or args.prometheus_port or args.events or args.verbose):
+        return None, None
+    import json
+    from instrumentation import JSONFileSink, Metrics, PrometheusFileSink
+
+    sinks = []
+    if args.stats_json:
+        sinks.append(JSONFileSink(args.stats_json))
+    if args.prometheus_file:
+        sinks.append(PrometheusFileSink(args.prometheus_file))
+    events_file = callbacks = None
+    if args.events:
+        events_file = sys.stderr if args.events == '-' else open(args.events, 'a', encoding='utf-8')
+        callbacks = [lambda event: events_file.write(json.dumps(event) + '\n')]
+    metrics = Metrics(sinks, callbacks)
+    if args.prometheus_port:
+        from instrumentation import serve_metrics
+        serve_metrics(metrics, args.prometheus_port)
+    return metrics, (events_file if events_file is not sys.stderr else None)
+
+
+def add_metrics_path_argument(parser):
+    parser.add_argument('--metrics-path', metavar='PATH',
+                        help='metrics history file (default: <install>/master/metrics.sqlite3)')
+
+
+def base_output_dir(args):
+    output_dir = args.output_dir or os.path.join(find_installation_dir(), 'data')
+    if args.timestamp_subfolder:
+        output_dir = os.path.join(output_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
+    return output_dir
+
+
+def add_blobs_argument(parser):
+    parser.add_argument('--blobs', nargs='?', const='paragraphs', choices=('paragraphs', 'whole'), metavar='MODE',
+                        help='store descriptions and tags once in <output>/blobs.sqlite3 and reference them '
+                             "from the output; descriptions are split into paragraphs unless MODE is 'whole'")
+
+
+def open_blob_store(args, output_dir):
+    """Returns: the blob_store.BlobStore in output_dir if --blobs was given, else None"""
+    if not args.blobs:
+        return None
+    from blob_store import BLOB_STORE_NAME, BlobStore
+    return BlobStore(os.path.join(output_dir, BLOB_STORE_NAME), chunk_paragraphs=args.blobs == 'paragraphs')
+
+
+def add_search_path_argument(parser):
+    parser.add_argument('--search-path', metavar='PATH',
+                        help='search index file (default: <install>/master/search.sqlite3)')
+
+
+def search_path(args):
+    return args.search_path or os.path.join(find_installation_dir(), 'master', 'search.sqlite3')
+
+
+def add_archive_dir_argument(parser):
+    parser.add_argument('--archive-dir', metavar='DIR', help='raw archive directory (default: <install>/archive)')
+
+
+def archive_dir(args):
+    return args.archive_dir or os.path.join(find_installation_dir(), 'archive')
+
+
+def watchlist_path(args):
+    return args.watchlist or os.path.join(find_installation_dir(), 'master', 'watchlist.sqlite3')
+
+
+def master_dir(args):
+    return args.master_dir or os.path.join(find_installation_dir(), 'master')
+
+
+def metrics_path(args):
+    return args.metrics_path or os.path.join(find_installation_dir(), 'master', 'metrics.sqlite3')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m yt_data_extractor',
+        description='Extract YouTube video metadata without the GUI.'
+    )
+    parser.add_argument('-v', '--verbose', action='store_true', help='print per-URL progress to stderr')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    extract = subparsers.add_parser('extract', help='extract metadata for URLs')
+    add_extract_arguments(extract)
+    extract.set_defaults(func=cmd_extract)
+
+    master = subparsers.add_parser('master', help='maintain the master dataset')
+    master.add_argument('action', choices=('compact', 'export', 'stats'),
+                        help='compact: merge run segments; export: write the current state of every video; '
+                             'stats: print dataset size')
+    master.add_argument('--master-dir', metavar='DIR', help='master dataset directory (default: <install>/master)')
+    master.add_argument('-o', '--output-dir', help='export directory (default: <install>/data)')
+    master.add_argument('-f', '--format', default='csv', choices=OUTPUT_FORMATS, help='export format')
+    master.set_defaults(func=cmd_master)
+
+    merge = subparsers.add_parser('merge', help='merge shard outputs into one de-duplicated file')
+    merge.add_argument('inputs', nargs='+', metavar='INPUT', help='shard output files or directories')
+    merge.add_argument('-o', '--output-dir', help='directory for the merged file (default: <install>/data)')
+    merge.add_argument('-f', '--format', default='csv', choices=OUTPUT_FORMATS, help='merged file format')
+    add_blobs_argument(merge)
+    merge.set_defaults(func=cmd_merge)
+
+    rederive = subparsers.add_parser('rederive', help='build records from the raw archive without fetching')
+    rederive.add_argument('-o', '--output-dir', help='output directory (default: <install>/data)')
+    rederive.add_argument('-f', '--format', default='csv', choices=OUTPUT_FORMATS, help='output format')
+    rederive.add_argument('--fields', metavar='LIST', help="comma-separated fields and presets, as for extract")
+    rederive.add_argument('-p', '--processes', type=int, metavar='N',
+                          help='segments read in parallel (default: one process per core)')
+    add_blobs_argument(rederive)
+    add_archive_dir_argument(rederive)
+    rederive.set_defaults(func=cmd_rederive)
+
+    serve = subparsers.add_parser('serve', help='answer metadata requests over local HTTP/JSON')
+    serve.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    serve.add_argument('--port', type=int, default=8765, help='port to listen on')
+    serve.add_argument('-c', '--concurrency', type=int, default=8, help='fetches running at once')
+    serve.add_argument('--memo-ttl', type=float, default=30, help='seconds a fetched record answers repeat requests')
+    serve.add_argument('--max-pending', type=int, default=256,
+                       help='requests allowed to wait; more are refused with 503')
+    serve.add_argument('--max-rps', type=float, default=0,
+                       help='maximum requests per second to YouTube (0 = unlimited)')
+    serve.add_argument('--fetch-retries', type=int, default=3,
+                       help='retries of a transient or rate-limited failure, with backoff')
+    serve.add_argument('--fields', metavar='LIST', help="comma-separated fields and presets, as for extract")
+    serve.add_argument('--cache', metavar='PATH',
+                       help='metadata cache file (default: <install>/temp/metadata_cache.sqlite3)')
+    serve.add_argument('--cache-ttl', type=float, default=6 * 3600, help='cache freshness in seconds')
+    serve.add_argument('--no-cache', action='store_true', help='do not use the metadata cache')
+    serve.set_defaults(func=cmd_serve)
+
+    search = subparsers.add_parser('search', help='find videos in the local search index')
+    search.add_argument('words', nargs='*', help="title/description words, all required; 'word*' matches a prefix")
+    search.add_argument('-t', '--tag', action='append', default=[], help='required tag (repeatable)')
+    search.add_argument('--category', help='exact category')
+    search.add_argument('--after', metavar='YYYYMMDD', help='uploaded on or after this date')
+    search.add_argument('--before', metavar='YYYYMMDD', help='uploaded on or before this date')
+    search.add_argument('--min-views', type=int, help='at least this many views')
+    search.add_argument('--max-views', type=int, help='at most this many views')
+    search.add_argument('--title-only', action='store_true', help='match words in titles only')
+    search.add_argument('--sort', choices=('views', 'likes', 'date', 'oldest'), default='views', help='result order')
+    search.add_argument('-n', '--limit', type=int, default=20, help='maximum results')
+    search.add_argument('--add', nargs='+', metavar='PATH',
+                        help="index output files or directories first ('master' for the master dataset)")
+    search.add_argument('--master-dir', metavar='DIR', help='master dataset directory (default: <install>/master)')
+    search.add_argument('--stats', action='store_true', help='print index size and the most used tags')
+    add_search_path_argument(search)
+    search.set_defaults(func=cmd_search)
+
+    metrics = subparsers.add_parser('metrics', help='query the view/like history')
+    metrics.add_argument('action', choices=('series', 'top', 'stats'),
+                         help="series: one video's snapshots; top: fastest-growing videos; stats: history size")
+    metrics.add_argument('video', nargs='?', help='video ID or URL (for series)')
+    metrics.add_argument('--days', type=float, default=7, help='window for top, in days back from now')
+    metrics.add_argument('-n', '--limit', type=int, default=10, help='number of videos for top')
+    metrics.add_argument('--metric', choices=('views', 'likes'), default='views', help='counter to rank by')
+    add_metrics_path_argument(metrics)
+    metrics.set_defaults(func=cmd_metrics)
+
+    watch = subparsers.add_parser('watch', help='keep a watch list of videos fresh, each at its own frequency')
+    watch.add_argument('action', choices=('add', 'remove', 'run', 'due', 'stats'),
+                       help='add/remove: change the list; run: refresh due videos until stopped; '
+                            'due: list the videos due now; stats: list size and budget used')
+    watch.add_argument('urls', nargs='*', help='video, playlist or channel URLs, or video IDs (for add/remove)')
+    watch.add_argument('-b', '--batch', metavar='FILE', help='batch file of URLs to add or remove')
+    watch.add_argument('--watchlist', metavar='PATH',
+                       help='watch list file (default: <install>/master/watchlist.sqlite3)')
+    watch.add_argument('--playlist-limit', type=int, help='maximum videos added from each playlist or channel')
+    watch.add_argument('--budget', type=int, default=1000, help='maximum videos refreshed per hour')
+    watch.add_argument('--poll-interval', type=float, default=60, help='seconds between scheduling cycles')
+    watch.add_argument('--once', action='store_true', help='run one scheduling cycle and exit')
+    watch.add_argument('-n', '--limit', type=int, default=20, help='videos listed by due')
+    watch.add_argument('-w', '--workers', type=int, default=4, help='concurrent extraction workers')
+    watch.add_argument('--max-rps', type=float, default=0,
+                       help='maximum requests per second per host (0 = unlimited)')
+    watch.add_argument('--fetch-retries', type=int, default=3,
+                       help='retries of a transient or rate-limited failure, with backoff')
+    watch.add_argument('-o', '--output-dir', help='output directory (default: <install>/data)')
+    watch.add_argument('-f', '--format', default='csv', choices=OUTPUT_FORMATS, help='output format')
+    watch.add_argument('--fields', metavar='LIST',
+                       help="comma-separated fields and presets, as for extract; the counts and upload "
+                            "date are always included")
+    watch.add_argument('--no-output', action='store_true', help='write no output file, only feed the other sinks')
+    watch.add_argument('--metrics', action='store_true', help='also record view/like counts in the metrics history')
+    add_metrics_path_argument(watch)
+    watch.add_argument('--master', action='store_true', help='also upsert every record into the master dataset')
+    watch.add_argument('--master-dir', metavar='DIR', help='master dataset directory (default: <install>/master)')
+    watch.add_argument('--cache', metavar='PATH',
+                       help='metadata cache file, updated with every refresh '
+                            '(default: <install>/temp/metadata_cache.sqlite3)')
+    watch.add_argument('--no-cache', action='store_true', help='do not update the metadata cache')
+    watch.set_defaults(func=cmd_watch)
+    return parser
+
+
+def cmd_extract(args):
+    from youtube_extractor import YouTubeExtractor
+    from metadata_cache import MetadataCache
+    from batch_input import BatchSource
+    from records import parse_fields
+
+    if not args.urls and not args.batch:
+        if sys.stdin.isatty():
+            print('error: give URLs, --batch FILE or pipe URLs on stdin', file=sys.stderr)
+            return 2
+        args.batch = '-'
+
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+
+    shard = None
+    if args.processes > 1:
+        return cmd_extract_sharded(args)
+    if args.shard:
+        from sharding import parse_shard
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"error: {str(e)}", file=sys.stderr)
+            return 2
+
+    base_dir = find_installation_dir()
+    output_dir = base_output_dir(args)
+    if not args.metrics_only:
+        os.makedirs(output_dir, exist_ok=True)
+
+    cache = None
+    if not args.no_cache:
+        cache_path = args.cache or os.path.join(base_dir, 'temp', 'metadata_cache.sqlite3')
+        cache = MetadataCache(cache_path, ttl=args.cache_ttl)
+
+    blob_store = open_blob_store(args, output_dir) if not args.metrics_only else None
+
+    master = None
+    if args.master:
+        from master_store import MasterStore
+        master = MasterStore(master_dir(args), keep_history=args.keep_history)
+
+    history = None
+    if args.metrics or args.metrics_only:
+        from metrics_history import MetricsHistory
+        history = MetricsHistory(metrics_path(args))
+    search = None
+    if args.search_index:
+        from search_index import SearchIndex
+        search = SearchIndex(search_path(args))
+    sinks = [sink for sink in (master, history, search) if sink is not None]
+    archive = None
+    if args.archive:
+        from raw_archive import RawArchive
+        exclude = [key.strip() for key in (args.archive_exclude or '').split(',') if key.strip()]
+        archive = RawArchive(archive_dir(args), exclude=exclude)
+
+    metrics, events_file = build_metrics(args)
+    progress = (lambda message: print(message, file=sys.stderr)) if args.verbose else None
+    extractor = YouTubeExtractor(
+        output_dir,
+        output_mode='none' if args.metrics_only else ('per_url' if args.per_url else 'batch'),
+        output_format=args.format,
+        cache=cache,
+        force_refresh=args.force_refresh,
+        dedupe=None if args.no_dedupe else 'auto',
+        playlist_limit=args.playlist_limit,
+        playlist_date_after=args.date_after,
+        journal_path=args.journal,
+        max_retries=args.max_retries,
+        sinks=sinks,
+        metrics=metrics,
+        fetch_retries=args.fetch_retries,
+        shard=shard,
+        fields=fields,
+        blob_store=blob_store,
+        archive=archive,
+    )
+
+    source = BatchSource(args.batch, args.input_format, args.url_column) if args.batch else None
+    processed = failed = 0
+    started = last_report = time.monotonic()
+    try:
+        urls = iter_input_urls(args, source)
+        if args.workers > 1:
+            results = (
+                (result.url, result.success)
+                for result in extractor.extract_concurrent(
+                    urls, args.workers, args.max_rps, progress, transform_workers=args.transform_workers,
+                    write_workers=args.write_workers, queue_size=args.queue_size,
+                    max_in_flight=args.max_in_flight, memory_limit_mb=args.memory_limit,
+                )
+            )
+        else:
+            results = extractor.extract_many(urls, progress)
+        for url, success in results:
+            processed += 1
+            if not success:
+                failed += 1
+            print(f"{'OK' if success else 'FAILED'}\t{url}", flush=True)
+            if args.verbose and source is not None and time.monotonic() - last_report >= 5:
+                last_report = time.monotonic()
+                report_progress(source, processed, last_report - started, extractor.pipeline_stats())
+    except ValueError as e:
+        # e.g. the journal's output file is gone, or the format cannot be resumed
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    finally:
+        extractor.close()
+        if cache is not None:
+            cache.close()
+        if blob_store is not None:
+            blob_store.close()
+        if archive is not None:
+            archive.close()
+        for sink in sinks:
+            sink.close()
+        if events_file is not None:
+            events_file.close()
+
+    print(
+        f"Processed {processed} URLs, {failed} failed, "
+        f"{extractor.duplicates_dropped()} duplicates skipped, "
+        f"{extractor.journal_skipped()} already done."
+        + ('' if args.metrics_only else f" Output: {output_dir}"),
+        file=sys.stderr
+    )
+    if history is not None:
+        print(f"Metrics history: {history.path}", file=sys.stderr)
+    if extractor.rate_summary():
+        print(extractor.rate_summary(), file=sys.stderr)
+    if blob_store is not None and blob_store.summary():
+        print(blob_store.summary(), file=sys.stderr)
+    if args.verbose and metrics is not None:
+        from instrumentation import stage_summary
+        snapshot = metrics.snapshot()
+        if snapshot['stages']:
+            print(f"Mean time per stage: {stage_summary(snapshot)}", file=sys.stderr)
+        if extractor.pipeline_stats():
+            from pipeline import pipeline_summary
+            print(f"Pipeline: {pipeline_summary(extractor.pipeline_stats())}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def shard_args(args, index, count, shard_root):
+    """Arguments for the process running shard index (from 0) of a --processes run."""
+    child = argparse.Namespace(**vars(args))
+    child.processes = 1
+    child.shard = f"{index + 1}/{count}"
+    child.output_dir = os.path.join(shard_root, f"shard-{index + 1}-of-{count}")
+    child.timestamp_subfolder = False
+    # The request budget and the memory limit are shared between the processes
+    child.max_rps = args.max_rps / count
+    if args.memory_limit:
+        child.memory_limit = args.memory_limit / count
+    for name in ('journal', 'stats_json', 'prometheus_file', 'events'):
+        value = getattr(args, name)
+        if value and value != '-':
+            root, extension = os.path.splitext(value)
+            setattr(child, name, f"{root}.shard{index + 1}{extension}")
+    if args.prometheus_port:
+        child.prometheus_port = args.prometheus_port + index
+    return child
+
+
+def run_shard(args):
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    try:
+        sys.exit(cmd_extract(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+def cmd_extract_sharded(args):
+    """
+    Run extract as args.processes shard processes, one per core, each writing its
+    own output under <output>/shards, then merge the shard outputs into one file.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+    from sharding import merge_outputs
+
+    if args.shard or args.per_url:
+        print('error: --processes cannot be combined with --shard or --per-url', file=sys.stderr)
+        return 2
+    output_dir = base_output_dir(args)
+    shard_root = os.path.join(output_dir, 'shards')
+    spool = None
+    if args.batch == '-':
+        # Every shard reads the whole input, so stdin is saved to a file first
+        fd, spool = tempfile.mkstemp(prefix='yt_batch_', suffix='.txt')
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(sys.stdin.buffer, f)
+        args.batch = spool
+
+    count = args.processes
+    # spawn behaves the same on every platform and does not fork the parent's threads
+    context = multiprocessing.get_context('spawn')
+    shard_specs = [shard_args(args, index, count, shard_root) for index in range(count)]
+    processes = [
+        context.Process(target=run_shard, args=(child,), name=f"shard-{index + 1}")
+        for index, child in enumerate(shard_specs)
+    ]
+    started = time.monotonic()
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        if spool is not None:
+            os.remove(spool)
+    exit_code = max(process.exitcode or 0 for process in processes)
+    print(f"{count} shards finished in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+    if args.metrics_only:
+        return exit_code
+    # Exit code 1 only means some URLs failed; anything else left a shard's output incomplete
+    broken = [process.name for process in processes if process.exitcode not in (0, 1)]
+    if broken:
+        print(f"error: {', '.join(broken)} did not finish; not merging. Shard outputs are kept in {shard_root}",
+              file=sys.stderr)
+        return exit_code
+    blob_store = open_blob_store(args, output_dir)
+    try:
+        path, records, duplicates = merge_outputs([shard_root], output_dir, args.format, blob_store)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return exit_code or 1
+    finally:
+        if blob_store is not None:
+            blob_store.close()
+    print(f"Merged {records} videos ({duplicates} duplicates dropped) into {path}", file=sys.stderr)
+    # A shard journal checkpoints into its shard's output, which a rerun resumes
+    journals = [child.journal for child in shard_specs if child.journal and os.path.exists(child.journal)]
+    if exit_code or journals:
+        print(f"Keeping {shard_root}: rerun the same command to resume the unfinished shards", file=sys.stderr)
+    elif not args.keep_shards:
+        shutil.rmtree(shard_root, ignore_errors=True)
+    return exit_code
+
+
+def cmd_merge(args):
+    from sharding import merge_outputs
+
+    output_dir = args.output_dir or os.path.join(find_installation_dir(), 'data')
+    blob_store = open_blob_store(args, output_dir)
+    try:
+        path, records, duplicates = merge_outputs(args.inputs, output_dir, args.format, blob_store)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    finally:
+        if blob_store is not None:
+            blob_store.close()
+    print(f"Merged {records} videos ({duplicates} duplicates dropped) into {path}", file=sys.stderr)
+    return 0
+
+
+def cmd_rederive(args):
+    from raw_archive import rederive
+    from records import parse_fields
+
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    output_dir = args.output_dir or os.path.join(find_installation_dir(), 'data')
+    progress = (lambda message: print(message, file=sys.stderr)) if args.verbose else None
+    blob_store = open_blob_store(args, output_dir)
+    started = time.monotonic()
+    try:
+        path, records, older = rederive(archive_dir(args), output_dir, fields, args.format,
+                                        args.processes, blob_store, progress)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    finally:
+        if blob_store is not None:
+            blob_store.close()
+    print(f"Derived {records} videos ({older} older snapshots dropped) in "
+          f"{time.monotonic() - started:.1f}s into {path}", file=sys.stderr)
+    return 0
+
+
+def cmd_serve(args):
+    import asyncio
+    from async_service import AsyncExtractor, MetadataServer
+    from metadata_cache import MetadataCache
+    from records import parse_fields
+    from youtube_extractor import YouTubeExtractor
+
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    cache = None
+    if not args.no_cache:
+        cache_path = args.cache or os.path.join(find_installation_dir(), 'temp', 'metadata_cache.sqlite3')
+        cache = MetadataCache(cache_path, ttl=args.cache_ttl)
+    extractor = YouTubeExtractor(None, output_mode='none', cache=cache, fields=fields,
+                                 fetch_retries=args.fetch_retries)
+    service = AsyncExtractor(extractor, args.concurrency, args.memo_ttl, max_rps=args.max_rps)
+    server = MetadataServer(service, args.host, args.port, args.max_pending)
+
+    async def run():
+        await server.start()
+        print(f"Serving on http://{server.host}:{server.port}/video?url=...", file=sys.stderr)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.close()
+        if cache is not None:
+            cache.close()
+        stats = service.stats()
+        print(f"Answered {stats['requests']} requests with {stats['fetches']} fetches "
+              f"({stats['coalesced']} shared an in-flight fetch, {stats['memo_hits']} memoised)", file=sys.stderr)
+    return 0
+
+
+def cmd_master(args):
+    from master_store import MasterStore
+
+    with MasterStore(master_dir(args)) as master:
+        if args.action == 'compact':
+            merged = master.compact()
+            print(f"Merged {merged} segments; {len(master)} videos in the master dataset", file=sys.stderr)
+        elif args.action == 'export':
+            from output_writers import create_writer
+            output_dir = args.output_dir or os.path.join(find_installation_dir(), 'data')
+            os.makedirs(output_dir, exist_ok=True)
+            writer = create_writer(output_dir, output_format=args.format)
+            count = 0
+            try:
+                for record in master.iter_current():
+                    writer.write(record)
+                    count += 1
+            finally:
+                writer.close()
+            print(f"Exported {count} videos to {writer.path or output_dir}", file=sys.stderr)
+        else:
+            print(f"{len(master)} videos in {master.master_dir}")
+    return 0
+
+
+def cmd_search(args):
+    from search_index import SearchIndex
+
+    with SearchIndex(search_path(args)) as index:
+        if args.add:
+            from output_writers import read_records
+            from sharding import find_output_files
+            count = 0
+            for path in args.add:
+                if path == 'master':
+                    from master_store import MasterStore
+                    with MasterStore(master_dir(args)) as master:
+                        for record in master.iter_current():
+                            index.add(record)
+                            count += 1
+                    continue
+                for output_file in find_output_files([path]):
+                    for record in read_records(output_file):
+                        index.add(record)
+                        count += 1
+            index.flush()
+            print(f"Indexed {count} records; {len(index)} videos in {index.path}", file=sys.stderr)
+        if args.stats:
+            stats = index.stats()
+            print(f"{stats['videos']} videos, {stats['postings']} postings in {index.path}")
+            for tag, videos in index.top_tags():
+                print(f"{videos}\t{tag}")
+        if not (args.words or args.tag or args.category or args.after or args.before
+                or args.min_views is not None or args.max_views is not None):
+            if not (args.add or args.stats):
+                print('error: give words, --tag or a filter to search for', file=sys.stderr)
+                return 2
+            return 0
+        started = time.perf_counter()
+        hits = index.search(args.words, args.tag, args.category, args.after, args.before,
+                            args.min_views, args.max_views, args.title_only, args.sort, args.limit)
+        elapsed = time.perf_counter() - started
+        print('video_id\tupload_date\tviews\ttitle')
+        for hit in hits:
+            print(f"{hit.video_id}\t{hit.upload_date}\t{hit.view_count}\t{hit.title}")
+        if args.verbose:
+            print(f"{len(hits)} results in {elapsed * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+def cmd_metrics(args):
+    from metrics_history import MetricsHistory
+    from url_utils import video_id_from_url
+
+    with MetricsHistory(metrics_path(args)) as history:
+        if args.action == 'series':
+            if not args.video:
+                print('error: series needs a video ID or URL', file=sys.stderr)
+                return 2
+            video_id = video_id_from_url(args.video) or args.video
+            print('timestamp\tviews\tlikes')
+            for point in history.series(video_id):
+                when = datetime.fromtimestamp(point.ts).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"{when}\t{point.views}\t{point.likes}")
+        elif args.action == 'top':
+            start = time.time() - args.days * 86400
+            print("video_id\tfirst\tlast\tgrowth\tper_day")
+            for row in history.top_growth(start, limit=args.limit, metric=args.metric):
+                print(f"{row.video_id}\t{row.first}\t{row.last}\t{row.growth}\t{row.per_day:.0f}")
+        else:
+            stats = history.stats()
+            print(f"{stats['snapshots']} snapshots of {stats['videos']} videos in {history.path}")
+    return 0
+
+
+def watch_targets(args):
+    """URLs given to watch add/remove: the command line, then the batch file."""
+    from batch_input import BatchSource
+    yield from args.urls
+    if args.batch:
+        yield from BatchSource(args.batch)
+
+
+def cmd_watch(args):
+    from url_utils import is_collection_url, video_id_from_url
+    from watchlist import Watchlist
+
+    with Watchlist(watchlist_path(args)) as watchlist:
+        if args.action == 'add':
+            if not args.urls and not args.batch:
+                print('error: add needs URLs or --batch FILE', file=sys.stderr)
+                return 2
+            from youtube_extractor import YouTubeExtractor
+            expander = YouTubeExtractor(None, output_mode='none')
+
+            def videos():
+                for url in watch_targets(args):
+                    if not is_collection_url(url):
+                        yield url
+                        continue
+                    try:
+                        yield from expander.expand_url(url, args.playlist_limit)
+                    except Exception as e:
+                        logging.error(f"Error expanding {url}: {str(e)}")
+
+            added, skipped = watchlist.add(videos())
+            print(f"Added {added} videos ({skipped} URLs skipped); watching {len(watchlist)}", file=sys.stderr)
+        elif args.action == 'remove':
+            removed = watchlist.remove(video_id_from_url(url) or url for url in watch_targets(args))
+            print(f"Removed {removed} videos; watching {len(watchlist)}", file=sys.stderr)
+        elif args.action == 'due':
+            print('video_id\tlast_scrape\tinterval_hours\tpriority')
+            for entry in watchlist.due(args.limit):
+                when = (datetime.fromtimestamp(entry.last_scrape_ts).strftime('%Y-%m-%d %H:%M:%S')
+                        if entry.last_scrape_ts else 'never')
+                interval = f"{entry.interval / 3600:.1f}" if entry.interval else ''
+                priority = f"{entry.priority:.2f}" if entry.priority is not None else 'new'
+                print(f"{entry.video_id}\t{when}\t{interval}\t{priority}")
+        elif args.action == 'stats':
+            stats = watchlist.stats()
+            print(f"Watching {stats['watched']} videos ({stats['dropped']} dropped as unavailable), "
+                  f"{stats['due']} due now, {stats['spent_last_hour']} refreshed in the last hour")
+        else:
+            return run_watch(args, watchlist)
+    return 0
+
+
+def run_watch(args, watchlist):
+    from metadata_cache import MetadataCache
+    import signal
+    from records import parse_fields
+    from run_control import RunControl
+    from watchlist import WatchScheduler
+    from youtube_extractor import YouTubeExtractor
+
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"error: {str(e)}", file=sys.stderr)
+        return 2
+    # The schedule is driven by these
+    fields = parse_fields(list(fields) + ['upload_date', 'view_count', 'like_count'])
+    output_dir = args.output_dir or os.path.join(find_installation_dir(), 'data')
+    if not args.no_output:
+        os.makedirs(output_dir, exist_ok=True)
+    cache = None
+    if not args.no_cache:
+        cache = MetadataCache(args.cache or os.path.join(find_installation_dir(), 'temp', 'metadata_cache.sqlite3'))
+    sinks = [watchlist]
+    if args.metrics:
+        from metrics_history import MetricsHistory
+        sinks.append(MetricsHistory(metrics_path(args)))
+    if args.master:
+        from master_store import MasterStore
+        sinks.append(MasterStore(master_dir(args)))
+    extractor = YouTubeExtractor(
+        output_dir,
+        output_mode='none' if args.no_output else 'batch',
+        output_format=args.format,
+        cache=cache,
+        # Refreshes always go to the network; the cache only receives the result
+        force_refresh=True,
+        sinks=sinks,
+        fetch_retries=args.fetch_retries,
+        fields=fields,
+    )
+    scheduler = WatchScheduler(watchlist, extractor, args.budget, args.poll_interval, args.workers, args.max_rps)
+    progress = (lambda message: print(message, file=sys.stderr)) if args.verbose else None
+    # A service manager's SIGTERM stops the loop after the current cycle
+    control = RunControl()
+    signal.signal(signal.SIGTERM, lambda signum, frame: control.cancel())
+    print(f"Watching {len(watchlist)} videos, at most {args.budget} refreshes per hour", file=sys.stderr)
+    try:
+        scheduler.run(progress, control, max_cycles=1 if args.once else None)
+    finally:
+        extractor.close()
+        if cache is not None:
+            cache.close()
+        for sink in sinks[1:]:
+            sink.close()
+        print(f"Refreshed {scheduler.refreshed} videos, {scheduler.failed} failed", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        print('\nCancelled by user.', file=sys.stderr)
+        return 130
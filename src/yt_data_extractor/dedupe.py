@@ -0,0 +1,88 @@
+import hashlib
+import math
+
+from url_utils import canonical_url
+
+
+class BloomFilter:
+    """
+    Fixed-size probabilistic set. add() returns False for keys that are
+    definitely new; a previously unseen key is wrongly reported as present
+    with probability about `error_rate` once `capacity` keys have been added.
+    """
+    def __init__(self, capacity, error_rate=1e-6):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        """Add key. Returns: True if key was (probably) already present"""
+        present = True
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                present = False
+                self._bits[byte] |= 1 << bit
+        return present
+
+
+class Deduplicator:
+    """
+    Drops URLs whose canonical form has already been seen in this run.
+    Keys are kept in an exact hash set until there are more than `max_exact`
+    of them, after which they move into a Bloom filter sized for
+    `expected_items`, so memory stays bounded on multi-million-line inputs.
+    mode: 'auto' (the above), 'memory' (always exact) or 'bloom' (always Bloom)
+    """
+    def __init__(self, mode='auto', max_exact=1000000, expected_items=20000000, error_rate=1e-5):
+        if mode not in ('auto', 'memory', 'bloom'):
+            raise ValueError(f"Unknown de-duplication mode: {mode}")
+        self.mode = mode
+        self.max_exact = max_exact
+        self.expected_items = expected_items
+        self.error_rate = error_rate
+        self.seen = 0
+        self.dropped = 0
+        self._exact = set()
+        self._bloom = BloomFilter(expected_items, error_rate) if mode == 'bloom' else None
+
+    def is_duplicate(self, url):
+        """Record url. Returns: True if an equivalent URL was seen before"""
+        return self._check(canonical_url(url))
+
+    def _check(self, key):
+        self.seen += 1
+        if self._bloom is not None:
+            duplicate = self._bloom.add(key)
+        else:
+            duplicate = key in self._exact
+            if not duplicate:
+                self._exact.add(key)
+                if self.mode == 'auto' and len(self._exact) > self.max_exact:
+                    self._spill_to_bloom()
+        if duplicate:
+            self.dropped += 1
+        return duplicate
+
+    def _spill_to_bloom(self):
+        self._bloom = BloomFilter(self.expected_items, self.error_rate)
+        for key in self._exact:
+            self._bloom.add(key)
+        self._exact = set()
+
+    def filter(self, items):
+        """
+        Yield the (index, url) items whose URL is not equivalent to an earlier
+        one. The canonical form is only the key; the URL is passed on as given.
+        """
+        for index, url in items:
+            if not self._check(canonical_url(url)):
+                yield index, url
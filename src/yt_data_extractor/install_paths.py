@@ -0,0 +1,21 @@
+import logging
+import os
+
+
+def find_installation_dir():
+    """Find the installation directory by looking for the 'data' folder"""
+    try:
+        # First check if we're in the installation directory
+        if os.path.exists('data'):
+            return os.getcwd()
+
+        # Check parent directory
+        parent = os.path.dirname(os.getcwd())
+        if os.path.exists(os.path.join(parent, 'data')):
+            return parent
+
+        # If not found, use current directory
+        return os.getcwd()
+    except Exception as e:
+        logging.error(f"Error finding installation directory: {e}")
+        return os.getcwd()
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stages of one URL, in the order _extract runs them. 'fetch' is a single
+# yt-dlp extract_info call, which does the network request and the parsing
+# together, so the two cannot be timed apart.
+STAGES = ('cache_lookup', 'rate_wait', 'fetch', 'backoff', 'archive', 'build', 'cache_store', 'write', 'sinks')
+
+# Prometheus label name for counters that are split by a label
+COUNTER_LABELS = {'failures': 'error', 'failure_kinds': 'kind', 'stage_stall_seconds': 'stage',
+                  'stage_idle_seconds': 'stage', 'sink_errors': 'sink'}
+
+PROMETHEUS_PREFIX = 'yt_extractor'
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Metrics that record nothing; the extractor's default, so instrumentation costs almost nothing when off."""
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+    def observe(self, stage, seconds):
+        pass
+
+    def incr(self, name, value=1, label=None):
+        pass
+
+    def event(self, name, **fields):
+        pass
+
+    def snapshot(self):
+        return {'started': None, 'elapsed': 0.0, 'counters': {}, 'stages': {}}
+
+    def export(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    """
+    Thread-safe per-stage timers and counters for extraction runs.
+
+    timer(stage) times a block; incr(name, value, label) bumps a counter,
+    optionally split by one label (e.g. failures by exception type).
+    event(name, **fields) passes a structured event dict to every callback,
+    as a structured alternative to the free-text progress_callback.
+    export() hands a snapshot to every sink (see MemorySink, JSONFileSink,
+    PrometheusFileSink); the extractor calls it at the end of each run.
+    """
+    enabled = True
+
+    def __init__(self, sinks=None, event_callbacks=None):
+        self.sinks = list(sinks or [])
+        self.event_callbacks = list(event_callbacks or [])
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # Callbacks run one at a time, so they need not be thread-safe themselves
+        self._event_lock = threading.Lock()
+        # stage -> [count, total seconds, max seconds]
+        self._stages = {}
+        # name -> {label or None: value}
+        self._counters = {}
+
+    def timer(self, stage):
+        return _StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def incr(self, name, value=1, label=None):
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[label] = counter.get(label, 0) + value
+
+    def event(self, name, **fields):
+        if not self.event_callbacks:
+            return
+        fields['event'] = name
+        fields['time'] = time.time()
+        with self._event_lock:
+            for callback in self.event_callbacks:
+                try:
+                    callback(fields)
+                except Exception as e:
+                    logging.error(f"Error in metrics event callback: {str(e)}")
+
+    def counter(self, name, label=None):
+        with self._lock:
+            return self._counters.get(name, {}).get(label, 0)
+
+    def snapshot(self):
+        """
+        Returns: {'started', 'elapsed', 'counters': {name: value or {label: value}},
+                  'stages': {stage: {'count', 'total_seconds', 'mean_ms', 'max_ms'}}}
+        """
+        with self._lock:
+            counters = {}
+            for name, values in self._counters.items():
+                if list(values) == [None]:
+                    counters[name] = values[None]
+                else:
+                    counters[name] = {str(label): value for label, value in values.items()}
+            stages = {
+                stage: {
+                    'count': count,
+                    'total_seconds': round(total, 6),
+                    'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+                    'max_ms': round(longest * 1000, 3),
+                }
+                for stage, (count, total, longest) in self._stages.items()
+            }
+        return {
+            'started': self.started,
+            'elapsed': round(time.time() - self.started, 3),
+            'counters': counters,
+            'stages': stages,
+        }
+
+    def export(self):
+        """Hand the current snapshot to every sink."""
+        if not self.sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            try:
+                sink.export(snapshot)
+            except Exception as e:
+                logging.error(f"Error exporting metrics: {str(e)}")
+
+
+def stage_summary(snapshot):
+    """One line of mean time per stage, in pipeline order, e.g. for the end-of-run summary."""
+    stages = snapshot['stages']
+    order = [stage for stage in STAGES if stage in stages] + sorted(set(stages) - set(STAGES))
+    return ', '.join(f"{stage} {stages[stage]['mean_ms']:.1f} ms" for stage in order)
+
+
+def prometheus_text(snapshot, prefix=PROMETHEUS_PREFIX):
+    """Render a Metrics snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        metric = f"{prefix}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        if isinstance(value, dict):
+            label = COUNTER_LABELS.get(name, 'label')
+            for label_value, count in sorted(value.items()):
+                escaped = label_value.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{metric}{{{label}="{escaped}"}} {count}')
+        else:
+            lines.append(f"{metric} {value}")
+    if snapshot['stages']:
+        metric = f"{prefix}_stage_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append(f"# TYPE {metric}_max gauge")
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f'{metric}_max{{stage="{stage}"}} {round(stats["max_ms"] / 1000, 6)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomically(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class MemorySink:
+    """Keeps every exported snapshot in memory; handy for the GUI and the Python API."""
+    def __init__(self):
+        self.snapshots = []
+
+    @property
+    def latest(self):
+        return self.snapshots[-1] if self.snapshots else None
+
+    def export(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+class JSONFileSink:
+    """Writes the latest snapshot to a JSON stats file."""
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, snapshot):
+        _write_atomically(self.path, json.dumps(snapshot, indent=2))
+
+
+class PrometheusFileSink:
+    """Writes the latest snapshot as a Prometheus text file, e.g. for node_exporter's textfile collector."""
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, snapshot):
+        _write_atomically(self.path, prometheus_text(snapshot))
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """
+    Serve live metrics in Prometheus format at http://host:port/metrics on a
+    daemon thread. Returns: the server; call shutdown() on it to stop
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = prometheus_text(metrics.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-http').start()
+    return server
@@ -1,10 +1,77 @@
 import PySimpleGUI as sg
+import hashlib
 import os
 import sys
+import threading
+import time
+from collections import deque
 from pathlib import Path
 from youtube_extractor import YouTubeExtractor
+from batch_input import BatchSource
+from output_writers import RESUMABLE_FORMATS, available_formats
+from blob_store import BLOB_STORE_NAME, BlobStore
+from records import DEFAULT_FIELDS, FIELDS
+from metadata_cache import MetadataCache
+from master_store import MasterStore
+from metrics_history import MetricsHistory
+from search_index import SearchIndex
+from raw_archive import RawArchive
+from install_paths import find_installation_dir
+from run_control import RunControl
+from instrumentation import JSONFileSink, Metrics, stage_summary
 import logging
 
+# Events posted by the background batch thread
+PROGRESS_EVENT = '-JOB_PROGRESS-'
+DONE_EVENT = '-JOB_DONE-'
+
+# How often queued progress is pushed into the window, and how many lines the
+# progress log keeps
+REFRESH_INTERVAL = 0.2
+MAX_LOG_LINES = 500
+
+
+class ProgressRelay:
+    """
+    Collects progress from worker threads and hands it to the GUI event loop.
+    Messages are queued and the window is woken with write_event_value at most
+    once per REFRESH_INTERVAL, so a fast batch cannot flood the event loop.
+    Only the newest MAX_LOG_LINES pending messages are kept.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.done = 0
+        self.fraction = None
+        self.eta = None
+        self._pending = deque(maxlen=MAX_LOG_LINES)
+        self._lock = threading.Lock()
+        self._last_notify = 0.0
+
+    def post(self, message):
+        with self._lock:
+            self._pending.append(message)
+        self._notify()
+
+    def set_progress(self, done, fraction=None, eta=None):
+        """Record URLs done, fraction of the input consumed (0..1) and seconds left."""
+        with self._lock:
+            self.done, self.fraction, self.eta = done, fraction, eta
+        self._notify()
+
+    def _notify(self):
+        now = time.monotonic()
+        if now - self._last_notify >= REFRESH_INTERVAL:
+            self._last_notify = now
+            self.window.write_event_value(PROGRESS_EVENT, None)
+
+    def drain(self):
+        """Returns: (queued messages, done, fraction, eta)"""
+        with self._lock:
+            messages = list(self._pending)
+            self._pending.clear()
+            return messages, self.done, self.fraction, self.eta
+
+
 class YouTubeToolGUI:
     def __init__(self):
         sg.theme('DarkBlue3')
@@ -12,6 +79,21 @@ class YouTubeToolGUI:
         # Get the installation directory
         self.base_dir = self._get_installation_dir()
         self.default_output = os.path.join(self.base_dir, 'data') if self.base_dir else None
+        self.cache_path = os.path.join(self.base_dir, 'temp', 'metadata_cache.sqlite3')
+        self.cache = None
+        self.master_path = os.path.join(self.base_dir, 'master')
+        self.master = None
+        self.metrics_path = os.path.join(self.base_dir, 'master', 'metrics.sqlite3')
+        self.metrics = None
+        self.search_path = os.path.join(self.base_dir, 'master', 'search.sqlite3')
+        self.search = None
+        self.archive_path = os.path.join(self.base_dir, 'archive')
+        self.archive = None
+        # State of the background job, if one is running
+        self.job_thread = None
+        self.control = None
+        self.relay = None
+        self.log_lines = deque(maxlen=MAX_LOG_LINES)
 
         self.layout = [
             [sg.Text('YouTube Metadata Extractor', font=('Helvetica', 16), justification='center')],
@@ -22,7 +104,16 @@ class YouTubeToolGUI:
                 [sg.Input(key='-URL-', size=(60, 1))],
                 [sg.Text('OR')],
                 [sg.Text('Batch File:')],
-                [sg.Input(key='-BATCH-', size=(52, 1)), sg.FileBrowse(file_types=(("Text Files", "*.txt"),))]
+                [sg.Input(key='-BATCH-', size=(52, 1)),
+                 sg.FileBrowse(file_types=(("Batch Files", "*.txt *.csv *.jsonl *.gz"), ("All Files", "*.*")))],
+                [sg.Text('URL column (CSV/JSONL batch files):'), sg.Input('url', key='-URL_COLUMN-', size=(12, 1))],
+                [sg.Text('Workers:'), sg.Spin(list(range(1, 33)), initial_value=4, key='-WORKERS-', size=(4, 1)),
+                 sg.Text('Max requests/sec (0 = unlimited):'), sg.Input('0', key='-RPS-', size=(6, 1))],
+                [sg.Text('Max videos per playlist/channel (0 = all):'), sg.Input('0', key='-PLAYLIST_LIMIT-', size=(8, 1)),
+                 sg.Text('Only uploads after (YYYYMMDD):'), sg.Input('', key='-DATE_AFTER-', size=(10, 1))],
+                [sg.Checkbox('Use metadata cache', key='-CACHE-', default=True),
+                 sg.Checkbox('Force refresh', key='-REFRESH-', default=False),
+                 sg.Checkbox('Resume interrupted batches', key='-RESUME-', default=True)]
             ])],
             
             # Output Directory Section
@@ -30,64 +121,246 @@ class YouTubeToolGUI:
                 [sg.Text('Select output directory:')],
                 [sg.Input(default_text=self.default_output, key='-OUTPUT-', size=(52, 1)), 
                  sg.FolderBrowse(initial_folder=self.default_output)],
-                [sg.Checkbox('Create timestamp subfolder', key='-TIMESTAMP-', default=True)]
+                [sg.Checkbox('Create timestamp subfolder', key='-TIMESTAMP-', default=True)],
+                [sg.Text('Format:'), sg.Combo(available_formats(), default_value='csv', key='-FORMAT-', readonly=True),
+                 sg.Checkbox('One file per URL (legacy)', key='-PER_URL-', default=False)],
+                [sg.Checkbox('Store each description and tag list once (blobs.sqlite3)', key='-BLOBS-', default=False)],
+                [sg.Text('Fields (video_id and scrape_timestamp are always kept):')],
+                [sg.Listbox(list(FIELDS), default_values=list(DEFAULT_FIELDS), key='-FIELDS-', size=(30, 6),
+                            select_mode=sg.LISTBOX_SELECT_MODE_MULTIPLE)],
+                [sg.Checkbox('Update master dataset', key='-MASTER-', default=True),
+                 sg.Checkbox('Record view/like history', key='-METRICS-', default=False),
+                 sg.Checkbox('History only (no output file)', key='-METRICS_ONLY-', default=False)],
+                [sg.Checkbox('Update search index', key='-SEARCH-', default=False),
+                 sg.Checkbox('Archive raw yt-dlp data', key='-ARCHIVE-', default=False)]
             ])],
             
             # Progress Section
             [sg.Frame('Progress', [
                 [sg.Multiline(size=(70, 10), key='-PROGRESS-', autoscroll=True, reroute_stdout=True)],
-                [sg.ProgressBar(100, orientation='h', size=(50, 20), key='-PBAR-')]
+                [sg.ProgressBar(100, orientation='h', size=(50, 20), key='-PBAR-')],
+                [sg.Text('', key='-STATUS-', size=(60, 1))]
             ])],
             
             # Control Buttons
             [sg.Button('Process Single URL', size=(15, 1)),
              sg.Button('Process Batch', size=(15, 1)),
-             sg.Button('Clear', size=(15, 1)),
-             sg.Button('Exit', size=(15, 1))]
+             sg.Button('Pause', size=(8, 1), disabled=True),
+             sg.Button('Cancel', size=(8, 1), disabled=True),
+             sg.Button('Clear', size=(8, 1)),
+             sg.Button('Exit', size=(8, 1))]
         ]
         
         self.window = sg.Window('YouTube Metadata Extractor', self.layout, finalize=True)
 
     def _get_installation_dir(self):
         """Find the installation directory by looking for the 'data' folder"""
-        try:
-            # First check if we're in the installation directory
-            if os.path.exists('data'):
-                return os.getcwd()
-            
-            # Check parent directory
-            parent = os.path.dirname(os.getcwd())
-            if os.path.exists(os.path.join(parent, 'data')):
-                return parent
-            
-            # If not found, use current directory
-            return os.getcwd()
-        except Exception as e:
-            logging.error(f"Error finding installation directory: {e}")
-            return os.getcwd()
+        return find_installation_dir()
+
+    def journal_path(self, batch_file):
+        """Journal for a batch file, so re-running the same file resumes it."""
+        batch_file = os.path.abspath(batch_file)
+        digest = hashlib.sha1(batch_file.encode('utf-8')).hexdigest()[:8]
+        name = os.path.splitext(os.path.basename(batch_file))[0]
+        return os.path.join(self.base_dir, 'temp', 'journals', f"{name}-{digest}.journal")
+
+    def get_cache(self):
+        """Open the metadata cache in the installation's temp directory on first use."""
+        if self.cache is None:
+            self.cache = MetadataCache(self.cache_path)
+        return self.cache
+
+    def get_master(self):
+        """Open the master dataset in the installation's master directory on first use."""
+        if self.master is None:
+            self.master = MasterStore(self.master_path)
+        return self.master
+
+    def attach_blob_store(self, extractor, enabled):
+        """Give the extractor a blob store in its output directory; job_worker closes it."""
+        if enabled and extractor.output_mode != 'none':
+            extractor.blob_store = BlobStore(os.path.join(extractor.output_dir, BLOB_STORE_NAME))
+
+    def get_metrics(self):
+        """Open the view/like history in the installation's master directory on first use."""
+        if self.metrics is None:
+            self.metrics = MetricsHistory(self.metrics_path)
+        return self.metrics
+
+    def get_search(self):
+        """Open the search index in the installation's master directory on first use."""
+        if self.search is None:
+            self.search = SearchIndex(self.search_path)
+        return self.search
+
+    def get_archive(self):
+        """Open the raw archive in the installation's archive directory on first use."""
+        if self.archive is None:
+            self.archive = RawArchive(self.archive_path)
+        return self.archive
+
+    def new_metrics(self):
+        """Metrics for one job; the stats of the last job are kept in logs/last_run_stats.json."""
+        return Metrics(sinks=[JSONFileSink(os.path.join(self.base_dir, 'logs', 'last_run_stats.json'))])
 
     def update_progress(self, message):
-        self.window['-PROGRESS-'].print(message)
-        
-    def process_url(self, url, extractor):
-        self.update_progress(f"\nProcessing URL: {url}")
-        success = extractor.extract_metadata(url, self.update_progress)
+        """Queue a progress message; safe to call from any thread."""
+        if self.relay is not None:
+            self.relay.post(message)
+        else:
+            self.append_log([message])
+
+    def append_log(self, messages):
+        self.log_lines.extend(messages)
+        self.window['-PROGRESS-'].update('\n'.join(self.log_lines))
+
+    def refresh_progress(self):
+        """Move queued progress from the background job into the window."""
+        if self.relay is None:
+            return
+        messages, done, fraction, eta = self.relay.drain()
+        if messages:
+            self.append_log(messages)
+        status = f"{done} URLs done"
+        if fraction is not None:
+            self.window['-PBAR-'].update(current_count=int(fraction * 100))
+            status += f", {fraction * 100:.1f}% of input read"
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            status += f", about {minutes}m {seconds:02d}s left"
+        self.window['-STATUS-'].update(status)
+
+    def report_result(self, url, success):
         if success:
             self.update_progress(f"Successfully processed: {url}")
         else:
             self.update_progress(f"Failed to process: {url}")
-        return success
-            
+
+    def run_batch(self, urls, extractor, workers, max_rps):
+        """Run a batch and yield (url, success) as each URL finishes."""
+        if workers <= 1:
+            # One YoutubeDL session is reused for the whole batch
+            yield from extractor.extract_many(urls, self.update_progress, self.control)
+            return
+        for result in extractor.extract_concurrent(urls, workers, max_rps, self.update_progress, self.control):
+            yield result.url, result.success
+        for worker, stats in extractor.worker_utilisation().items():
+            self.update_progress(
+                f"{worker}: {stats['items']} URLs, {stats['utilisation'] * 100:.0f}% busy"
+            )
+
+    def start_job(self, extractor, urls=None, batch_file=None, workers=1, max_rps=0, url_column='url'):
+        """Run a single URL or a batch file on a background thread."""
+        self.control = RunControl()
+        self.relay = ProgressRelay(self.window)
+        self.job_thread = threading.Thread(
+            target=self.job_worker, args=(extractor, urls, batch_file, workers, max_rps, url_column), daemon=True
+        )
+        self.set_running(True)
+        self.job_thread.start()
+
+    def job_worker(self, extractor, urls, batch_file, workers, max_rps, url_column):
+        summary = []
+        started = time.monotonic()
+        try:
+            # Batch files are streamed; progress comes from the read position
+            source = BatchSource(batch_file, url_column=url_column) if batch_file else None
+            self.relay.set_progress(0, 0.0)
+            results = self.run_batch(source if source else urls, extractor, workers, max_rps)
+            for i, (url, success) in enumerate(results, 1):
+                self.report_result(url, success)
+                if source:
+                    self.relay.set_progress(i, source.progress(), source.eta(time.monotonic() - started))
+                else:
+                    self.relay.set_progress(i, i / len(urls))
+            if self.control.cancelled:
+                summary.append("Batch cancelled")
+            if extractor.journal_skipped():
+                summary.append(f"Skipped {extractor.journal_skipped()} URLs finished by an earlier run")
+            summary.append(f"Skipped {extractor.duplicates_dropped()} duplicate URLs")
+            if extractor.rate_summary():
+                summary.append(extractor.rate_summary())
+            if extractor.journal is not None and extractor.journal.permanent_failures():
+                summary.append(f"{extractor.journal.permanent_failures()} URLs failed permanently and will not be retried")
+            if extractor.blob_store is not None and extractor.blob_store.summary():
+                summary.append(extractor.blob_store.summary())
+            if extractor.cache is not None:
+                stats = extractor.cache.stats()
+                summary.append(f"Cache: {stats['hits']} hits, {stats['misses']} misses")
+            snapshot = extractor.metrics.snapshot()
+            if snapshot['stages']:
+                summary.append(f"Mean time per stage: {stage_summary(snapshot)}")
+        except Exception as e:
+            summary.append(f"Error processing batch: {str(e)}")
+            logging.exception("Error processing batch")
+        finally:
+            extractor.close()
+            if extractor.blob_store is not None:
+                extractor.blob_store.close()
+            self.window.write_event_value(DONE_EVENT, summary)
+
+    def finish_job(self, summary):
+        self.refresh_progress()
+        self.append_log(summary)
+        self.job_thread.join()
+        if self.master is not None:
+            self.master.flush()
+            # Merge the segments of earlier sessions without blocking the window
+            self.master.compact_in_background()
+        if self.metrics is not None:
+            self.metrics.flush()
+        if self.search is not None:
+            self.search.flush()
+        if self.archive is not None:
+            self.archive.flush()
+        self.job_thread = None
+        self.control = None
+        self.relay = None
+        self.set_running(False)
+
+    def set_running(self, running):
+        for key in ('Process Single URL', 'Process Batch', 'Clear'):
+            self.window[key].update(disabled=running)
+        self.window['Pause'].update('Pause', disabled=not running)
+        self.window['Cancel'].update(disabled=not running)
+
     def run(self):
         while True:
-            event, values = self.window.read()
+            # Poll while a job runs so the last queued messages are never left behind
+            timeout = int(REFRESH_INTERVAL * 1000) if self.job_thread else None
+            event, values = self.window.read(timeout=timeout)
             
             if event in (sg.WIN_CLOSED, 'Exit'):
                 break
+
+            if event in (PROGRESS_EVENT, sg.TIMEOUT_KEY):
+                self.refresh_progress()
+                continue
+
+            if event == DONE_EVENT:
+                self.finish_job(values[DONE_EVENT])
+                continue
+
+            if event == 'Pause' and self.control is not None:
+                if self.control.paused:
+                    self.control.resume()
+                    self.window['Pause'].update('Pause')
+                    self.update_progress("Resumed")
+                else:
+                    self.control.pause()
+                    self.window['Pause'].update('Resume')
+                    self.update_progress("Paused")
+                continue
+
+            if event == 'Cancel' and self.control is not None:
+                self.control.cancel()
+                self.update_progress("Cancelling after the URLs in progress finish...")
+                continue
                 
             if event == 'Clear':
                 self.window['-URL-'].update('')
                 self.window['-BATCH-'].update('')
+                self.log_lines.clear()
                 self.window['-PROGRESS-'].update('')
                 continue
                 
@@ -110,7 +383,33 @@ class YouTubeToolGUI:
                 output_dir = os.path.join(output_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
                 os.makedirs(output_dir, exist_ok=True)
                 
-            extractor = YouTubeExtractor(output_dir)
+            output_mode = 'per_url' if values['-PER_URL-'] else 'batch'
+            if values['-METRICS_ONLY-']:
+                output_mode = 'none'
+            try:
+                playlist_limit = int(values['-PLAYLIST_LIMIT-'] or 0) or None
+            except ValueError:
+                sg.popup_error('Max videos per playlist must be a number')
+                continue
+            date_after = values['-DATE_AFTER-'].strip() or None
+            if date_after and not (len(date_after) == 8 and date_after.isdigit()):
+                sg.popup_error('Upload date must be in YYYYMMDD format')
+                continue
+
+            cache = self.get_cache() if values['-CACHE-'] else None
+            sinks = []
+            if values['-MASTER-']:
+                sinks.append(self.get_master())
+            if values['-METRICS-'] or values['-METRICS_ONLY-']:
+                sinks.append(self.get_metrics())
+            if values['-SEARCH-']:
+                sinks.append(self.get_search())
+            extractor = YouTubeExtractor(output_dir, output_mode=output_mode, output_format=values['-FORMAT-'],
+                                         cache=cache, force_refresh=values['-REFRESH-'],
+                                         playlist_limit=playlist_limit, playlist_date_after=date_after,
+                                         sinks=sinks, metrics=self.new_metrics(),
+                                         fields=values['-FIELDS-'] or None,
+                                         archive=self.get_archive() if values['-ARCHIVE-'] else None)
             
             if event == 'Process Single URL':
                 url = values['-URL-'].strip()
@@ -118,7 +417,9 @@ class YouTubeToolGUI:
                     sg.popup_error('Please enter a URL')
                     continue
                     
-                self.process_url(url, extractor)
+                self.update_progress(f"\nProcessing URL: {url}")
+                self.attach_blob_store(extractor, values['-BLOBS-'])
+                self.start_job(extractor, urls=[url])
                 
             elif event == 'Process Batch':
                 batch_file = values['-BATCH-']
@@ -127,19 +428,35 @@ class YouTubeToolGUI:
                     continue
                     
                 try:
-                    with open(batch_file, 'r') as f:
-                        urls = [line.strip() for line in f if line.strip()]
-                        
-                    total_urls = len(urls)
-                    for i, url in enumerate(urls, 1):
-                        self.update_progress(f"\nProcessing URL {i}/{total_urls}")
-                        self.window['-PBAR-'].update(current_count=(i * 100) // total_urls)
-                        self.process_url(url, extractor)
-                        
-                except Exception as e:
-                    self.update_progress(f"Error processing batch file: {str(e)}")
-                    logging.exception("Error processing batch file")
+                    workers = int(values['-WORKERS-'])
+                    max_rps = float(values['-RPS-'] or 0)
+                except ValueError:
+                    sg.popup_error('Workers and max requests/sec must be numbers')
+                    continue
+
+                if values['-RESUME-']:
+                    if output_mode == 'per_url' or (output_mode == 'batch' and values['-FORMAT-'] not in RESUMABLE_FORMATS):
+                        sg.popup_error(f"Resuming needs one output file in {', '.join(RESUMABLE_FORMATS)} format")
+                        continue
+                    extractor.journal_path = self.journal_path(batch_file)
+
+                self.attach_blob_store(extractor, values['-BLOBS-'])
+                self.start_job(extractor, batch_file=batch_file, workers=workers, max_rps=max_rps,
+                               url_column=values['-URL_COLUMN-'].strip() or 'url')
                     
+        if self.control is not None:
+            self.control.cancel()
+            self.job_thread.join()
+        if self.cache is not None:
+            self.cache.close()
+        if self.master is not None:
+            self.master.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.search is not None:
+            self.search.close()
+        if self.archive is not None:
+            self.archive.close()
         self.window.close()
 
 if __name__ == "__main__":
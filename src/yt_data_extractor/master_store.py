@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from records import as_dict
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+SEGMENT_RE = re.compile(r'^seg_(\d+)\.jsonl$')
+
+
+def _try_lock(f):
+    """Take an exclusive lock on the open file f without waiting. Returns: False if another process holds it"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class MasterStore:
+    """
+    Consolidated dataset holding the latest snapshot of every video ever scraped.
+
+    Records are appended to JSONL segment files under <master_dir>/segments; each
+    store session writes its own segment. An SQLite index maps video_id to the
+    segment and byte offset of its latest snapshot, so an upsert is an append
+    plus an O(log n) index update, never a rewrite. A snapshot only replaces the
+    indexed one if its scrape_timestamp is not older. With keep_history=True,
+    replaced snapshots are kept in the index's history table.
+
+    compact() merges closed segments into one file sorted by video_id and drops
+    superseded snapshots, so loading the current state is one sequential read.
+
+    Index updates are held in memory and applied commit_every at a time in one
+    short transaction, so several processes (e.g. the shards of one run) can
+    upsert into the same store; each waits up to busy_timeout seconds for the
+    others' transactions. A segment being written is locked through its
+    seg_<id>.lock file, so compact() in any process leaves it alone.
+    """
+    def __init__(self, master_dir, keep_history=False, commit_every=500, busy_timeout=60.0):
+        self.master_dir = master_dir
+        self.segment_dir = os.path.join(master_dir, 'segments')
+        self.keep_history = keep_history
+        self.commit_every = commit_every
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._compacting = None
+        self._conn = sqlite3.connect(os.path.join(master_dir, 'index.sqlite3'), timeout=busy_timeout,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS current ("
+                "video_id TEXT PRIMARY KEY, segment INTEGER NOT NULL, offset INTEGER NOT NULL, "
+                "length INTEGER NOT NULL, scrape_timestamp TEXT) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS current_location ON current (segment, offset)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "video_id TEXT NOT NULL, scrape_timestamp TEXT, record TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS history_video ON history (video_id)")
+        self._segment_id = None
+        self._segment = None
+        self._segment_lock = None
+        # Upserts written to the segment but not yet to the index:
+        # (video_id, segment, offset, length, scrape_timestamp, line)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.segment_dir, f"seg_{segment_id:06d}.jsonl")
+
+    def _lock_path(self, segment_id):
+        return os.path.join(self.segment_dir, f"seg_{segment_id:06d}.lock")
+
+    def _lock_segment(self, segment_id):
+        """Returns: the open, locked lock file of segment_id, or None if another process holds it"""
+        lock = open(self._lock_path(segment_id), 'ab')
+        if not _try_lock(lock):
+            lock.close()
+            return None
+        return lock
+
+    def _remove_segment(self, segment_id, lock):
+        os.remove(self._segment_path(segment_id))
+        lock.close()
+        try:
+            os.remove(self._lock_path(segment_id))
+        except OSError:
+            # Another process has it open (Windows); it is only an empty marker
+            pass
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.segment_dir):
+            match = SEGMENT_RE.match(name)
+            if match:
+                ids.append(int(match.group(1)))
+        return sorted(ids)
+
+    def _new_segment_id(self):
+        ids = self._segment_ids()
+        return (ids[-1] + 1) if ids else 1
+
+    def _open_segment(self):
+        segment_id = self._new_segment_id()
+        while self._segment is None:
+            # Another process writing to the same master (e.g. a sibling shard)
+            # may have just taken this id
+            lock = self._lock_segment(segment_id)
+            if lock is None:
+                segment_id += 1
+                continue
+            try:
+                self._segment = open(self._segment_path(segment_id), 'xb')
+            except FileExistsError:
+                lock.close()
+                segment_id += 1
+                continue
+            self._segment_id = segment_id
+            self._segment_lock = lock
+        return self._segment
+
+    def _read(self, segment_id, offset, length):
+        with open(self._segment_path(segment_id), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def upsert(self, record):
+        """Add a snapshot of record['video_id'], replacing the indexed one unless it is newer."""
+        video_id = record.get('video_id')
+        if not video_id:
+            return
+        line = (json.dumps(as_dict(record), ensure_ascii=False) + '\n').encode('utf-8')
+        timestamp = record.get('scrape_timestamp')
+        with self._lock:
+            segment = self._open_segment()
+            offset = segment.tell()
+            segment.write(line)
+            self._pending.append((video_id, self._segment_id, offset, len(line), timestamp, line))
+            if len(self._pending) >= self.commit_every:
+                self._commit()
+
+    # Lets the store be passed to YouTubeExtractor as an extra output sink
+    write = upsert
+
+    def _commit(self):
+        """Apply the pending upserts to the index in one transaction."""
+        # Segment data must be on disk before the index points at it
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with self._conn:
+                # Take the write lock up front: a read transaction cannot be
+                # upgraded while another process is writing
+                self._conn.execute('BEGIN IMMEDIATE')
+                for video_id, segment_id, offset, length, timestamp, line in pending:
+                    self._apply(video_id, segment_id, offset, length, timestamp, line)
+        except Exception:
+            self._pending = pending + self._pending
+            raise
+
+    def _apply(self, video_id, segment_id, offset, length, timestamp, line):
+        old = self._conn.execute(
+            "SELECT segment, offset, length, scrape_timestamp FROM current WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if old is not None and old[3] and timestamp and old[3] > timestamp:
+            # The stored snapshot is newer (e.g. this record came from the cache)
+            if self.keep_history:
+                self._conn.execute("INSERT INTO history VALUES (?, ?, ?)", (video_id, timestamp, line.decode('utf-8')))
+            return
+        if old is not None and self.keep_history:
+            previous = self._read(old[0], old[1], old[2]).decode('utf-8')
+            self._conn.execute("INSERT INTO history VALUES (?, ?, ?)", (video_id, old[3], previous))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO current VALUES (?, ?, ?, ?, ?)", (video_id, segment_id, offset, length, timestamp)
+        )
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def get(self, video_id):
+        """Returns: the latest snapshot of video_id, or None"""
+        with self._lock:
+            self._commit()
+            row = self._conn.execute(
+                "SELECT segment, offset, length FROM current WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            return json.loads(self._read(*row))
+
+    def history(self, video_id):
+        """Returns: older snapshots of video_id kept with keep_history, oldest first"""
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(
+                "SELECT record FROM history WHERE video_id = ? ORDER BY scrape_timestamp", (video_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            self._commit()
+            return self._conn.execute("SELECT COUNT(*) FROM current").fetchone()[0]
+
+    def iter_current(self):
+        """
+        Yield the latest snapshot of every video. Segments are read front to back,
+        so after compact() this is a single sequential read of one file.
+        """
+        self.flush()
+        with self._lock:
+            locations = self._conn.execute(
+                "SELECT segment, offset, length FROM current ORDER BY segment, offset"
+            ).fetchall()
+        current_id, f = None, None
+        try:
+            for segment_id, offset, length in locations:
+                if segment_id != current_id:
+                    if f is not None:
+                        f.close()
+                    f = open(self._segment_path(segment_id), 'rb')
+                    current_id = segment_id
+                if f.tell() != offset:
+                    f.seek(offset)
+                yield json.loads(f.read(length))
+        finally:
+            if f is not None:
+                f.close()
+
+    def compact(self):
+        """
+        Merge every closed segment into one new segment sorted by video_id, keeping
+        only the snapshots the index points at, then delete the merged segments.
+        Segments that this or another process is still writing (or compacting)
+        are locked and left out, so this is safe to run while other threads and
+        processes upsert into the same master directory.
+        Returns: number of segments merged
+        """
+        with self._lock:
+            self._commit()
+            locks = {}
+            for segment_id in self._segment_ids():
+                if segment_id != self._segment_id:
+                    lock = self._lock_segment(segment_id)
+                    if lock is not None:
+                        locks[segment_id] = lock
+            closed = sorted(locks)
+            if len(closed) < 2:
+                for lock in locks.values():
+                    lock.close()
+                return 0
+            # Reserve the id so a new active segment cannot take it, and lock it
+            # so no other compaction takes the half-written target as closed
+            target_id = max(self._segment_ids()) + 1
+            while True:
+                target_lock = self._lock_segment(target_id)
+                if target_lock is not None:
+                    target_path = self._segment_path(target_id)
+                    try:
+                        open(target_path, 'xb').close()
+                        break
+                    except FileExistsError:
+                        target_lock.close()
+                target_id += 1
+            placeholders = ', '.join('?' * len(closed))
+            live = self._conn.execute(
+                f"SELECT video_id, segment, offset, length FROM current "
+                f"WHERE segment IN ({placeholders}) ORDER BY video_id", closed
+            ).fetchall()
+
+        try:
+            moves = []
+            with open(target_path, 'wb') as out:
+                for video_id, segment_id, offset, length in live:
+                    moves.append((target_id, out.tell(), video_id, segment_id, offset))
+                    out.write(self._read(segment_id, offset, length))
+                out.flush()
+                os.fsync(out.fileno())
+
+            with self._lock:
+                with self._conn:
+                    # Skip videos that were upserted again while we were copying
+                    self._conn.executemany(
+                        "UPDATE current SET segment = ?, offset = ? WHERE video_id = ? AND segment = ? AND offset = ?",
+                        moves
+                    )
+                for segment_id in closed:
+                    self._remove_segment(segment_id, locks.pop(segment_id))
+        finally:
+            target_lock.close()
+            for lock in locks.values():
+                lock.close()
+        logging.info(f"Compacted {len(closed)} master segments into {target_path}")
+        return len(closed)
+
+    def compact_in_background(self, min_segments=8):
+        """Start compact() on a background thread once there are min_segments closed segments."""
+        with self._lock:
+            if self._compacting is not None and self._compacting.is_alive():
+                return self._compacting
+            if len(self._segment_ids()) - (self._segment is not None) < min_segments:
+                return None
+            self._compacting = threading.Thread(target=self._compact_logged, daemon=True)
+            self._compacting.start()
+            return self._compacting
+
+    def _compact_logged(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logging.error(f"Error compacting master store: {str(e)}")
+
+    def close(self):
+        if self._compacting is not None:
+            self._compacting.join()
+        with self._lock:
+            self._commit()
+            if self._segment is not None:
+                self._segment.close()
+                self._segment_lock.close()
+                self._segment = None
+                self._segment_lock = None
+                self._segment_id = None
+            self._conn.close()
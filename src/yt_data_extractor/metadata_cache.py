@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from records import as_dict
+
+
+class MetadataCache:
+    """
+    Persistent cache of extracted metadata records, keyed by video ID.
+    Entries older than `ttl` seconds are treated as misses. When the cache holds
+    more than `max_entries` records or `max_bytes` of record data, the least
+    recently used entries are evicted. Safe to share between worker threads.
+
+    Videos that failed permanently (private, removed, ...) are remembered for
+    `failure_ttl` seconds so later runs do not request them again.
+
+    Every change is its own short transaction, so several processes (e.g. shards)
+    can share the cache; each waits up to busy_timeout seconds for the others.
+    """
+    def __init__(self, path, ttl=6 * 3600, max_entries=200000, max_bytes=None, failure_ttl=7 * 86400,
+                 busy_timeout=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "video_id TEXT PRIMARY KEY, record TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS failures ("
+                "video_id TEXT PRIMARY KEY, message TEXT, failed_at REAL NOT NULL)"
+            )
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, video_id):
+        """Return the cached record for video_id, or None if missing or stale."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record, fetched_at FROM entries WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[1] > self.ttl:
+                self.misses += 1
+                self.expired += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE entries SET accessed_at = ? WHERE video_id = ?", (now, video_id))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, video_id, record):
+        """Store record for video_id, evicting least recently used entries if over the limits."""
+        data = json.dumps(as_dict(record), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE video_id = ?", (video_id,)).fetchone()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (video_id, data, now, now, len(data))
+                )
+            if old is None:
+                self._entries += 1
+            else:
+                self._bytes -= old[0]
+            self._bytes += len(data)
+            self._evict()
+
+    def get_failure(self, video_id):
+        """Returns: the error message if video_id failed permanently within failure_ttl, else None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT message, failed_at FROM failures WHERE video_id = ?", (video_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.failure_ttl:
+            return None
+        return row[0]
+
+    def put_failure(self, video_id, message):
+        """Remember that video_id failed permanently."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO failures VALUES (?, ?, ?)", (video_id, message, time.time())
+                )
+
+    def _evict(self):
+        while self._over_limit():
+            # Drop a slice of the oldest entries at a time rather than one by one
+            excess = max(self._entries - (self.max_entries or self._entries), 1)
+            rows = self._conn.execute(
+                "SELECT video_id, size FROM entries ORDER BY accessed_at LIMIT ?", (min(excess, 1000),)
+            ).fetchall()
+            if not rows:
+                break
+            with self._conn:
+                self._conn.executemany("DELETE FROM entries WHERE video_id = ?", [(row[0],) for row in rows])
+            self._entries -= len(rows)
+            self._bytes -= sum(row[1] for row in rows)
+            self.evictions += len(rows)
+
+    def _over_limit(self):
+        if self.max_entries and self._entries > self.max_entries:
+            return True
+        return bool(self.max_bytes and self._bytes > self.max_bytes)
+
+    def stats(self):
+        """Returns: hit/miss counters and current size of the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'entries': self._entries,
+                'bytes': self._bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception as e:
+                logging.error(f"Error closing metadata cache: {str(e)}")
@@ -0,0 +1,157 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+# One snapshot of a video's counters; ts is seconds since the epoch
+MetricsPoint = namedtuple('MetricsPoint', ['ts', 'views', 'likes'])
+# One row of MetricsHistory.top_growth
+Growth = namedtuple('Growth', ['video_id', 'first', 'last', 'growth', 'per_day', 'first_ts', 'last_ts'])
+
+METRIC_COLUMNS = {'views': 'views', 'view_count': 'views', 'likes': 'likes', 'like_count': 'likes'}
+
+
+def parse_timestamp(value):
+    """Seconds since the epoch for a record's scrape_timestamp (local time), or now if missing."""
+    if not value:
+        return int(time.time())
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp())
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class MetricsHistory:
+    """
+    View and like counts of every snapshot of every video, without the rest of the record.
+
+    Rows are (video_id, ts, views, likes) in an SQLite WITHOUT ROWID table
+    clustered on (video_id, ts), so a video's series is one contiguous range.
+    SQLite stores each integer in 1-8 bytes depending on its size, which keeps a
+    row to a few dozen bytes. A secondary index on ts lets window queries such as
+    top_growth() touch only the snapshots inside the window.
+    Re-recording the same video at the same timestamp (e.g. from the cache) is a no-op.
+    Snapshots are buffered and inserted commit_every at a time in one short
+    transaction, so several processes can record into the same file.
+    """
+    def __init__(self, path, commit_every=1000, busy_timeout=60.0):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                "video_id TEXT NOT NULL, ts INTEGER NOT NULL, views INTEGER, likes INTEGER, "
+                "PRIMARY KEY (video_id, ts)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS metrics_ts ON metrics (ts)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, record):
+        """Store the counters of one extracted metadata record."""
+        video_id = record.get('video_id')
+        if not video_id:
+            return
+        row = (
+            video_id,
+            parse_timestamp(record.get('scrape_timestamp')),
+            _int_or_none(record.get('view_count')),
+            _int_or_none(record.get('like_count')),
+        )
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.commit_every:
+                self._commit()
+
+    # Lets the history be passed to YouTubeExtractor as an extra output sink
+    write = record
+
+    def _commit(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO metrics VALUES (?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def series(self, video_id, start=None, end=None):
+        """Returns: MetricsPoints of video_id between start and end (epoch seconds), oldest first"""
+        query = "SELECT ts, views, likes FROM metrics WHERE video_id = ?"
+        params = [video_id]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(int(start))
+        if end is not None:
+            query += " AND ts <= ?"
+            params.append(int(end))
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(query + " ORDER BY ts", params).fetchall()
+        return [MetricsPoint(*row) for row in rows]
+
+    def top_growth(self, start, end=None, limit=10, metric='views'):
+        """
+        Videos whose counter grew the most between their first and last snapshot
+        inside [start, end] (epoch seconds; end defaults to now). Videos with
+        fewer than two snapshots in the window are left out.
+        Returns: list of Growth, largest growth first
+        """
+        column = METRIC_COLUMNS.get(metric)
+        if column is None:
+            raise ValueError(f"Unknown metric: {metric}")
+        end = int(time.time()) if end is None else int(end)
+        query = (
+            "WITH span AS ("
+            " SELECT video_id, MIN(ts) AS first_ts, MAX(ts) AS last_ts FROM metrics"
+            " WHERE ts >= ? AND ts <= ? GROUP BY video_id HAVING last_ts > first_ts)"
+            f" SELECT s.video_id, f.{column}, l.{column}, l.{column} - f.{column} AS growth, s.first_ts, s.last_ts"
+            " FROM span s"
+            " JOIN metrics f ON f.video_id = s.video_id AND f.ts = s.first_ts"
+            " JOIN metrics l ON l.video_id = s.video_id AND l.ts = s.last_ts"
+            " WHERE growth IS NOT NULL ORDER BY growth DESC LIMIT ?"
+        )
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(query, (int(start), end, limit)).fetchall()
+        return [
+            Growth(video_id, first, last, growth, growth * 86400 / (last_ts - first_ts), first_ts, last_ts)
+            for video_id, first, last, growth, first_ts, last_ts in rows
+        ]
+
+    def stats(self):
+        """Returns: dict with the number of videos and snapshots stored"""
+        with self._lock:
+            self._commit()
+            snapshots = self._conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+            videos = self._conn.execute("SELECT COUNT(DISTINCT video_id) FROM metrics").fetchone()[0]
+        return {'videos': videos, 'snapshots': snapshots}
+
+    def close(self):
+        with self._lock:
+            try:
+                self._commit()
+                self._conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error closing metrics history: {str(e)}")
@@ -0,0 +1,583 @@
+import csv
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from blob_store import BlobRefWriter, rehydrate_records
+from records import FIELDS
+
+# Python type of each metadata field, used by the typed backends.
+# Fields not listed here are stored as text.
+FIELD_TYPES = {
+    'video_id': str,
+    'title': str,
+    'upload_date': str,
+    'view_count': int,
+    'like_count': int,
+    'duration': float,
+    'tags': list,
+    'category': str,
+    'description': str,
+    'scrape_timestamp': str,
+    # Optional fields, see records.FIELDS
+    'channel_follower_count': int,
+    'comment_count': int,
+    'age_limit': int,
+    'thumbnails': list,
+}
+
+
+def field_type(name):
+    return FIELD_TYPES.get(name, str)
+
+
+def coerce_value(name, value):
+    """Convert a metadata value to its declared type, keeping None as None."""
+    if value is None:
+        return None
+    kind = field_type(name)
+    if kind is list:
+        return [str(item) for item in value]
+    return kind(value)
+
+
+def flatten_record(record):
+    """Flatten list fields such as tags into '|'-joined strings for text formats."""
+    return {
+        key: '|'.join(value) if isinstance(value, (list, tuple)) else value
+        for key, value in record.items()
+    }
+
+
+def reserve_output_path(output_dir, prefix, extension):
+    """
+    Create a new, empty output file that no other writer can claim.
+    Names look like metadata_20240101_120000.csv, with _1, _2, ... appended when
+    another file was already created in the same second.
+    Returns: path of the created file
+    """
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for counter in itertools.count():
+        suffix = f"_{counter}" if counter else ''
+        path = os.path.join(output_dir, f"{prefix}_{stamp}{suffix}.{extension}")
+        try:
+            # O_EXCL makes the check-and-create atomic across threads and processes
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return path
+
+
+class BatchWriter:
+    """
+    Streams every record of a run into a single output file.
+    Rows go through a buffered file and are flushed every `flush_every` rows or
+    `flush_interval` seconds, and fsync'd every `fsync_every` rows.
+    write() is safe to call from several worker threads.
+    """
+    extension = None
+
+    def __init__(self, output_dir, prefix='metadata', flush_every=100, flush_interval=5.0, fsync_every=1000):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync_every = fsync_every
+        self.path = None
+        self.rows_written = 0
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._unsynced = 0
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        with self._lock:
+            if self.path is None:
+                path = reserve_output_path(self.output_dir, self.prefix, self.extension)
+                try:
+                    self.path = path
+                    self._open(record)
+                except Exception:
+                    # Leave the writer unopened so a later write can try again
+                    self.path = None
+                    os.remove(path)
+                    raise
+            self._write(record)
+            self.rows_written += 1
+            self._unflushed += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._flush(fsync=True)
+            elif (self._unflushed >= self.flush_every
+                  or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush(fsync=False)
+
+    def flush(self, fsync=False):
+        """Push buffered rows to the OS, and to disk when fsync is True."""
+        with self._lock:
+            if self.path is not None:
+                self._flush(fsync)
+
+    def close(self):
+        with self._lock:
+            if self.path is None:
+                return
+            try:
+                self._flush(fsync=True)
+            finally:
+                self._close()
+
+    def checkpoint(self):
+        """
+        Make every row written so far durable.
+        Returns: (path, position) to pass to resume() after a crash; path is None
+        if nothing has been written yet
+        """
+        with self._lock:
+            if self.path is None:
+                return None, 0
+            self._flush(fsync=True)
+            return self.path, self._position()
+
+    def resume(self, path, position):
+        """
+        Continue a crashed run's output in `path`, discarding anything written
+        after `position` (as returned by checkpoint()). Raises ValueError if the
+        file is gone, since the rows before `position` would be lost.
+        """
+        with self._lock:
+            if not position:
+                # Nothing durable was written; start over in a fresh file
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            if not os.path.exists(path):
+                raise ValueError(f"Cannot resume: the output file {path} of the journaled run is missing")
+            try:
+                self.path = path
+                self._resume(position)
+            except Exception:
+                # Leave the writer unopened so close() has nothing to close
+                self.path = None
+                raise
+
+    def _flush(self, fsync):
+        self._do_flush(fsync)
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        if fsync:
+            self._unsynced = 0
+
+    # Subclasses implement the file format below
+    def _open(self, first_record):
+        raise NotImplementedError
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def _do_flush(self, fsync):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def _position(self):
+        raise NotImplementedError(f"{type(self).__name__} does not support resuming")
+
+    def _resume(self, position):
+        raise NotImplementedError(f"{type(self).__name__} does not support resuming")
+
+    def _file_position(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def _truncate(self, position):
+        with open(self.path, 'r+b') as f:
+            f.truncate(position)
+
+
+class CSVWriter(BatchWriter):
+    """Writes the run to one CSV file with a single header row."""
+    extension = 'csv'
+
+    def _open(self, first_record):
+        self._file = open(self.path, 'w', newline='', encoding='utf-8', buffering=1 << 16)
+        self._writer = csv.DictWriter(self._file, fieldnames=list(first_record.keys()))
+        self._writer.writeheader()
+
+    def _write(self, record):
+        self._writer.writerow(flatten_record(record))
+
+    def _do_flush(self, fsync):
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
+
+    def _position(self):
+        return self._file_position()
+
+    def _resume(self, position):
+        self._truncate(position)
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            fieldnames = next(csv.reader(f))
+        self._file = open(self.path, 'a', newline='', encoding='utf-8', buffering=1 << 16)
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+
+
+class JSONLWriter(BatchWriter):
+    """Writes one JSON object per line, keeping numbers typed and tags as a JSON array."""
+    extension = 'jsonl'
+
+    def _open(self, first_record):
+        self._file = open(self.path, 'w', encoding='utf-8', buffering=1 << 16)
+
+    def _write(self, record):
+        typed = {key: coerce_value(key, value) for key, value in record.items()}
+        self._file.write(json.dumps(typed, ensure_ascii=False))
+        self._file.write('\n')
+
+    def _do_flush(self, fsync):
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
+
+    def _position(self):
+        return self._file_position()
+
+    def _resume(self, position):
+        self._truncate(position)
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1 << 16)
+
+
+class SQLiteWriter(BatchWriter):
+    """
+    Writes the run to a SQLite database with typed columns.
+    Rows are buffered and inserted with executemany, one transaction per flush.
+    Tags go to a video_tags child table keyed by the row id of the video.
+    """
+    extension = 'sqlite3'
+    SQL_TYPES = {str: 'TEXT', int: 'INTEGER', float: 'REAL'}
+
+    def _connect(self):
+        self._pending = []
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    def _open(self, first_record):
+        self._columns = [name for name in first_record if field_type(name) is not list]
+        self._list_columns = [name for name in first_record if field_type(name) is list]
+        self._next_id = 1
+        self._connect()
+        columns = ', '.join(f"{name} {self.SQL_TYPES[field_type(name)]}" for name in self._columns)
+        with self._conn:
+            self._conn.execute(f"CREATE TABLE videos (id INTEGER PRIMARY KEY, {columns})")
+            self._conn.execute(
+                "CREATE TABLE video_tags (video_row INTEGER REFERENCES videos(id), "
+                "field TEXT, position INTEGER, value TEXT)"
+            )
+            self._conn.execute("CREATE INDEX video_tags_value ON video_tags (value)")
+            # Lets readers tell an empty list field from one the run did not extract
+            self._conn.execute("CREATE TABLE list_fields (name TEXT PRIMARY KEY)")
+            self._conn.executemany("INSERT INTO list_fields VALUES (?)", [(name,) for name in self._list_columns])
+
+    def _resume(self, position):
+        self._connect()
+        self._columns = [row[1] for row in self._conn.execute("PRAGMA table_info(videos)")][1:]
+        # List fields are not columns of videos; take them from the next record
+        self._list_columns = None
+        self._next_id = position + 1
+        with self._conn:
+            self._conn.execute("DELETE FROM videos WHERE id > ?", (position,))
+            self._conn.execute("DELETE FROM video_tags WHERE video_row > ?", (position,))
+
+    def _position(self):
+        # Rows are numbered from 1 and _pending is empty after a flush
+        return self._next_id - 1
+
+    def _write(self, record):
+        if self._list_columns is None:
+            self._list_columns = [name for name in record if field_type(name) is list]
+        self._pending.append((self._next_id, record))
+        self._next_id += 1
+
+    def _do_flush(self, fsync):
+        if not self._pending:
+            return
+        placeholders = ', '.join('?' * (len(self._columns) + 1))
+        video_rows = []
+        tag_rows = []
+        for row_id, record in self._pending:
+            video_rows.append([row_id] + [coerce_value(name, record.get(name)) for name in self._columns])
+            for name in self._list_columns:
+                for position, value in enumerate(coerce_value(name, record.get(name)) or []):
+                    tag_rows.append((row_id, name, position, value))
+        with self._conn:
+            self._conn.executemany(f"INSERT INTO videos VALUES ({placeholders})", video_rows)
+            self._conn.executemany("INSERT INTO video_tags VALUES (?, ?, ?, ?)", tag_rows)
+        self._pending = []
+
+    def _close(self):
+        self._conn.close()
+
+
+class ParquetWriter(BatchWriter):
+    """
+    Writes the run to a zstd-compressed Parquet file with a typed schema.
+    Rows are collected into row groups of `row_group_size`; the file is only
+    readable once the writer is closed. Needs the optional pyarrow package.
+    """
+    extension = 'parquet'
+
+    def __init__(self, output_dir, row_group_size=10000, **kwargs):
+        kwargs.setdefault('flush_every', row_group_size)
+        super().__init__(output_dir, **kwargs)
+        self.row_group_size = row_group_size
+
+    def _open(self, first_record):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs the pyarrow package: pip install pyarrow")
+        arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64(), list: pa.list_(pa.string())}
+        self._pa = pa
+        self._schema = pa.schema([(name, arrow_types[field_type(name)]) for name in first_record])
+        self._parquet = pq.ParquetWriter(self.path, self._schema, compression='zstd')
+        self._pending = []
+
+    def _write(self, record):
+        self._pending.append(record)
+
+    def _do_flush(self, fsync):
+        # Small row groups defeat the point of Parquet, so periodic flushes only
+        # write once a full group is buffered; close() writes the remainder.
+        if len(self._pending) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if not self._pending:
+            return
+        columns = {
+            name: [coerce_value(name, record.get(name)) for record in self._pending]
+            for name in self._schema.names
+        }
+        self._parquet.write_table(self._pa.table(columns, schema=self._schema))
+        self._pending = []
+
+    def _close(self):
+        self._write_row_group()
+        self._parquet.close()
+
+
+# Output formats selectable from the GUI and the Python API
+WRITERS = {
+    'csv': CSVWriter,
+    'jsonl': JSONLWriter,
+    'sqlite': SQLiteWriter,
+    'parquet': ParquetWriter,
+}
+
+# Formats whose output can be cut back to a checkpoint and continued after a crash
+RESUMABLE_FORMATS = ('csv', 'jsonl', 'sqlite')
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_formats():
+    """Returns: the WRITERS formats usable here, leaving out parquet without pyarrow"""
+    return [name for name in WRITERS if name != 'parquet' or parquet_available()]
+
+
+class PerURLWriter:
+    """Legacy output: every record goes to its own metadata_<timestamp> file."""
+
+    def __init__(self, output_dir, writer_class=CSVWriter, prefix='metadata'):
+        self.output_dir = output_dir
+        self.writer_class = writer_class
+        self.prefix = prefix
+        self.path = None
+        self.rows_written = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        with self.writer_class(self.output_dir, prefix=self.prefix) as writer:
+            writer.write(record)
+        with self._lock:
+            self.path = writer.path
+            self.rows_written += 1
+
+    def flush(self, fsync=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullWriter:
+    """Output for runs that only feed the extractor's sinks (e.g. metrics history)."""
+    def __init__(self):
+        self.path = None
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        self.rows_written += 1
+
+    def flush(self, fsync=False):
+        pass
+
+    def checkpoint(self):
+        return None, 0
+
+    def resume(self, path, position):
+        pass
+
+    def close(self):
+        pass
+
+
+def create_writer(output_dir, output_mode='batch', output_format='csv', blob_store=None):
+    """
+    Build the writer for a run.
+    output_mode: 'batch' for one file per run, 'per_url' for the legacy one file per video,
+    'none' to write no output file
+    output_format: one of WRITERS ('csv', 'jsonl', 'sqlite', 'parquet')
+    blob_store: optional blob_store.BlobStore; descriptions and tags are stored
+    there once and the file holds references to them
+    """
+    if output_format not in WRITERS:
+        logging.error(f"Unknown output format: {output_format}")
+        raise ValueError(f"Unknown output format: {output_format}")
+    writer_class = WRITERS[output_format]
+    if output_mode == 'none':
+        return NullWriter()
+    if output_mode == 'per_url':
+        writer = PerURLWriter(output_dir, writer_class)
+    elif output_mode == 'batch':
+        writer = writer_class(output_dir)
+    else:
+        logging.error(f"Unknown output mode: {output_mode}")
+        raise ValueError(f"Unknown output mode: {output_mode}")
+    return BlobRefWriter(writer, blob_store) if blob_store is not None else writer
+
+
+def parse_text_value(name, text):
+    """Inverse of flatten_record for one CSV cell: typed value, or None for an empty number."""
+    kind = field_type(name)
+    if kind is list:
+        return text.split('|') if text else []
+    if kind is str:
+        return text
+    if text == '':
+        return None
+    try:
+        return kind(text)
+    except ValueError:
+        return kind(float(text))
+
+
+def read_csv_records(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {name: parse_text_value(name, value or '') for name, value in row.items()}
+
+
+def read_jsonl_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_sqlite_records(path):
+    conn = sqlite3.connect(path)
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(videos)")]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'list_fields' in tables:
+            list_fields = [row[0] for row in conn.execute("SELECT name FROM list_fields")]
+        else:
+            # Written before list_fields existed, when tags was the only list field
+            list_fields = ['tags']
+        # Both queries are ordered by video row, so tags are joined in one pass
+        tags = conn.execute("SELECT video_row, field, value FROM video_tags ORDER BY video_row, position")
+        pending = next(tags, None)
+        for row in conn.execute("SELECT * FROM videos ORDER BY id"):
+            record = dict(zip(columns[1:], row[1:]))
+            for name in list_fields:
+                record[name] = []
+            while pending is not None and pending[0] <= row[0]:
+                if pending[0] == row[0]:
+                    record.setdefault(pending[1], []).append(pending[2])
+                pending = next(tags, None)
+            # List fields live in their own table; put them back in the usual field order
+            ordered = {name: record.pop(name) for name in FIELDS if name in record}
+            ordered.update(record)
+            yield ordered
+    finally:
+        conn.close()
+
+
+def read_parquet_records(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet needs the pyarrow package: pip install pyarrow")
+    for batch in pq.ParquetFile(path).iter_batches():
+        yield from batch.to_pylist()
+
+
+# Readers for the files written by WRITERS, by file extension
+READERS = {
+    'csv': read_csv_records,
+    'jsonl': read_jsonl_records,
+    'sqlite3': read_sqlite_records,
+    'parquet': read_parquet_records,
+}
+
+
+def read_records(path, blob_store=None):
+    """
+    Yield the records of an output file written by one of the batch writers.
+    Blob references are resolved through blob_store, by default the
+    blob_store.BLOB_STORE_NAME file next to path.
+    """
+    extension = os.path.splitext(path)[1][1:].lower()
+    if extension not in READERS:
+        raise ValueError(f"Unknown output file type: {path}")
+    return rehydrate_records(READERS[extension](path), path, blob_store)
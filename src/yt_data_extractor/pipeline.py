@@ -0,0 +1,266 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+# Marks the end of a stage's input
+_END = object()
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB, or None where it cannot be read cheaply (non-Linux)."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class Stage:
+    """
+    One step of a Pipeline: `workers` threads each taking an item from the
+    stage's input queue (at most queue_size waiting), calling func(item) and
+    passing the item on. func works on the item in place. If it raises, the
+    error is stored in item.error and later stages pass the item through untouched.
+    """
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.workers * 2
+        self.queue = None
+        self._lock = threading.Lock()
+        self._running = 0
+        self.reset()
+
+    def reset(self):
+        self.queue = queue.Queue(self.queue_size)
+        self.items = 0
+        self.max_depth = 0
+        # Seconds spent working, waiting for input and blocked on a full next queue
+        self.busy = 0.0
+        self.idle = 0.0
+        self.stalled = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'items': self.items,
+                'busy_seconds': round(self.busy, 3),
+                'idle_seconds': round(self.idle, 3),
+                'stall_seconds': round(self.stalled, 3),
+            }
+
+
+class Pipeline:
+    """
+    Runs items through a chain of Stages joined by bounded queues.
+
+    A reader thread feeds the first stage from the input iterator, admitting a
+    new item only while fewer than max_in_flight items are anywhere between
+    the reader and the consumer of run(). A slow stage therefore fills its
+    queue, stalls the stages before it and finally the reader, instead of
+    letting results pile up in memory. With memory_limit_mb, the reader and
+    the first stage (where items grow, e.g. by fetching) also hold back while
+    the process's resident memory is above the limit (Linux only), as long as
+    later stages have items to finish, so the run cannot deadlock.
+
+    stats() can be called from any thread while the pipeline runs: per-stage
+    queue depth, busy, idle and stall time show which stage is the bottleneck.
+    """
+    def __init__(self, stages, max_in_flight=1000, memory_limit_mb=None):
+        self.stages = list(stages)
+        self.max_in_flight = max_in_flight
+        self.memory_limit_mb = memory_limit_mb
+        if memory_limit_mb and current_rss_mb() is None:
+            logging.warning("Memory limit ignored: resident memory cannot be read on this platform")
+            self.memory_limit_mb = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # Items the first stage has handed on and run() has not yet yielded
+        self._past_first = 0
+        self.reader_stalled = 0.0
+        self.memory_waits = 0
+        self._admitted = threading.Condition()
+        self._stopping = threading.Event()
+        self._results = queue.Queue()
+        self._reader_error = None
+
+    def _admit(self):
+        """Block until one more item may enter. Returns: False if the pipeline is stopping"""
+        with self._admitted:
+            while not self._stopping.is_set() and self.in_flight > 0:
+                if self.in_flight >= self.max_in_flight:
+                    self._admitted.wait(0.1)
+                elif self.memory_limit_mb and current_rss_mb() > self.memory_limit_mb:
+                    self.memory_waits += 1
+                    self._admitted.wait(0.05)
+                else:
+                    break
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return not self._stopping.is_set()
+
+    def _release(self):
+        with self._admitted:
+            self.in_flight -= 1
+            self._past_first -= 1
+            self._admitted.notify_all()
+
+    def _wait_for_memory(self):
+        """Hold the first stage while memory is over the limit and later stages can free some."""
+        with self._admitted:
+            while (not self._stopping.is_set() and self._past_first > 0
+                   and current_rss_mb() > self.memory_limit_mb):
+                self.memory_waits += 1
+                self._admitted.wait(0.05)
+
+    def _put(self, stage, next_queue, item):
+        """Hand item on, counting the time the next queue was full against stage."""
+        try:
+            next_queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        started = time.perf_counter()
+        next_queue.put(item)
+        with stage._lock:
+            stage.stalled += time.perf_counter() - started
+
+    def _read(self, items):
+        first = self.stages[0].queue
+        try:
+            for item in items:
+                # Time waiting for a slot or for room in the first queue is backpressure
+                started = time.perf_counter()
+                if not self._admit():
+                    self._release()
+                    break
+                first.put(item)
+                self.reader_stalled += time.perf_counter() - started
+                depth = first.qsize()
+                if depth > self.stages[0].max_depth:
+                    self.stages[0].max_depth = depth
+        except Exception as e:
+            logging.error(f"Error reading pipeline input: {str(e)}")
+            self._reader_error = e
+        finally:
+            for _ in range(self.stages[0].workers):
+                first.put(_END)
+
+    def _work(self, position):
+        stage = self.stages[position]
+        last = position == len(self.stages) - 1
+        next_queue = self._results if last else self.stages[position + 1].queue
+        next_stage = None if last else self.stages[position + 1]
+        while True:
+            started = time.perf_counter()
+            item = stage.queue.get()
+            waited = time.perf_counter() - started
+            if item is _END:
+                with stage._lock:
+                    stage.idle += waited
+                    stage._running -= 1
+                    finished = stage._running == 0
+                if finished:
+                    # The last worker of a stage ends the next one
+                    for _ in range(1 if last else next_stage.workers):
+                        next_queue.put(_END)
+                return
+            if position == 0 and self.memory_limit_mb:
+                started = time.perf_counter()
+                self._wait_for_memory()
+                with stage._lock:
+                    stage.stalled += time.perf_counter() - started
+            started = time.perf_counter()
+            if getattr(item, 'error', None) is None and not self._stopping.is_set():
+                try:
+                    stage.func(item)
+                except Exception as e:
+                    item.error = e
+            busy = time.perf_counter() - started
+            with stage._lock:
+                stage.items += 1
+                stage.idle += waited
+                stage.busy += busy
+            self._put(stage, next_queue, item)
+            if position == 0:
+                with self._admitted:
+                    self._past_first += 1
+            if next_stage is not None:
+                depth = next_queue.qsize()
+                if depth > next_stage.max_depth:
+                    next_stage.max_depth = depth
+
+    def run(self, items):
+        """
+        Run every item of the items iterator through the stages.
+        Yields: items in completion order, with item.error set if a stage failed.
+        Closing the generator early lets the items in flight finish without
+        running further stage functions on them.
+        """
+        for stage in self.stages:
+            stage.reset()
+            stage._running = stage.workers
+        self.in_flight = self.peak_in_flight = self.memory_waits = self._past_first = 0
+        self.reader_stalled = 0.0
+        self._stopping.clear()
+        self._reader_error = None
+        threads = [threading.Thread(target=self._read, args=(iter(items),), name='pipeline-reader', daemon=True)]
+        for position, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(target=self._work, args=(position,), name=f"{stage.name}-{number}", daemon=True)
+                for number in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        finished = False
+        try:
+            while True:
+                item = self._results.get()
+                if item is _END:
+                    finished = True
+                    break
+                self._release()
+                yield item
+        finally:
+            if not finished:
+                # Stopped early: stages skip their work, so what is in flight drains quickly
+                self._stopping.set()
+                with self._admitted:
+                    self._admitted.notify_all()
+                while self._results.get() is not _END:
+                    self._release()
+            for thread in threads:
+                thread.join()
+        if self._reader_error is not None:
+            raise self._reader_error
+
+    def stats(self):
+        """Returns: {'reader': {...}, stage name: Stage.stats()} for each stage, in order"""
+        stats = {'reader': {
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'max_in_flight': self.max_in_flight,
+            'stall_seconds': round(self.reader_stalled, 3),
+            'memory_waits': self.memory_waits,
+        }}
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
+
+
+def pipeline_summary(stats):
+    """One line per stage of queue depth and stall time, e.g. for a progress report."""
+    reader = stats['reader']
+    parts = [f"in flight {reader['in_flight']}/{reader['max_in_flight']}, reader stalled {reader['stall_seconds']:.1f}s"]
+    for name, stage in stats.items():
+        if name != 'reader':
+            parts.append(f"{name} x{stage['workers']}: queue {stage['queue_depth']} (max {stage['max_queue_depth']}), "
+                         f"busy {stage['busy_seconds']:.1f}s, stalled {stage['stall_seconds']:.1f}s")
+    return '; '.join(parts)
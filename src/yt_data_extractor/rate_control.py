@@ -0,0 +1,232 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+# How a failed request should be handled
+TRANSIENT = 'transient'        # worth retrying after a short backoff
+RATE_LIMITED = 'rate_limited'  # the site is pushing back: retry, and slow everyone down
+PERMANENT = 'permanent'        # the video cannot be fetched (private, removed, ...): never retry
+
+# Matched case-insensitively against the error message, in this order. YouTube's
+# bot check reuses the "Video unavailable" wording, so rate limits come first.
+RATE_LIMIT_PATTERNS = (
+    'http error 429', 'too many requests', "confirm you're not a bot", 'confirm you\u2019re not a bot',
+    'try again later', 'rate limit', 'rate-limit', 'captcha',
+)
+PERMANENT_PATTERNS = (
+    'private video', 'video unavailable', 'has been removed', 'no longer available',
+    'account associated with this video has been terminated', 'members-only', 'join this channel',
+    'confirm your age', 'not available in your country', 'copyright', 'does not exist',
+    'http error 404', 'http error 410', 'unsupported url', 'is not a valid url', 'incomplete youtube id',
+)
+
+
+def classify_error(error):
+    """Returns: TRANSIENT, RATE_LIMITED or PERMANENT for an exception raised while fetching"""
+    message = str(error).lower()
+    if any(pattern in message for pattern in RATE_LIMIT_PATTERNS):
+        return RATE_LIMITED
+    if any(pattern in message for pattern in PERMANENT_PATTERNS):
+        return PERMANENT
+    # Anything else is only retried a bounded number of times, but never
+    # remembered as permanent: an error we do not recognise (e.g. a bug while
+    # mapping fields) says nothing about the video itself
+    return TRANSIENT
+
+
+# Hosts that are served by the same backend share one rate budget
+HOST_ALIASES = {
+    'youtu.be': 'youtube.com',
+    'youtube-nocookie.com': 'youtube.com',
+}
+
+
+def host_key(url):
+    """Return the rate-limit bucket for a URL, e.g. 'youtube.com'."""
+    host = (urlparse(url).hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return HOST_ALIASES.get(host, host)
+
+
+class RateLimiter:
+    """
+    Spaces requests out so that no host receives more than `rate` requests per second.
+    A rate of None or 0 disables limiting. Safe to share between worker threads.
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def acquire(self, url):
+        """
+        Block until a request to the host of `url` is allowed.
+        Returns: seconds spent waiting
+        """
+        if not self.rate:
+            return 0.0
+        key = host_key(url)
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+
+class AdaptiveRateController(RateLimiter):
+    """
+    RateLimiter that reacts to how the site responds, shared by all workers of a run.
+
+    - Rate-limit errors cut the request rate multiplicatively (rate * decrease);
+      every `increase_every` successes add back `increase` requests/second, or
+      5% of the rate before the first cut if that is more, up to `max_rate`
+      (AIMD). Starting unlimited, the first cut is taken from the rate actually
+      observed over the last few seconds, and limiting switches off again once
+      that rate is reached. Errors from requests already in flight when the
+      rate was cut do not cut it again.
+    - After `breaker_threshold` rate-limited or transient failures in a row the
+      circuit breaker opens: acquire() holds every worker for `cooldown` seconds.
+      The next request then probes the site; if it is rate limited again the
+      breaker reopens with twice the cooldown (up to `max_cooldown`).
+    - retry_delay() gives the jittered exponential backoff before retrying a
+      transient or rate-limited failure; permanent failures are not retried.
+    """
+    def __init__(self, max_rate=None, min_rate=0.2, decrease=0.5, increase=0.25, increase_every=20,
+                 max_retries=3, base_delay=1.0, max_delay=60.0, breaker_threshold=5, cooldown=30.0,
+                 max_cooldown=600.0):
+        super().__init__(max_rate)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.increase_every = increase_every
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._state_lock = threading.Lock()
+        self._recent = deque()
+        self._successes = 0
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        # Rate the run was going at before it was first slowed down
+        self._target_rate = max_rate
+        self._unlimited = max_rate is None
+        self._cut_until = 0.0
+        self.rate_limited = 0
+        self.breaker_trips = 0
+        self.min_rate_seen = max_rate
+
+    @property
+    def breaker_open(self):
+        return time.monotonic() < self._open_until
+
+    def acquire(self, url):
+        """Wait for the circuit breaker and the current rate. Returns: seconds spent waiting"""
+        waited = 0.0
+        while True:
+            delay = self._open_until - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(delay)
+            waited += delay
+        waited += super().acquire(url)
+        with self._state_lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > 10.0:
+                self._recent.popleft()
+        return waited
+
+    def retry_delay(self, attempt):
+        """Returns: seconds to wait before retry number `attempt` (0-based), with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def should_retry(self, kind, attempt):
+        return kind != PERMANENT and attempt < self.max_retries
+
+    def record_success(self):
+        with self._state_lock:
+            self._consecutive_failures = 0
+            if self._probing:
+                self._probing = False
+                self.cooldown = self.base_cooldown
+            if self.rate is None:
+                return
+            self._successes += 1
+            if self._successes >= self.increase_every:
+                self._successes = 0
+                rate = self.rate + max(self.increase, 0.05 * self._target_rate)
+                if rate < self._target_rate:
+                    self.rate = rate
+                elif self._unlimited:
+                    self.rate = None
+                    logging.info("No longer rate limited; request rate back to unlimited")
+                else:
+                    self.rate = self._target_rate
+
+    def record_failure(self, kind):
+        if kind == PERMANENT:
+            return
+        with self._state_lock:
+            self._consecutive_failures += 1
+            self._successes = 0
+            if kind == RATE_LIMITED:
+                self.rate_limited += 1
+                self._slow_down()
+            if self._probing or self._consecutive_failures >= self.breaker_threshold:
+                self._trip()
+
+    def _slow_down(self):
+        now = time.monotonic()
+        if now < self._cut_until:
+            return
+        if self.rate is None:
+            span = (self._recent[-1] - self._recent[0]) if len(self._recent) > 1 else 0.0
+            observed = len(self._recent) / span if span > 0 else 1.0
+            if self._target_rate is None:
+                self._target_rate = observed
+            rate = observed * self.decrease
+        else:
+            rate = self.rate * self.decrease
+        self.rate = max(self.min_rate, rate)
+        self._cut_until = now + max(1.0, 2.0 / self.rate)
+        if self.min_rate_seen is None or self.rate < self.min_rate_seen:
+            self.min_rate_seen = self.rate
+        logging.warning(f"Rate limited; slowing down to {self.rate:.2f} requests/second")
+
+    def _trip(self):
+        now = time.monotonic()
+        if now < self._open_until:
+            return
+        if self._probing:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        self._open_until = now + self.cooldown
+        self._probing = True
+        self._consecutive_failures = 0
+        self.breaker_trips += 1
+        logging.warning(f"Too many failures in a row; pausing requests for {self.cooldown:.0f}s")
+
+    def stats(self):
+        """Returns: dict with the current rate, rate-limit signals and breaker trips"""
+        with self._state_lock:
+            return {
+                'rate': self.rate,
+                'min_rate': self.min_rate_seen,
+                'rate_limited': self.rate_limited,
+                'breaker_trips': self.breaker_trips,
+            }
@@ -0,0 +1,299 @@
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from output_writers import create_writer
+from records import SCRAPE_TIME_KEY, Projection
+from sharding import merge_outputs
+
+SEGMENT_RE = re.compile(r'^seg_(\d+)\.jsonl\.(gz|zst)$')
+CODEC_EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+
+def zstd_available():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_codec(codec):
+    """'auto' picks zstd when the optional zstandard package is installed, else gzip."""
+    if codec == 'auto':
+        return 'zstd' if zstd_available() else 'gzip'
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"Unknown archive compression: {codec}")
+    if codec == 'zstd' and not zstd_available():
+        raise ImportError("zstd compression needs the zstandard package: pip install zstandard")
+    return codec
+
+
+def _codec_of(path):
+    return 'zstd' if path.endswith('.zst') else 'gzip'
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _read_errors():
+    errors = (EOFError, OSError, ValueError, zlib.error)
+    if zstd_available():
+        import zstandard
+        errors += (zstandard.ZstdError,)
+    return errors
+
+
+def find_segments(segment_dir):
+    """Returns: paths of the segment files in segment_dir, oldest first"""
+    found = []
+    for name in os.listdir(segment_dir):
+        match = SEGMENT_RE.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(segment_dir, name)))
+    return [path for _, path in sorted(found)]
+
+
+def iter_segment(path):
+    """
+    Yield the info dicts archived in one segment file, streaming. A segment cut
+    short by a crash yields what was written before the damage.
+    """
+    if _codec_of(path) == 'zstd':
+        import zstandard
+        raw = open(path, 'rb')
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        f = io.TextIOWrapper(stream, encoding='utf-8')
+    else:
+        f = gzip.open(path, 'rt', encoding='utf-8')
+    with f:
+        try:
+            for line in f:
+                yield json.loads(line)
+        except _read_errors() as e:
+            logging.error(f"Error reading archive segment {path}, stopped early: {str(e)}")
+
+
+class RawArchive:
+    """
+    Append-only archive of yt-dlp's full info dicts, so fields that were not
+    extracted at the time can be derived later without fetching again.
+
+    Info dicts are written as JSON lines to segment files under
+    <archive_dir>/segments, records_per_segment to a file. Lines are compressed
+    in blocks of about block_size bytes, each block a complete gzip member or
+    zstd frame, so a segment is a plain .jsonl.gz (or .jsonl.zst) file that
+    zcat can read, and one block can be decompressed on its own. An SQLite
+    index maps every video ID to the segment, block and line of each archived
+    snapshot. Each session writes its own segments and indexes each block in
+    one short transaction, so shard processes can share one archive; each waits
+    up to busy_timeout seconds for the others' transactions.
+    """
+    def __init__(self, archive_dir, codec='auto', records_per_segment=10000, block_size=1 << 20,
+                 level=None, exclude=(), busy_timeout=60.0):
+        self.archive_dir = archive_dir
+        self.segment_dir = os.path.join(archive_dir, 'segments')
+        self.codec = resolve_codec(codec)
+        self.records_per_segment = records_per_segment
+        self.block_size = block_size
+        self.level = level
+        # Top-level info dict keys not worth keeping, e.g. 'formats'
+        self.exclude = frozenset(exclude)
+        self.records_written = 0
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(archive_dir, 'index.sqlite3'), timeout=busy_timeout,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "video_id TEXT NOT NULL, scrape_timestamp TEXT, segment INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL, line INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_video ON entries (video_id)")
+        self._segment = None
+        self._segment_id = None
+        self._segment_records = 0
+        # Lines of the block being filled, and (video_id, timestamp) of each
+        self._block = []
+        self._block_keys = []
+        self._block_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _segment_path(self, segment_id, codec=None):
+        return os.path.join(self.segment_dir, f"seg_{segment_id:06d}.jsonl.{CODEC_EXTENSIONS[codec or self.codec]}")
+
+    def _open_segment(self):
+        while self._segment is None:
+            paths = find_segments(self.segment_dir)
+            segment_id = int(SEGMENT_RE.match(os.path.basename(paths[-1])).group(1)) + 1 if paths else 1
+            try:
+                # Exclusive create: a sibling shard process may have just taken this id
+                self._segment = open(self._segment_path(segment_id), 'xb')
+            except FileExistsError:
+                continue
+            self._segment_id = segment_id
+            self._segment_records = 0
+        return self._segment
+
+    def _compress(self, data):
+        if self.codec == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        return gzip.compress(data, compresslevel=self.level or 6)
+
+    def add(self, info):
+        """
+        Archive one info dict. Its scrape time is stored with it under
+        records.SCRAPE_TIME_KEY, set on info itself if missing, so a record
+        built from info now and one derived from the archive later agree.
+        """
+        video_id = info.get('id')
+        if not video_id:
+            return
+        timestamp = info.setdefault(SCRAPE_TIME_KEY, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        kept = {key: value for key, value in info.items() if key not in self.exclude and not key.startswith('__')}
+        line = (json.dumps(kept, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            self._block.append(line)
+            self._block_keys.append((video_id, timestamp))
+            self._block_bytes += len(line)
+            self.records_written += 1
+            if (self._block_bytes >= self.block_size
+                    or self._segment_records + len(self._block) >= self.records_per_segment):
+                self._write_block()
+
+    def _write_block(self):
+        if not self._block:
+            return
+        segment = self._open_segment()
+        data = self._compress(b''.join(self._block))
+        offset = segment.tell()
+        segment.write(data)
+        # Block data must be on disk before the index points at it
+        segment.flush()
+        os.fsync(segment.fileno())
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                [(video_id, timestamp, self._segment_id, offset, len(data), line)
+                 for line, (video_id, timestamp) in enumerate(self._block_keys)]
+            )
+        self._segment_records += len(self._block)
+        self._block, self._block_keys, self._block_bytes = [], [], 0
+        if self._segment_records >= self.records_per_segment:
+            segment.close()
+            self._segment = None
+            self._segment_id = None
+
+    def flush(self):
+        with self._lock:
+            self._write_block()
+
+    def get(self, video_id):
+        """Returns: the latest archived info dict of video_id, or None"""
+        self.flush()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT segment, offset, length, line FROM entries WHERE video_id = ? "
+                "ORDER BY scrape_timestamp DESC, rowid DESC LIMIT 1", (video_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        segment_id, offset, length, line = row
+        path = next((path for path in (self._segment_path(segment_id, codec) for codec in CODEC_EXTENSIONS)
+                     if os.path.exists(path)), None)
+        if path is None:
+            raise KeyError(f"Archive segment {segment_id} of {video_id} is missing from {self.segment_dir}")
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return json.loads(_decompress(_codec_of(path), data).split(b'\n')[line])
+
+    def stats(self):
+        """Returns: dict with the number of archived snapshots, videos, segments and bytes on disk"""
+        with self._lock:
+            snapshots, videos = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT video_id) FROM entries"
+            ).fetchone()
+        paths = find_segments(self.segment_dir)
+        return {'snapshots': snapshots, 'videos': videos, 'segments': len(paths),
+                'bytes': sum(os.path.getsize(path) for path in paths)}
+
+    def close(self):
+        with self._lock:
+            try:
+                self._write_block()
+            finally:
+                if self._segment is not None:
+                    self._segment.close()
+                    self._segment = None
+                self._conn.close()
+
+
+def _derive_segment(path, fields, output_dir):
+    """Write the records of fields for every info dict in one segment to a new JSONL file. Returns: records written"""
+    projection = Projection(fields)
+    writer = create_writer(output_dir, output_format='jsonl')
+    count = 0
+    try:
+        for info in iter_segment(path):
+            writer.write(projection.build(info))
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def rederive(archive_dir, output_dir, fields=None, output_format='csv', processes=None,
+             blob_store=None, progress_callback=None):
+    """
+    Build records of fields from the archived info dicts, with no network access.
+    Segments are read by `processes` worker processes (default: one per core),
+    streaming; their records are then merged into one output file in
+    output_dir with the latest snapshot of each video, as the merge command does.
+    The merge holds sharding.MERGE_RUN_SIZE records in memory however many
+    segments there are, and spills its sorted runs next to the output.
+    Returns: (path of the output file, videos written, older snapshots dropped)
+    """
+    segment_dir = os.path.join(archive_dir, 'segments')
+    if not os.path.isdir(segment_dir):
+        raise ValueError(f"No raw archive in {archive_dir}")
+    paths = find_segments(segment_dir)
+    if not paths:
+        raise ValueError(f"The raw archive in {archive_dir} is empty")
+    fields = Projection(fields).fields
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='yt_rederive_', dir=output_dir) as temp_dir:
+        # spawn behaves the same on every platform, like sharded extract runs
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), mp_context=context) as pool:
+            futures = {
+                pool.submit(_derive_segment, path, fields, temp_dir): path for path in paths
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                count = future.result()
+                if progress_callback:
+                    progress_callback(f"Derived {count} records from {os.path.basename(futures[future])} "
+                                      f"({done}/{len(paths)} segments)")
+        return merge_outputs([temp_dir], output_dir, output_format, blob_store, temp_dir=output_dir)
@@ -0,0 +1,54 @@
+import threading
+
+
+class RunControl:
+    """
+    Pause/resume/cancel switch for a batch run, shared between the thread that
+    drives the run and the one that controls it (e.g. the GUI).
+    Cancelling stops new URLs from being dispatched; URLs already in flight finish.
+    """
+    def __init__(self):
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        # Wake up a paused run so it can notice the cancellation
+        self._running.set()
+
+    def wait(self):
+        """
+        Block while the run is paused.
+        Returns: False if the run has been cancelled, True otherwise
+        """
+        self._running.wait()
+        return not self.cancelled
+
+    def guard(self, items):
+        """Yield from items, pausing while paused and stopping once cancelled."""
+        for item in items:
+            if not self.wait():
+                return
+            yield item
+
+    def sleep(self, seconds):
+        """
+        Sleep for up to seconds, waking early once cancelled.
+        Returns: False if the run has been cancelled, True otherwise
+        """
+        return not self._cancelled.wait(seconds)
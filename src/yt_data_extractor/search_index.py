@@ -0,0 +1,277 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import zlib
+from collections import namedtuple
+
+# One result of SearchIndex.search
+SearchHit = namedtuple('SearchHit', ['video_id', 'title', 'upload_date', 'view_count', 'like_count', 'category'])
+
+# Posting kinds: normalised tag, word of the title, word of the description
+TAG, TITLE, DESCRIPTION = 'g', 't', 'd'
+
+# Record fields kept per video for range filters and sorting
+DOC_COLUMNS = ('title', 'upload_date', 'view_count', 'like_count', 'category', 'scrape_timestamp')
+SORT_COLUMNS = {'views': 'view_count DESC', 'likes': 'like_count DESC', 'date': 'upload_date DESC',
+                'oldest': 'upload_date ASC'}
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lower-case text and strip accents, so 'Café' and 'cafe' match."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """Returns: the set of words of text worth indexing (two characters or more)"""
+    if not text:
+        return set()
+    return {word for word in WORD_RE.findall(normalize(text)) if len(word) > 1}
+
+
+def normalize_tag(tag):
+    """One spelling per tag: '#Lo-Fi  Beats' becomes 'lo-fi beats'."""
+    return ' '.join(normalize(str(tag)).lstrip('#').split())
+
+
+def record_terms(record):
+    """Returns: {kind: set of terms} for the posting kinds whose field record holds"""
+    terms = {}
+    if 'tags' in record:
+        terms[TAG] = {normalize_tag(tag) for tag in record.get('tags') or []} - {''}
+    if 'title' in record:
+        terms[TITLE] = tokenize(record.get('title'))
+    if 'description' in record:
+        terms[DESCRIPTION] = tokenize(record.get('description'))
+    return terms
+
+
+def _pack_terms(terms):
+    lines = [f"{kind}{term}" for kind in sorted(terms) for term in sorted(terms[kind])]
+    return zlib.compress('\n'.join(lines).encode('utf-8'))
+
+
+def _unpack_terms(data):
+    terms = {}
+    if data:
+        for line in zlib.decompress(data).decode('utf-8').split('\n'):
+            if line:
+                terms.setdefault(line[0], set()).add(line[1:])
+    return terms
+
+
+class SearchIndex:
+    """
+    Incremental local search index over extracted records.
+
+    An inverted index maps every normalised tag and every title and description
+    word to the videos that have it, in an SQLite table clustered on the term,
+    so a lookup reads one contiguous range. Upload date, view count, like count
+    and category are kept per video with secondary indexes for range filters
+    and sorting. write() updates one video in place: only the postings of terms
+    that were added or removed are touched, and fields missing from a record
+    (e.g. with a smaller field set) keep their indexed values. A snapshot older
+    than the indexed one is ignored.
+
+    Records are applied commit_every at a time in one short transaction, so
+    several processes (e.g. shards) can add to the same index.
+
+    Pass the index to YouTubeExtractor as a sink to keep it current as runs write.
+    """
+    def __init__(self, path, index_descriptions=True, commit_every=1000, busy_timeout=60.0):
+        self.path = path
+        self.index_descriptions = index_descriptions
+        self.commit_every = commit_every
+        # (video_id, {column: value}, terms) of records not yet applied
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                "doc INTEGER PRIMARY KEY, video_id TEXT NOT NULL UNIQUE, title TEXT, upload_date TEXT, "
+                "view_count INTEGER, like_count INTEGER, category TEXT, scrape_timestamp TEXT, terms BLOB)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term TEXT NOT NULL, kind TEXT NOT NULL, doc INTEGER NOT NULL, "
+                "PRIMARY KEY (term, kind, doc)) WITHOUT ROWID"
+            )
+            for column in ('upload_date', 'view_count', 'like_count', 'category'):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS docs_{column} ON docs ({column})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, record):
+        """Index one extracted metadata record, replacing what was indexed for its video."""
+        video_id = record.get('video_id')
+        if not video_id:
+            return
+        terms = record_terms(record)
+        if not self.index_descriptions:
+            terms.pop(DESCRIPTION, None)
+        fields = {name: record[name] for name in DOC_COLUMNS if name in record}
+        with self._lock:
+            self._pending.append((video_id, fields, terms))
+            if len(self._pending) >= self.commit_every:
+                self._commit()
+
+    # Lets the index be passed to YouTubeExtractor as an extra output sink
+    write = add
+
+    def _commit(self):
+        """Apply the pending records in one transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with self._conn:
+                # Take the write lock up front: a read transaction cannot be
+                # upgraded while another process is writing
+                self._conn.execute('BEGIN IMMEDIATE')
+                for video_id, fields, terms in pending:
+                    self._apply(video_id, fields, terms)
+        except Exception:
+            self._pending = pending + self._pending
+            raise
+
+    def _apply(self, video_id, fields, terms):
+        old = self._conn.execute(
+            f"SELECT doc, {', '.join(DOC_COLUMNS)}, terms FROM docs WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if old is None:
+            values = [fields.get(name) for name in DOC_COLUMNS]
+            doc = self._conn.execute(
+                f"INSERT INTO docs (video_id, {', '.join(DOC_COLUMNS)}, terms) "
+                f"VALUES (?, {', '.join('?' * len(DOC_COLUMNS))}, ?)",
+                [video_id] + values + [_pack_terms(terms)]
+            ).lastrowid
+            old_terms = {}
+        else:
+            doc, old_values, old_terms = old[0], old[1:-1], _unpack_terms(old[-1])
+            old_timestamp = old_values[DOC_COLUMNS.index('scrape_timestamp')]
+            timestamp = fields.get('scrape_timestamp')
+            if old_timestamp and timestamp and old_timestamp > timestamp:
+                return
+            values = [fields[name] if name in fields else value for name, value in zip(DOC_COLUMNS, old_values)]
+            terms = dict(old_terms, **terms)
+            self._conn.execute(
+                f"UPDATE docs SET {', '.join(name + ' = ?' for name in DOC_COLUMNS)}, terms = ? WHERE doc = ?",
+                values + [_pack_terms(terms), doc]
+            )
+        removed = [(term, kind, doc) for kind, words in old_terms.items()
+                   for term in words - terms.get(kind, set())]
+        added = [(term, kind, doc) for kind, words in terms.items()
+                 for term in words - old_terms.get(kind, set())]
+        if removed:
+            self._conn.executemany("DELETE FROM postings WHERE term = ? AND kind = ? AND doc = ?", removed)
+        if added:
+            self._conn.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", added)
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def search(self, words=(), tags=(), category=None, date_from=None, date_to=None,
+               min_views=None, max_views=None, title_only=False, sort='views', limit=100):
+        """
+        Videos matching every condition given.
+        words: title or description words (title only with title_only); a trailing
+        '*' matches any word starting with the rest, e.g. 'tutor*'
+        tags: tags the video must all have, matched after normalize_tag()
+        category: exact category; date_from/date_to: YYYYMMDD upload date bounds
+        min_views/max_views: view count bounds
+        sort: 'views', 'likes', 'date' (newest first), 'oldest' or None
+        Returns: list of SearchHit
+        """
+        selects = []
+        params = []
+        kinds = (TITLE,) if title_only else (TITLE, DESCRIPTION)
+        kind_list = ', '.join('?' * len(kinds))
+        for word in words:
+            prefix = word.endswith('*')
+            term = normalize(word.rstrip('*')).strip()
+            if not term:
+                continue
+            if prefix:
+                selects.append(f"SELECT doc FROM postings WHERE term >= ? AND term < ? AND kind IN ({kind_list})")
+                params.extend([term, term + '\U0010ffff'])
+            else:
+                selects.append(f"SELECT doc FROM postings WHERE term = ? AND kind IN ({kind_list})")
+                params.append(term)
+            params.extend(kinds)
+        for tag in tags:
+            selects.append("SELECT doc FROM postings WHERE term = ? AND kind = ?")
+            params.extend([normalize_tag(tag), TAG])
+
+        conditions = []
+        if selects:
+            conditions.append(f"doc IN ({' INTERSECT '.join(selects)})")
+        for clause, value in (("category = ?", category), ("upload_date >= ?", date_from),
+                              ("upload_date <= ?", date_to), ("view_count >= ?", min_views),
+                              ("view_count <= ?", max_views)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        query = f"SELECT video_id, {', '.join(SearchHit._fields[1:])} FROM docs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if sort:
+            if sort not in SORT_COLUMNS:
+                raise ValueError(f"Unknown sort order: {sort}")
+            order = SORT_COLUMNS[sort]
+            ranges = {'view_count': (min_views, max_views), 'upload_date': (date_from, date_to)}
+            if any(value is not None for column, bounds in ranges.items()
+                   if not order.startswith(column) for value in bounds):
+                # SQLite would walk the sort column's index and test every row;
+                # a leading + makes it use the range's index and sort the matches
+                order = '+' + order
+            query += f" ORDER BY {order}"
+        query += " LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(query, params).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def top_tags(self, limit=20):
+        """Returns: [(tag, number of videos)] for the most used tags"""
+        with self._lock:
+            self._commit()
+            return self._conn.execute(
+                "SELECT term, COUNT(*) AS videos FROM postings WHERE kind = ? "
+                "GROUP BY term ORDER BY videos DESC LIMIT ?", (TAG, limit)
+            ).fetchall()
+
+    def stats(self):
+        """Returns: dict with the number of videos and postings indexed"""
+        with self._lock:
+            self._commit()
+            videos = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            postings = self._conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+        return {'videos': videos, 'postings': postings}
+
+    def __len__(self):
+        with self._lock:
+            self._commit()
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            try:
+                self._commit()
+                self._conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error closing search index: {str(e)}")
@@ -0,0 +1,152 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+from blob_store import BLOB_STORE_NAME
+from output_writers import READERS, create_writer, read_records
+from url_utils import canonical_url, video_id_from_url
+
+# Records held in memory while merging, whatever the number of inputs; the rest spill to temp files
+MERGE_RUN_SIZE = 100000
+
+
+def shard_key(url):
+    """The video ID of url, or its canonical spelling for playlists and other URLs."""
+    return video_id_from_url(url) or canonical_url(url)
+
+
+def shard_of(url, count):
+    """
+    Returns: the shard (0..count-1) that url belongs to. The hash is stable across
+    processes, machines and Python versions, so independent invocations agree.
+    """
+    digest = hashlib.blake2b(shard_key(url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def parse_shard(spec):
+    """
+    Parse a shard given as 'I/N' with I counted from 1, e.g. '2/4'.
+    Returns: (index, count) with index counted from 0
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard must look like I/N, e.g. 2/4: {spec}")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {max(count, 1)}: {spec}")
+    return index - 1, count
+
+
+def filter_shard(jobs, index, count):
+    """Yield the (position, url) jobs that belong to shard index of count."""
+    for job in jobs:
+        if shard_of(job[1], count) == index:
+            yield job
+
+
+def find_output_files(paths):
+    """
+    Expand directories into the output files inside them (recursively, leaving
+    out blob stores), sorted by path.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    if name != BLOB_STORE_NAME and os.path.splitext(name)[1][1:].lower() in READERS:
+                        found.append(os.path.join(root, name))
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def _sort_key(record):
+    # Ties on video_id and timestamp are broken by the record's content, so the
+    # result does not depend on which shard or file a record came from
+    text = json.dumps(record, ensure_ascii=False)
+    return record['video_id'], record.get('scrape_timestamp') or '', text
+
+
+def _sorted_runs(records, temp_dir, run_size):
+    """
+    Sort the keys of records in runs of run_size, spilling full runs to temp files.
+    Returns: (paths of the spilled runs, the last run, still in memory)
+    """
+    spilled = []
+    run = []
+    for record in records:
+        if not record.get('video_id'):
+            continue
+        run.append(_sort_key(record))
+        if len(run) >= run_size:
+            run.sort()
+            fd, path = tempfile.mkstemp(suffix='.jsonl', dir=temp_dir)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for key in run:
+                    f.write(json.dumps(key, ensure_ascii=False) + '\n')
+            spilled.append(path)
+            run = []
+    run.sort()
+    return spilled, run
+
+
+def _read_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def merge_records(paths, run_size=MERGE_RUN_SIZE, temp_dir=None):
+    """
+    Merge shard output files into one stream of records ordered by video_id, with
+    one record per video: the one with the latest scrape_timestamp. The result is
+    the same whatever the order of paths or how the input was sharded. Memory use
+    is bounded by run_size records in total, however many input files there are;
+    the input is sorted in runs of run_size that are spilled to disk, under
+    temp_dir if given.
+    Yields: (record, duplicates dropped before it)
+    """
+    with tempfile.TemporaryDirectory(prefix='yt_merge_', dir=temp_dir) as run_dir:
+        # One run fills up across file boundaries, so only the last run stays in memory
+        records = itertools.chain.from_iterable(read_records(path) for path in paths)
+        spilled, last_run = _sorted_runs(records, run_dir, run_size)
+        runs = [_read_run(spill) for spill in spilled]
+        runs.append(last_run)
+        duplicates = 0
+        pending = None
+        for key in heapq.merge(*runs):
+            if pending is not None:
+                if pending[0] == key[0]:
+                    duplicates += 1
+                else:
+                    yield json.loads(pending[2]), duplicates
+            pending = key
+        if pending is not None:
+            yield json.loads(pending[2]), duplicates
+
+
+def merge_outputs(paths, output_dir, output_format='csv', blob_store=None, temp_dir=None):
+    """
+    Merge shard outputs (files or directories) into one new output file, with
+    descriptions and tags going to blob_store if one is given. Sorted runs are
+    spilled under temp_dir (default: the system temp directory).
+    Returns: (path of the merged file, records written, duplicates dropped)
+    """
+    files = find_output_files(paths)
+    if not files:
+        raise ValueError(f"No output files found in: {', '.join(paths)}")
+    os.makedirs(output_dir, exist_ok=True)
+    writer = create_writer(output_dir, output_format=output_format, blob_store=blob_store)
+    count = duplicates = 0
+    try:
+        for record, duplicates in merge_records(files, temp_dir=temp_dir):
+            writer.write(record)
+            count += 1
+    finally:
+        writer.close()
+    return writer.path, count, duplicates
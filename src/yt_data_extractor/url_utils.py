@@ -0,0 +1,105 @@
+import re
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+# Path prefixes that are followed by the video ID, e.g. /shorts/<id>
+ID_PATH_PREFIXES = ('shorts', 'embed', 'v', 'e', 'live', 'watch')
+
+# Query parameters that never change which video or playlist a URL points at
+TRACKING_PARAMS = {'si', 'feature', 'pp', 't', 'start', 'ab_channel', 'app', 'index', 'fbclid', 'gclid'}
+
+YOUTUBE_HOSTS = ('youtube.com', 'youtube-nocookie.com')
+
+
+def _is_youtube_host(host):
+    return any(host == domain or host.endswith('.' + domain) for domain in YOUTUBE_HOSTS)
+
+
+def video_id_from_url(url):
+    """
+    Extract the 11-character YouTube video ID from a URL without calling yt-dlp.
+    Accepts watch, youtu.be, shorts, embed and live links on any youtube.com
+    subdomain (www., m., music.), attribution links and bare video IDs.
+    Returns: the video ID, or None if the URL does not point at a single video
+    """
+    url = url.strip()
+    if VIDEO_ID_RE.match(url):
+        return url
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    parts = [part for part in parsed.path.split('/') if part]
+
+    candidate = None
+    if host in ('youtu.be', 'www.youtu.be'):
+        candidate = parts[0] if parts else None
+    elif _is_youtube_host(host):
+        query = parse_qs(parsed.query)
+        if parts[:1] == ['watch'] and 'v' in query:
+            candidate = query['v'][0]
+        elif parts[:1] == ['attribution_link'] and 'u' in query:
+            return video_id_from_url('https://www.youtube.com' + query['u'][0])
+        elif len(parts) >= 2 and parts[0] in ID_PATH_PREFIXES:
+            candidate = parts[1]
+
+    if candidate and VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def canonical_url(url):
+    """
+    Return one spelling for every URL that points at the same thing.
+    Single videos become https://www.youtube.com/watch?v=<id>; other YouTube
+    URLs (playlists, channels) get the www.youtube.com host, no fragment and no
+    tracking parameters. URLs on other sites are returned as given, stripped of
+    surrounding whitespace, since their query parameters may matter.
+    """
+    video_id = video_id_from_url(url)
+    if video_id is not None:
+        return f"https://www.youtube.com/watch?v={video_id}"
+    url = url.strip()
+    parsed = urlparse(url if '://' in url else 'https://' + url)
+    if not _is_youtube_host((parsed.hostname or '').lower()):
+        return url
+    host = 'www.youtube.com'
+    query = sorted(
+        (key, value) for key, value in parse_qs(parsed.query).items()
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    )
+    return urlunparse((
+        'https', host, parsed.path.rstrip('/') or '/', '', urlencode(query, doseq=True), ''
+    ))
+
+
+# First path segments of YouTube channel pages
+CHANNEL_PATH_PREFIXES = ('channel', 'c', 'user')
+
+
+def is_collection_url(url):
+    """Returns: True if url is a YouTube playlist or channel rather than a single video"""
+    if video_id_from_url(url) is not None:
+        return False
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    if not _is_youtube_host((parsed.hostname or '').lower()):
+        return False
+    if 'list' in parse_qs(parsed.query):
+        return True
+    return is_channel_url(url)
+
+
+def is_channel_url(url):
+    """Returns: True if url is a YouTube channel page or tab (not a playlist), e.g. /@name/videos"""
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    if not _is_youtube_host((parsed.hostname or '').lower()) or 'list' in parse_qs(parsed.query):
+        return False
+    parts = [part for part in parsed.path.split('/') if part]
+    return bool(parts) and (parts[0].startswith('@') or parts[0] in CHANNEL_PATH_PREFIXES)
@@ -0,0 +1,330 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from metrics_history import parse_timestamp
+from rate_control import PERMANENT, AdaptiveRateController
+from url_utils import canonical_url, video_id_from_url
+
+# One video due for a refresh; priority is the time since its last scrape over
+# its refresh interval (None if it was never scraped)
+WatchEntry = namedtuple('WatchEntry', ['video_id', 'url', 'priority', 'last_scrape_ts', 'interval'])
+
+HOUR = 3600
+DAY = 86400
+
+
+def _count(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _upload_ts(upload_date):
+    """Seconds since the epoch for a YYYYMMDD upload date, or None"""
+    try:
+        return int(datetime.strptime(str(upload_date), '%Y%m%d').timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(old_rate, old_count, new_count, hours):
+    """Growth per hour between two snapshots, smoothed with the previous rate."""
+    if old_count is None or new_count is None or hours <= 0:
+        return old_rate
+    measured = max(new_count - old_count, 0) / hours
+    return measured if old_rate is None else (old_rate + measured) / 2
+
+
+class Watchlist:
+    """
+    Persistent list of videos to re-scrape, each at its own frequency.
+
+    After every scrape a video's refresh interval is set from its upload age
+    (age_factor of it: a day-old video every 2.4 hours, a month-old one every
+    3 days) and shortened by its recent view and like growth: a video gaining
+    10% of its views a day is refreshed growth_weight / 10 + 1 times as often.
+    The interval stays between min_interval and max_interval seconds.
+
+    due() is the priority queue: videos whose next_due time has passed, the
+    never-scraped first, then by time since the last scrape over the interval,
+    so when the budget is short the most overdue videos go first. spend() and
+    spent() keep a sliding hour of requests for the budget. Everything is in
+    one SQLite file, so a restarted scheduler carries on where it stopped.
+
+    Pass the watchlist to YouTubeExtractor as a sink so every record written
+    updates the schedule; records of videos not on the list are ignored.
+    """
+    def __init__(self, path, min_interval=HOUR, max_interval=30 * DAY, age_factor=0.1, growth_weight=10.0,
+                 commit_every=100):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.age_factor = age_factor
+        self.growth_weight = growth_weight
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS watch ("
+                "video_id TEXT PRIMARY KEY, url TEXT NOT NULL, added_ts INTEGER NOT NULL, upload_ts INTEGER, "
+                "last_scrape_ts INTEGER, views INTEGER, likes INTEGER, view_rate REAL, like_rate REAL, "
+                "interval REAL, next_due INTEGER NOT NULL, failures INTEGER NOT NULL DEFAULT 0, "
+                "active INTEGER NOT NULL DEFAULT 1)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS watch_due ON watch (active, next_due)")
+            # One row per request spent, kept for an hour
+            self._conn.execute("CREATE TABLE IF NOT EXISTS spent (ts REAL NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, urls):
+        """
+        Watch the videos at urls, due at once. A video already on the list keeps
+        its schedule but is watched again if it had been dropped.
+        Returns: (videos added, URLs skipped because they are not single videos)
+        """
+        added = skipped = 0
+        now = int(time.time())
+        with self._lock:
+            for url in urls:
+                video_id = video_id_from_url(url)
+                if video_id is None:
+                    skipped += 1
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO watch (video_id, url, added_ts, next_due) VALUES (?, ?, ?, ?)",
+                    (video_id, canonical_url(url), now, now)
+                )
+                if cursor.rowcount:
+                    added += 1
+                else:
+                    self._conn.execute(
+                        "UPDATE watch SET active = 1, failures = 0, next_due = MIN(next_due, ?) "
+                        "WHERE video_id = ? AND active = 0", (now, video_id)
+                    )
+            self._conn.commit()
+        return added, skipped
+
+    def remove(self, video_ids):
+        """Returns: the number of videos taken off the list"""
+        with self._lock:
+            removed = self._conn.executemany("DELETE FROM watch WHERE video_id = ?",
+                                             [(video_id,) for video_id in video_ids]).rowcount
+            self._conn.commit()
+        return removed
+
+    def refresh_interval(self, age, views=None, view_rate=None, likes=None, like_rate=None):
+        """Seconds until a video of this age (seconds, None if unknown) and growth per hour is due again."""
+        interval = age * self.age_factor if age is not None else DAY
+        # Growth as a fraction of the count per day; small counts are not
+        # allowed to make a handful of new views look like a surge
+        growth = max(
+            (view_rate or 0) * 24 / max(views or 0, 1000),
+            (like_rate or 0) * 24 / max(likes or 0, 100),
+        )
+        interval /= 1 + self.growth_weight * growth
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def record(self, record):
+        """Reschedule the video of one extracted metadata record from its new counts."""
+        video_id = record.get('video_id')
+        if not video_id:
+            return
+        ts = parse_timestamp(record.get('scrape_timestamp'))
+        views = _count(record.get('view_count'))
+        likes = _count(record.get('like_count'))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT upload_ts, last_scrape_ts, views, likes, view_rate, like_rate FROM watch WHERE video_id = ?",
+                (video_id,)
+            ).fetchone()
+            if row is None:
+                return
+            upload_ts, last_ts, old_views, old_likes, view_rate, like_rate = row
+            if last_ts is not None and ts <= last_ts:
+                # An older snapshot, e.g. a cache hit; the schedule already reflects it
+                return
+            upload_ts = _upload_ts(record.get('upload_date')) or upload_ts
+            if last_ts is not None:
+                hours = (ts - last_ts) / HOUR
+                view_rate = _rate(view_rate, old_views, views, hours)
+                like_rate = _rate(like_rate, old_likes, likes, hours)
+            views = old_views if views is None else views
+            likes = old_likes if likes is None else likes
+            age = max(ts - upload_ts, 0) if upload_ts is not None else None
+            interval = self.refresh_interval(age, views, view_rate, likes, like_rate)
+            self._conn.execute(
+                "UPDATE watch SET upload_ts = ?, last_scrape_ts = ?, views = ?, likes = ?, view_rate = ?, "
+                "like_rate = ?, interval = ?, next_due = ?, failures = 0 WHERE video_id = ?",
+                (upload_ts, ts, views, likes, view_rate, like_rate, interval, int(ts + interval), video_id)
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    # Lets the watchlist be passed to YouTubeExtractor as an extra output sink
+    write = record
+
+    def failed(self, url, kind=None):
+        """
+        Reschedule a video whose refresh failed: permanent failures (removed or
+        private videos) stop watching it, others retry after an exponential backoff.
+        """
+        video_id = video_id_from_url(url)
+        if video_id is None:
+            return
+        with self._lock:
+            if kind == PERMANENT:
+                self._conn.execute("UPDATE watch SET active = 0 WHERE video_id = ?", (video_id,))
+            else:
+                row = self._conn.execute("SELECT failures FROM watch WHERE video_id = ?", (video_id,)).fetchone()
+                if row is None:
+                    return
+                delay = min(self.min_interval * 2 ** row[0], self.max_interval)
+                self._conn.execute(
+                    "UPDATE watch SET failures = failures + 1, next_due = ? WHERE video_id = ?",
+                    (int(time.time() + delay), video_id)
+                )
+            self._uncommitted += 1
+
+    def due(self, limit, now=None):
+        """Returns: up to limit WatchEntries due at now (default: now), most urgent first"""
+        now = int(time.time()) if now is None else int(now)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT video_id, url, (? - last_scrape_ts) / interval AS priority, last_scrape_ts, interval "
+                "FROM watch WHERE active = 1 AND next_due <= ? "
+                "ORDER BY last_scrape_ts IS NOT NULL, priority DESC LIMIT ?", (now, now, limit)
+            ).fetchall()
+        return [WatchEntry(*row) for row in rows]
+
+    def spend(self, requests, now=None):
+        """Count requests against the hourly budget."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.executemany("INSERT INTO spent VALUES (?)", [(now,)] * requests)
+            self._conn.execute("DELETE FROM spent WHERE ts <= ?", (now - HOUR,))
+            self._conn.commit()
+
+    def spent(self, now=None):
+        """Returns: requests spent in the last hour"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spent WHERE ts > ?", (now - HOUR,)).fetchone()[0]
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def stats(self, now=None):
+        """Returns: dict with the number of videos watched, dropped, due now and requests spent in the last hour"""
+        now = int(time.time()) if now is None else int(now)
+        with self._lock:
+            active, dropped, due = self._conn.execute(
+                "SELECT COALESCE(SUM(active = 1), 0), COALESCE(SUM(active = 0), 0), "
+                "COALESCE(SUM(active = 1 AND next_due <= ?), 0) FROM watch", (now,)
+            ).fetchone()
+            spent = self._conn.execute("SELECT COUNT(*) FROM spent WHERE ts > ?", (now - HOUR,)).fetchone()[0]
+        return {'watched': active, 'dropped': dropped, 'due': due, 'spent_last_hour': spent}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM watch WHERE active = 1").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.commit()
+                self._conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error closing watchlist: {str(e)}")
+
+
+class WatchScheduler:
+    """
+    Long-lived loop refreshing a Watchlist through a YouTubeExtractor.
+
+    Every poll_interval seconds it takes the most urgent due videos and runs
+    them through extractor.extract_concurrent like any batch, so the
+    extractor's output, sinks, cache and rate control all apply. The extractor
+    must have the watchlist among its sinks and force_refresh set, or cache
+    hits would leave videos due. At most budget_per_hour videos are refreshed
+    in any sliding hour, spread evenly: one cycle takes at most its share of
+    the hour's budget. Output and sinks are flushed after every cycle and one
+    output file is written per run(). One rate controller is kept for all
+    cycles, so a rate cut or circuit-breaker pause carries over to the next poll.
+    """
+    def __init__(self, watchlist, extractor, budget_per_hour=1000, poll_interval=60, workers=4, max_rps=None):
+        self.watchlist = watchlist
+        self.extractor = extractor
+        self.budget_per_hour = budget_per_hour
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self.max_rps = max_rps
+        self.batch_size = max(1, math.ceil(budget_per_hour * poll_interval / HOUR))
+        self.rate_controller = AdaptiveRateController(max_rps or None, max_retries=extractor.fetch_retries)
+        self.refreshed = 0
+        self.failed = 0
+
+    def run_once(self, progress_callback=None, control=None):
+        """Refresh the videos due now, within the budget. Returns: (videos refreshed, videos failed)"""
+        allowance = min(self.batch_size, self.budget_per_hour - self.watchlist.spent())
+        entries = self.watchlist.due(allowance) if allowance > 0 else []
+        if not entries:
+            return 0, 0
+        self.watchlist.spend(len(entries))
+        refreshed = failed = 0
+        urls = [entry.url for entry in entries]
+        results = self.extractor.extract_concurrent(urls, self.workers, self.max_rps, progress_callback, control,
+                                                    rate_controller=self.rate_controller)
+        for result in results:
+            if result.success:
+                refreshed += 1
+            else:
+                failed += 1
+                self.watchlist.failed(result.url, result.error)
+        if self.extractor.writer is not None:
+            self.extractor.writer.flush()
+        for sink in self.extractor.sinks:
+            sink.flush()
+        self.refreshed += refreshed
+        self.failed += failed
+        return refreshed, failed
+
+    def run(self, progress_callback=None, control=None, max_cycles=None):
+        """Poll until control (a run_control.RunControl) is cancelled or after max_cycles cycles."""
+        cycles = 0
+        # Held open across cycles so the run writes one output file
+        self.extractor.open_writer()
+        while not (control and control.cancelled):
+            started = time.monotonic()
+            refreshed, failed = self.run_once(progress_callback, control)
+            cycles += 1
+            if progress_callback and (refreshed or failed):
+                progress_callback(f"Refreshed {refreshed} videos, {failed} failed; "
+                                  f"{self.watchlist.spent()}/{self.budget_per_hour} requests this hour")
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            delay = max(self.poll_interval - (time.monotonic() - started), 0)
+            if control is not None:
+                control.sleep(delay)
+            else:
+                time.sleep(delay)
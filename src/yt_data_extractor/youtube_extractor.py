@@ -1,56 +1,723 @@
-import yt_dlp
-import csv
 import os
 import logging
-from datetime import datetime
+import itertools
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
 from pathlib import Path
+from batch_journal import BatchJournal
+from dedupe import Deduplicator
+from instrumentation import NULL_METRICS
+from output_writers import RESUMABLE_FORMATS, create_writer
+from pipeline import Pipeline, Stage
+from rate_control import PERMANENT, RATE_LIMITED, AdaptiveRateController, classify_error
+from records import Projection
+from sharding import filter_shard
+from url_utils import canonical_url, is_channel_url, is_collection_url, video_id_from_url
+
+# One finished URL from extract_concurrent; index is the URL's position in the input
+# and error the rate_control error kind of a failure (None on success)
+BatchResult = namedtuple('BatchResult', ['index', 'url', 'success', 'worker', 'elapsed', 'error'])
+
+
+class KnownFailure(Exception):
+    """The metadata cache remembers that this URL failed permanently; it is not fetched again."""
+    def __init__(self, url, message):
+        super().__init__(f"{url} failed permanently before: {message}")
+        self.url = url
+        self.message = message
+
+
+class _Job:
+    """One URL on its way through the extract_concurrent pipeline."""
+    __slots__ = ('index', 'url', 'info', 'record', 'source', 'error', 'worker', 'started')
+
+    def __init__(self, index, url):
+        self.index = index
+        self.url = url
+        self.info = None
+        self.record = None
+        self.source = 'cache'
+        self.error = None
+        self.worker = None
+        self.started = None
+
 
 class YouTubeExtractor:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, shared_session=False, output_mode='batch', output_format='csv',
+                 cache=None, force_refresh=False, dedupe='auto', playlist_limit=None, playlist_date_after=None,
+                 journal_path=None, max_retries=3, sinks=None, metrics=None, fetch_retries=3, shard=None,
+                 fields=None, blob_store=None, archive=None):
         self.output_dir = output_dir
         self.ydl_opts = {
             'quiet': True,
             'no_warnings': True,
             'extract_flat': True
         }
-        
+        # When True, extract_metadata reuses one YoutubeDL instance across
+        # calls until close() is called instead of building one per URL.
+        self.shared_session = shared_session
+        self._session = None
+        # 'batch' streams a whole run into one file, 'per_url' is the legacy
+        # one-CSV-per-video behaviour, 'none' only feeds the sinks
+        self.output_mode = output_mode
+        # Output backend, one of output_writers.WRITERS
+        self.output_format = output_format
+        self.writer = None
+        # Optional blob_store.BlobStore: output files then hold references to
+        # descriptions and tags stored there once. The caller closes it.
+        self.blob_store = blob_store
+        # Optional metadata_cache.MetadataCache consulted before going to the network;
+        # force_refresh skips the lookup but still stores the fresh result
+        self.cache = cache
+        self.force_refresh = force_refresh
+        # De-duplication mode for batch runs ('auto', 'memory', 'bloom' or None to
+        # disable); the last run's Deduplicator is kept for its counters
+        self.dedupe = dedupe
+        self.deduplicator = None
+        # Playlist and channel URLs in a batch are expanded into their videos,
+        # stopping after playlist_limit entries or at the first video uploaded
+        # before playlist_date_after (YYYYMMDD)
+        self.playlist_limit = playlist_limit
+        self.playlist_date_after = playlist_date_after
+        # With a journal_path, batch runs record their progress there and pick up
+        # where a crashed run stopped, retrying failed URLs up to max_retries times
+        self.journal_path = journal_path
+        self.max_retries = max_retries
+        self.journal = None
+        # Fields of every record: None for records.DEFAULT_FIELDS, a preset name
+        # or a list of names from records.FIELDS
+        self.projection = Projection(fields)
+        # With shard=(index, count), batch runs only process the videos that
+        # sharding.shard_of assigns to shard index (counted from 0), so count
+        # processes or machines can split one batch between them
+        self.shard = shard
+        # Transient and rate-limited fetch errors are retried up to fetch_retries
+        # times within a run, with backoff; the last run's
+        # rate_control.AdaptiveRateController is kept for its stats
+        self.fetch_retries = fetch_retries
+        self.rate_controller = None
+        # Optional raw_archive.RawArchive receiving yt-dlp's full info dict of
+        # every video fetched from the network (not of cache hits), before
+        # projection, so other fields can be derived later. The caller closes it.
+        self.archive = archive
+        # Extra destinations that receive every record after the writer, e.g. a
+        # master_store.MasterStore; anything with a write(record) method. The
+        # caller owns them and closes them.
+        self.sinks = list(sinks or [])
+        # instrumentation.Metrics collecting stage timings, counters and structured
+        # events; the default records nothing
+        self.metrics = metrics or NULL_METRICS
+        # Per-thread sessions used by extract_concurrent
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Held while a record is written and journaled, and while the journal checkpoints
+        self._write_lock = threading.Lock()
+        self._worker_sessions = []
+        self.worker_stats = {}
+        self.batch_wall_time = 0.0
+        # pipeline.Pipeline of the running or last extract_concurrent run
+        self.pipeline = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _new_session(self):
+        """Create a YoutubeDL instance configured with this extractor's options."""
+        # yt-dlp is imported on first use so that startup (and cache-only runs)
+        # do not pay for loading its extractors
+        import yt_dlp
+        return yt_dlp.YoutubeDL(self.ydl_opts)
+
+    def open_session(self):
+        """
+        Return the long-lived YoutubeDL session, creating it on first use.
+        The session keeps its connection pool and cookie jar between URLs.
+        """
+        if self._session is None:
+            self._session = self._new_session()
+        return self._session
+
+    def close(self):
+        """Tear down the YoutubeDL sessions and the run's output writer."""
+        self.close_writer()
+        self.close_session()
+        self._close_worker_sessions()
+
+    def close_session(self):
+        """Tear down the long-lived YoutubeDL session, if one is open."""
+        if self._session is None:
+            return
+        try:
+            self._session.close()
+        except Exception as e:
+            logging.error(f"Error closing yt-dlp session: {str(e)}")
+        finally:
+            self._session = None
+
+    def open_writer(self):
+        """Return the output writer for the current run, creating it on first use."""
+        with self._lock:
+            if self.writer is None:
+                self.writer = create_writer(self.output_dir, self.output_mode, self.output_format,
+                                            self.blob_store)
+            return self.writer
+
+    def close_writer(self):
+        """Flush and close the current run's output file."""
+        with self._lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+            if self.metrics.enabled and writer.path and os.path.isfile(writer.path):
+                self.metrics.incr('bytes_written', os.path.getsize(writer.path))
+
     def extract_metadata(self, url, progress_callback=None):
+        owns_session = self._session is None and not self.shared_session
+        owns_writer = self.writer is None
         try:
+            success, _ = self._extract(url, self.open_session, progress_callback, self._new_rate_controller())
+            return success
+        finally:
+            if owns_writer:
+                self.close_writer()
+                self.metrics.export()
+            if owns_session:
+                self.close_session()
+
+    def expand_url(self, url, max_entries=None, date_after=None):
+        """
+        Lazily yield the video URLs of a playlist or channel.
+        Entries are pulled from yt-dlp page by page as the caller consumes them,
+        so large channels are never held in memory. Stops after max_entries videos.
+        Entries uploaded before date_after (YYYYMMDD) are skipped; a channel tab
+        lists its uploads newest first, so its expansion stops at the first one.
+        Flat entries carry no upload_date or timestamp for some playlists and
+        channels; they always pass the date_after filter.
+        """
+        with self._new_session() as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            entries = self._iter_entries(ydl, info, date_after)
+            yield from itertools.islice(entries, max_entries)
+
+    def _iter_entries(self, ydl, info, date_after, depth=0):
+        if info.get('_type') == 'url' and depth < 3 and info.get('url'):
+            # Channel root URLs redirect to one of their tabs
+            info = ydl.extract_info(info['url'], download=False, process=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            if info.get('id'):
+                yield canonical_url(info.get('webpage_url') or info.get('url') or info['id'])
+            return
+        # Only channel tabs are sorted by upload date; playlists can be in any order
+        newest_first = is_channel_url(info.get('webpage_url') or info.get('original_url') or '')
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            if entry.get('_type') == 'playlist' and depth < 3:
+                # Channel pages list their tabs as nested playlists
+                yield from self._iter_entries(ydl, entry, date_after, depth + 1)
+                continue
+            if entry.get('_type') == 'url' and is_collection_url(entry.get('url') or '') and depth < 3:
+                nested = ydl.extract_info(entry['url'], download=False, process=False)
+                yield from self._iter_entries(ydl, nested, date_after, depth + 1)
+                continue
+            upload_date = entry.get('upload_date')
+            if upload_date is None and entry.get('timestamp'):
+                upload_date = datetime.fromtimestamp(entry['timestamp'], timezone.utc).strftime('%Y%m%d')
+            if date_after and upload_date and upload_date < date_after:
+                if newest_first:
+                    return
+                continue
+            video_url = entry.get('url') or entry.get('id')
+            if video_url:
+                yield canonical_url(video_url)
+
+    def _expand_jobs(self, urls, progress_callback=None):
+        for index, url in enumerate(urls):
+            url = url.strip()
+            if not is_collection_url(url):
+                yield index, url
+                continue
             if progress_callback:
-                progress_callback(f"Processing URL: {url}")
-                
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                metadata = {
-                    'video_id': info.get('id'),
-                    'title': info.get('title'),
-                    'upload_date': info.get('upload_date'),
-                    'view_count': info.get('view_count'),
-                    'like_count': info.get('like_count'),
-                    'duration': info.get('duration'),
-                    'tags': '|'.join(info.get('tags', [])),
-                    'category': info.get('category'),
-                    'description': info.get('description'),
-                    'scrape_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                # Save to CSV
-                csv_path = os.path.join(self.output_dir, f"metadata_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-                if progress_callback:
-                    progress_callback(f"Saving metadata to: {csv_path}")
-                    
-                with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=metadata.keys())
-                    writer.writeheader()
-                    writer.writerow(metadata)
-                
+                progress_callback(f"Expanding playlist: {url}")
+            try:
+                for video_url in self.expand_url(url, self.playlist_limit, self.playlist_date_after):
+                    yield index, video_url
+            except Exception as e:
                 if progress_callback:
-                    progress_callback(f"Successfully processed: {url}")
-                return True
-                
+                    progress_callback(f"Error expanding {url}: {str(e)}")
+                logging.error(f"Error expanding {url}: {str(e)}")
+
+    def _iter_jobs(self, urls, progress_callback=None, control=None):
+        """
+        Number the input URLs, expand playlists and channels into their videos,
+        keep this extractor's shard, drop duplicates and skip URLs the journal
+        has already finished. Each job keeps the input position of the URL it came from.
+        A run_control.RunControl pauses or stops the flow of jobs.
+        """
+        jobs = self._expand_jobs(urls, progress_callback)
+        if self.shard is not None:
+            # Equivalent URLs share a shard, so de-duplicating afterwards only
+            # has to remember this shard's URLs
+            jobs = filter_shard(jobs, *self.shard)
+        if not self.dedupe:
+            self.deduplicator = None
+        else:
+            self.deduplicator = Deduplicator(self.dedupe)
+            jobs = self.deduplicator.filter(jobs)
+        if self.journal is not None:
+            jobs = self.journal.filter(jobs)
+        if control is not None:
+            jobs = control.guard(jobs)
+        return jobs
+
+    def _open_journal(self, progress_callback=None):
+        """Open the run journal, continuing the output of a crashed run if there is one."""
+        if self.journal_path is None:
+            self.journal = None
+            return
+        resumable = self.output_mode == 'none' or (
+            self.output_mode == 'batch' and self.output_format in RESUMABLE_FORMATS
+        )
+        if not resumable:
+            raise ValueError(
+                f"Resumable runs need batch output in one of: {', '.join(RESUMABLE_FORMATS)}"
+            )
+        self.journal = BatchJournal(self.journal_path, self.max_retries)
+        if self.journal.output is not None:
+            try:
+                self.open_writer().resume(*self.journal.output)
+            except Exception:
+                # Keep the journal file: the run can still be resumed once its output is back
+                self.journal.close()
+                self.journal = None
+                raise
+        if self.journal.resumed and progress_callback:
+            progress_callback(f"Resuming batch from journal: {self.journal_path}")
+
+    def _record_result(self, url, success, error=None):
+        """Journal a failed URL; successes are journaled by _write_record as their row is written."""
+        if self.journal is not None and not success:
+            with self._write_lock:
+                self.journal.record(url, False, self.open_writer(), self.sinks, permanent=error == PERMANENT)
+
+    def _new_rate_controller(self, max_rps=None):
+        self.rate_controller = AdaptiveRateController(max_rps or None, max_retries=self.fetch_retries)
+        return self.rate_controller
+
+    def _record_rate_stats(self, trips_before=0):
+        if self.rate_controller is not None:
+            self.metrics.incr('breaker_trips', self.rate_controller.breaker_trips - trips_before)
+
+    def _close_journal(self, completed):
+        """Checkpoint the journal and delete it if the run has nothing left to resume."""
+        journal = self.journal
+        if journal is None:
+            return
+        self.metrics.incr('retries', journal.retried)
+        try:
+            with self._write_lock:
+                journal.checkpoint(self.open_writer(), self.sinks)
+        finally:
+            journal.close(remove=completed and journal.retryable_failures() == 0)
+
+    def journal_skipped(self):
+        """Returns: how many URLs the last run skipped because the journal had finished them"""
+        return self.journal.skipped if self.journal else 0
+
+    def rate_summary(self):
+        """Returns: a sentence on how the last run was throttled, or None if it never was"""
+        if self.rate_controller is None:
+            return None
+        stats = self.rate_controller.stats()
+        if not stats['rate_limited'] and not stats['breaker_trips']:
+            return None
+        summary = f"Rate limited {stats['rate_limited']} times"
+        if stats['min_rate'] is not None:
+            summary += f", slowed to {stats['min_rate']:.2f} requests/second"
+        if stats['breaker_trips']:
+            summary += f", paused {stats['breaker_trips']} times"
+        return summary
+
+    def duplicates_dropped(self):
+        """Returns: how many duplicate URLs the last batch run skipped"""
+        return self.deduplicator.dropped if self.deduplicator else 0
+
+    def extract_many(self, urls, progress_callback=None, control=None):
+        """
+        Extract metadata for every URL in urls through one reused YoutubeDL session.
+        Playlist and channel URLs are expanded into their videos, and equivalent
+        URLs are only fetched once unless de-duplication is disabled.
+        Yields (url, success) tuples as each URL finishes. The session is torn down
+        when the iterator is exhausted or closed, unless the extractor was created
+        with shared_session=True or a session was already open.
+        control is an optional run_control.RunControl to pause or cancel the run.
+        """
+        owns_session = self._session is None and not self.shared_session
+        owns_writer = self.writer is None
+        completed = False
+        limiter = self._new_rate_controller()
+        self._open_journal(progress_callback)
+        self.metrics.event('run_start', workers=1)
+        try:
+            for index, url in self._iter_jobs(urls, progress_callback, control):
+                success, error = self._extract(url, self.open_session, progress_callback, limiter)
+                self._record_result(url, success, error)
+                yield url, success
+            completed = not (control and control.cancelled)
+        finally:
+            self._close_journal(completed)
+            if owns_writer:
+                self.close_writer()
+            if owns_session:
+                self.close_session()
+            self._record_rate_stats()
+            self.metrics.event('run_end', completed=completed)
+            self.metrics.export()
+
+    def extract_concurrent(self, urls, workers=4, max_rps=None, progress_callback=None, control=None,
+                           transform_workers=1, write_workers=1, queue_size=None, max_in_flight=None,
+                           memory_limit_mb=None, rate_controller=None):
+        """
+        Extract metadata for urls through a staged pipeline (see pipeline.Pipeline):
+        a reader expanding and filtering the input, `workers` fetch threads each
+        with its own long-lived YoutubeDL session, transform_workers threads
+        building records, and write_workers threads writing them. Stages are
+        joined by queues of queue_size items (default: twice the stage's workers),
+        and at most max_in_flight URLs (default: four per fetch worker) are
+        between the reader and the caller at once; with memory_limit_mb the
+        reader also holds back while resident memory is above that many MB.
+        So urls may be a lazy iterator of any length. max_rps caps requests per
+        second per host. The running pipeline's stats are in pipeline_stats().
+        Yields BatchResult tuples in completion order. progress_callback is
+        called from the stage threads. control is an optional
+        run_control.RunControl; cancelling lets the URLs already in flight finish.
+        rate_controller is an AdaptiveRateController to carry on with (e.g. one
+        kept across the cycles of a polling loop) instead of a new one from max_rps.
+        """
+        if rate_controller is not None:
+            self.rate_controller = limiter = rate_controller
+        else:
+            limiter = self._new_rate_controller(max_rps)
+        # A carried-over controller has already counted earlier runs' trips
+        trips_before = limiter.breaker_trips
+        owns_writer = self.writer is None
+        completed = False
+        self.worker_stats = {}
+        started = time.monotonic()
+        self._open_journal(progress_callback)
+        self.metrics.event('run_start', workers=workers)
+        self.pipeline = Pipeline([
+            Stage('fetch', lambda job: self._fetch_stage(job, limiter, progress_callback), workers, queue_size),
+            Stage('transform', self._transform_stage, transform_workers, queue_size),
+            Stage('write', lambda job: self._write_stage(job, progress_callback), write_workers, queue_size),
+        ], max_in_flight=max_in_flight or workers * 4, memory_limit_mb=memory_limit_mb)
+        jobs = (_Job(index, url) for index, url in self._iter_jobs(urls, progress_callback, control))
+        try:
+            for job in self.pipeline.run(jobs):
+                kind = None
+                if job.error is not None:
+                    kind = self._handle_failure(job.url, job.error, job.source, job.started, progress_callback)
+                result = BatchResult(job.index, job.url, job.error is None, job.worker,
+                                     time.perf_counter() - job.started if job.started else 0.0, kind)
+                self._record_result(result.url, result.success, result.error)
+                yield result
+            completed = not (control and control.cancelled)
+        finally:
+            self._close_worker_sessions()
+            self._close_journal(completed)
+            if owns_writer:
+                self.close_writer()
+            self.batch_wall_time = time.monotonic() - started
+            self._record_rate_stats(trips_before)
+            self._record_pipeline_stats()
+            self.metrics.event('run_end', completed=completed)
+            self.metrics.export()
+
+    def pipeline_stats(self):
+        """Returns: pipeline.Pipeline.stats() of the running or last extract_concurrent run, or None"""
+        return self.pipeline.stats() if self.pipeline is not None else None
+
+    def _record_pipeline_stats(self):
+        for name, stats in self.pipeline.stats().items():
+            if name != 'reader':
+                self.metrics.incr('stage_stall_seconds', stats['stall_seconds'], label=name)
+                self.metrics.incr('stage_idle_seconds', stats['idle_seconds'], label=name)
+        self.metrics.incr('stage_stall_seconds', round(self.pipeline.reader_stalled, 3), label='reader')
+
+    def worker_utilisation(self):
+        """
+        Report how busy each fetch worker was during the last extract_concurrent run.
+        Time spent waiting on the rate limiter or backing off before a retry
+        counts as throttled, not busy.
+        Returns: {worker name: {'items': n, 'busy_seconds': s, 'throttled_seconds': s, 'utilisation': 0..1}}
+        """
+        wall = self.batch_wall_time or 1e-9
+        with self._lock:
+            return {
+                name: {
+                    'items': stats['items'],
+                    'busy_seconds': round(stats['busy'], 3),
+                    'throttled_seconds': round(stats['throttled'], 3),
+                    'utilisation': round(min(stats['busy'] / wall, 1.0), 3)
+                }
+                for name, stats in sorted(self.worker_stats.items())
+            }
+
+    def _fetch_stage(self, job, limiter, progress_callback):
+        """Pipeline stage: the cached record of job's URL, or yt-dlp's info dict for it."""
+        job.worker = threading.current_thread().name
+        job.started = time.perf_counter()
+        self._local.throttled = 0.0
+        try:
+            if progress_callback:
+                progress_callback(f"Processing URL: {job.url}")
+            job.record = self._lookup(job.url, progress_callback)
+            if job.record is None:
+                job.source = 'network'
+                job.info = self._fetch_info(job.url, self._worker_session, limiter, progress_callback)
+        finally:
+            elapsed = time.perf_counter() - job.started
+            throttled = self._local.throttled
+            with self._lock:
+                stats = self.worker_stats.setdefault(job.worker, {'items': 0, 'busy': 0.0, 'throttled': 0.0})
+                stats['items'] += 1
+                stats['busy'] += elapsed - throttled
+                stats['throttled'] += throttled
+
+    def _transform_stage(self, job):
+        """Pipeline stage: build the record from the fetched info dict."""
+        if job.record is None:
+            info, job.info = job.info, None
+            job.record = self._transform(info)
+
+    def _write_stage(self, job, progress_callback):
+        """Pipeline stage: write the record to the output and the sinks."""
+        self._write_record(job.url, job.record, job.source, job.started, progress_callback)
+        job.record = None
+
+    def _worker_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._new_session()
+            self._local.session = session
+            with self._lock:
+                self._worker_sessions.append(session)
+        return session
+
+    def _close_worker_sessions(self):
+        with self._lock:
+            sessions, self._worker_sessions = self._worker_sessions, []
+        self._local = threading.local()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                logging.error(f"Error closing yt-dlp session: {str(e)}")
+
+    def get_record(self, url, progress_callback=None):
+        """
+        Fetch the record of one video URL and return it instead of writing it.
+        The cache and the raw archive are used as in a batch run, but nothing
+        goes to the output file or the sinks. Safe to call from several threads
+        at once; each thread gets its own yt-dlp session, closed by close().
+        Raises: KnownFailure, or the error of the last fetch attempt
+        """
+        with self._lock:
+            if self.rate_controller is None:
+                self._new_rate_controller()
+        metadata, _ = self._get_record(url, self._worker_session, progress_callback, self.rate_controller)
+        return metadata
+
+    def _get_record(self, url, get_session, progress_callback=None, limiter=None):
+        """
+        The record of url, from the cache or the network. get_session is only
+        called when the record has to come from the network.
+        Returns: (record, 'cache' or 'network')
+        """
+        metadata = self._lookup(url, progress_callback)
+        if metadata is not None:
+            return metadata, 'cache'
+        info = self._fetch_info(url, get_session, limiter, progress_callback)
+        return self._transform(info), 'network'
+
+    def _lookup(self, url, progress_callback=None):
+        """
+        Returns: the cached record of url, or None if it has to be fetched
+        Raises: KnownFailure if the cache remembers url failing permanently
+        """
+        with self.metrics.timer('cache_lookup'):
+            known_failure = self._known_failure(url)
+            metadata = self._cached_metadata(url, progress_callback) if known_failure is None else None
+        if known_failure is not None:
+            raise KnownFailure(url, known_failure)
+        if metadata is not None:
+            self.metrics.incr('cache_hits')
+        return metadata
+
+    def _fetch_info(self, url, get_session, limiter=None, progress_callback=None):
+        """yt-dlp's info dict for url; a permanent failure is remembered in the cache."""
+        try:
+            return self._fetch(url, get_session, limiter, progress_callback)
         except Exception as e:
+            if classify_error(e) == PERMANENT:
+                # yt-dlp itself reported the video as gone
+                self._remember_failure(url, str(e))
+            raise
+
+    def _transform(self, info):
+        """Archive a fetched info dict, build its record and cache it. Returns: the record"""
+        metrics = self.metrics
+        if self.archive is not None:
+            with metrics.timer('archive'):
+                self.archive.add(info)
+        with metrics.timer('build'):
+            metadata = self._build_metadata(info)
+        if self.cache is not None and metadata['video_id']:
+            with metrics.timer('cache_store'):
+                self.cache.put(metadata['video_id'], metadata)
+        return metadata
+
+    def _write_record(self, url, metadata, source, started, progress_callback=None):
+        """Write one record to the output file and the sinks. Sink errors are logged and counted, not raised."""
+        metrics = self.metrics
+        writer = self.open_writer()
+        # The journal line goes in under the same lock as the row, so a
+        # checkpoint taken by another thread never covers a row whose URL is
+        # not journaled yet (a resumed run would write that row twice)
+        with self._write_lock:
+            with metrics.timer('write'):
+                writer.write(metadata)
+            if self.sinks:
+                with metrics.timer('sinks'):
+                    for sink in self.sinks:
+                        # The row is already written: a failing sink must not
+                        # fail the URL, or its retry would write the row again
+                        try:
+                            sink.write(metadata)
+                        except Exception as e:
+                            metrics.incr('sink_errors', label=type(sink).__name__)
+                            logging.error(f"Error writing {url} to {type(sink).__name__}: {str(e)}")
+                            if progress_callback:
+                                progress_callback(f"Error writing {url} to {type(sink).__name__}: {str(e)}")
+            if self.journal is not None:
+                self.journal.record(url, True, writer, self.sinks)
+        metrics.incr('successes')
+        if metrics.enabled:
+            metrics.event('url_done', url=url, success=True, source=source,
+                          video_id=metadata['video_id'], elapsed=time.perf_counter() - started)
+        if progress_callback:
+            if writer.path:
+                progress_callback(f"Saved metadata to: {writer.path}")
+            progress_callback(f"Successfully processed: {url}")
+
+    def _handle_failure(self, url, error, source, started, progress_callback=None):
+        """Count and report a failed URL. Returns: its rate_control error kind"""
+        metrics = self.metrics
+        if isinstance(error, KnownFailure):
+            metrics.incr('known_failures')
+            if progress_callback:
+                progress_callback(f"Skipping {url}, it failed permanently before: {error.message}")
+            return PERMANENT
+        kind = classify_error(error)
+        metrics.incr('failures', label=type(error).__name__)
+        metrics.incr('failure_kinds', label=kind)
+        if metrics.enabled:
+            metrics.event('url_done', url=url, success=False, source=source, error=type(error).__name__,
+                          kind=kind, message=str(error), elapsed=time.perf_counter() - started)
+        if progress_callback:
+            progress_callback(f"Error processing {url} ({kind}): {str(error)}")
+        logging.error(f"Error processing {url} ({kind}): {str(error)}")
+        return kind
+
+    def _extract(self, url, get_session, progress_callback=None, limiter=None):
+        """
+        Fetch one URL and write its record. URLs the cache knows to have failed
+        permanently fail straight away.
+        Returns: (True, None) on success, (False, error kind) on failure
+        """
+        started = time.perf_counter()
+        source = 'network'
+        try:
             if progress_callback:
-                progress_callback(f"Error processing {url}: {str(e)}")
-            logging.error(f"Error processing {url}: {str(e)}")
-            return False
+                progress_callback(f"Processing URL: {url}")
+            metadata, source = self._get_record(url, get_session, progress_callback, limiter)
+            self._write_record(url, metadata, source, started, progress_callback)
+            return True, None
+        except Exception as e:
+            return False, self._handle_failure(url, e, source, started, progress_callback)
+
+    def _fetch(self, url, get_session, limiter=None, progress_callback=None):
+        """
+        Get yt-dlp's info dict for url. With a rate_control.AdaptiveRateController,
+        transient and rate-limited failures are retried after a jittered backoff
+        and every outcome is reported to the controller. Raises the last error.
+        """
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            if limiter is not None:
+                waited = limiter.acquire(url)
+                self._local.throttled = getattr(self._local, 'throttled', 0.0) + waited
+                if limiter.rate or waited:
+                    metrics.observe('rate_wait', waited)
+            session = get_session()
+            metrics.incr('requests')
+            try:
+                with metrics.timer('fetch'):
+                    info = session.extract_info(url, download=False)
+            except Exception as e:
+                if limiter is None:
+                    raise
+                kind = classify_error(e)
+                limiter.record_failure(kind)
+                if kind == RATE_LIMITED:
+                    metrics.incr('rate_limited')
+                if not limiter.should_retry(kind, attempt):
+                    raise
+                delay = limiter.retry_delay(attempt)
+                attempt += 1
+                metrics.incr('fetch_retries')
+                if progress_callback:
+                    progress_callback(f"Retrying {url} in {delay:.1f}s ({kind}): {str(e)}")
+                time.sleep(delay)
+                self._local.throttled = getattr(self._local, 'throttled', 0.0) + delay
+                metrics.observe('backoff', delay)
+                continue
+            if limiter is not None:
+                limiter.record_success()
+            return info
+
+    def _known_failure(self, url):
+        if self.cache is None or self.force_refresh:
+            return None
+        video_id = video_id_from_url(url)
+        return self.cache.get_failure(video_id) if video_id else None
+
+    def _remember_failure(self, url, message):
+        video_id = video_id_from_url(url)
+        if self.cache is not None and video_id:
+            try:
+                self.cache.put_failure(video_id, message)
+            except Exception as e:
+                logging.error(f"Error recording failure of {url}: {str(e)}")
+
+    def _cached_metadata(self, url, progress_callback=None):
+        if self.cache is None or self.force_refresh:
+            return None
+        video_id = video_id_from_url(url)
+        if video_id is None:
+            return None
+        cached = self.cache.get(video_id)
+        # A record cached with fewer fields than this run wants counts as a miss
+        metadata = self.projection.from_mapping(cached) if cached is not None else None
+        if metadata is not None and progress_callback:
+            progress_callback(f"Using cached metadata for {video_id}")
+        return metadata
+
+    def _build_metadata(self, info):
+        return self.projection.build(info)
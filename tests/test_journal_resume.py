@@ -0,0 +1,90 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'yt_data_extractor')
+
+# Stands in for yt-dlp so the test needs no network: every URL is a video
+FAKE_YT_DLP = '''
+class DownloadError(Exception):
+    pass
+
+
+class utils:
+    DownloadError = DownloadError
+
+
+class YoutubeDL:
+    def __init__(self, opts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False, process=True):
+        video_id = url.split('v=')[-1]
+        return {'id': video_id, 'title': 'Video ' + video_id, 'upload_date': '20240101',
+                'view_count': 1, 'like_count': 1, 'duration': 1, 'tags': [], 'category': 'Music',
+                'description': 'd'}
+'''
+
+# Extracts urls.txt concurrently, dying without any cleanup after KILL_AFTER results
+RUN_BATCH = '''
+import os
+import sys
+from youtube_extractor import YouTubeExtractor
+
+work_dir, kill_after = sys.argv[1], int(sys.argv[2])
+with open(os.path.join(work_dir, 'urls.txt')) as f:
+    urls = f.read().split()
+extractor = YouTubeExtractor(os.path.join(work_dir, 'out'), output_format='jsonl', dedupe=None,
+                             journal_path=os.path.join(work_dir, 'journal.log'))
+for done, result in enumerate(extractor.extract_concurrent(urls, workers=8, write_workers=2), 1):
+    if done == kill_after:
+        os._exit(1)
+extractor.close()
+'''
+
+
+class JournalResumeTest(unittest.TestCase):
+    def run_batch(self, work_dir, kill_after=0):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([work_dir, os.path.abspath(PACKAGE_DIR)]))
+        return subprocess.run([sys.executable, os.path.join(work_dir, 'run_batch.py'), work_dir, str(kill_after)],
+                              env=env, capture_output=True, text=True)
+
+    def test_killed_concurrent_run_resumes_without_duplicate_rows(self):
+        video_ids = [f"v{number:010d}" for number in range(1500)]
+        for attempt in range(3):
+            with tempfile.TemporaryDirectory() as work_dir:
+                os.makedirs(os.path.join(work_dir, 'out'))
+                with open(os.path.join(work_dir, 'yt_dlp.py'), 'w') as f:
+                    f.write(FAKE_YT_DLP)
+                with open(os.path.join(work_dir, 'run_batch.py'), 'w') as f:
+                    f.write(textwrap.dedent(RUN_BATCH))
+                with open(os.path.join(work_dir, 'urls.txt'), 'w') as f:
+                    f.write('\n'.join(f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids))
+                killed = self.run_batch(work_dir, kill_after=1100)
+                self.assertEqual(killed.returncode, 1, killed.stderr)
+                resumed = self.run_batch(work_dir)
+                self.assertEqual(resumed.returncode, 0, resumed.stderr)
+                written = []
+                for path in glob.glob(os.path.join(work_dir, 'out', '*.jsonl')):
+                    with open(path, encoding='utf-8') as f:
+                        written.extend(json.loads(line)['video_id'] for line in f if line.strip())
+                written.sort()
+                self.assertEqual(written, video_ids, f"attempt {attempt + 1}: {len(written)} rows")
+
+
+if __name__ == '__main__':
+    unittest.main()
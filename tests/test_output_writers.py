@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'yt_data_extractor'))
+
+from output_writers import RESUMABLE_FORMATS, create_writer, parquet_available, read_records  # noqa: E402
+
+RECORDS = [
+    {'video_id': 'aaaaaaaaaaa', 'title': 'Café, "quoted" | piped', 'upload_date': '20240101', 'view_count': 12,
+     'like_count': None, 'duration': 61, 'tags': ['lo-fi', 'two words'], 'category': 'Music',
+     'description': 'first line\nsecond line', 'scrape_timestamp': '2024-01-02 03:04:05'},
+    {'video_id': 'bbbbbbbbbbb', 'title': '', 'upload_date': '20231231', 'view_count': 0,
+     'like_count': 3, 'duration': None, 'tags': [], 'category': 'Education',
+     'description': '', 'scrape_timestamp': '2024-01-02 03:04:06'},
+]
+
+
+class WriterRoundTripTest(unittest.TestCase):
+    def round_trip(self, output_format):
+        with tempfile.TemporaryDirectory() as output_dir:
+            writer = create_writer(output_dir, output_format=output_format)
+            for record in RECORDS:
+                writer.write(record)
+            writer.close()
+            return list(read_records(writer.path))
+
+    def test_records_read_back_unchanged(self):
+        formats = list(RESUMABLE_FORMATS) + (['parquet'] if parquet_available() else [])
+        for output_format in formats:
+            with self.subTest(output_format=output_format):
+                self.assertEqual(self.round_trip(output_format), RECORDS)
+
+    def test_resume_discards_rows_after_the_checkpoint(self):
+        for output_format in RESUMABLE_FORMATS:
+            with self.subTest(output_format=output_format), tempfile.TemporaryDirectory() as output_dir:
+                writer = create_writer(output_dir, output_format=output_format)
+                writer.write(RECORDS[0])
+                path, position = writer.checkpoint()
+                # Written after the checkpoint, so lost in the "crash"
+                writer.write(RECORDS[1])
+                writer.close()
+
+                resumed = create_writer(output_dir, output_format=output_format)
+                resumed.resume(path, position)
+                resumed.write(RECORDS[1])
+                resumed.close()
+                self.assertEqual(resumed.path, path)
+                self.assertEqual(list(read_records(path)), RECORDS)
+
+    def test_resume_with_missing_output_raises_and_closes_cleanly(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            writer = create_writer(output_dir, output_format='csv')
+            with self.assertRaisesRegex(ValueError, 'missing'):
+                writer.resume(os.path.join(output_dir, 'gone.csv'), 100)
+            self.assertIsNone(writer.path)
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'yt_data_extractor'))
+
+from rate_control import (  # noqa: E402
+    PERMANENT, RATE_LIMITED, TRANSIENT, AdaptiveRateController, classify_error,
+)
+
+
+class DownloadError(Exception):
+    """Named like yt-dlp's, which wraps most fetch errors."""
+
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_rate_limits(self):
+        self.assertEqual(classify_error(DownloadError('ERROR: HTTP Error 429: Too Many Requests')), RATE_LIMITED)
+        # The bot check reuses the "Video unavailable" wording
+        self.assertEqual(
+            classify_error(DownloadError("Video unavailable. Sign in to confirm you're not a bot")), RATE_LIMITED
+        )
+
+    def test_permanent_messages(self):
+        for message in ('ERROR: [youtube] abc: Private video', 'Video unavailable', 'HTTP Error 404: Not Found',
+                        'This video is not available in your country'):
+            with self.subTest(message=message):
+                self.assertEqual(classify_error(DownloadError(message)), PERMANENT)
+
+    def test_everything_else_is_transient(self):
+        for error in (ConnectionResetError('connection reset by peer'), TimeoutError(),
+                      DownloadError('Unable to download webpage: <urlopen error timed out>'),
+                      KeyError('view_count'), ValueError('unexpected')):
+            with self.subTest(error=repr(error)):
+                self.assertEqual(classify_error(error), TRANSIENT)
+
+
+class AdaptiveRateControllerTest(unittest.TestCase):
+    def test_rate_limit_cuts_the_rate_and_successes_raise_it(self):
+        controller = AdaptiveRateController(10.0, increase=1.0, increase_every=2)
+        controller.record_failure(RATE_LIMITED)
+        cut = controller.stats()['rate']
+        self.assertLess(cut, 10.0)
+        for _ in range(4):
+            controller.record_success()
+        self.assertGreater(controller.stats()['rate'], cut)
+        self.assertLessEqual(controller.stats()['rate'], 10.0)
+
+    def test_retries_only_for_retryable_kinds(self):
+        controller = AdaptiveRateController(max_retries=2)
+        self.assertTrue(controller.should_retry(TRANSIENT, 0))
+        self.assertTrue(controller.should_retry(RATE_LIMITED, 1))
+        self.assertFalse(controller.should_retry(TRANSIENT, 2))
+        self.assertFalse(controller.should_retry(PERMANENT, 0))
+
+    def test_consecutive_failures_trip_the_breaker(self):
+        controller = AdaptiveRateController(breaker_threshold=3)
+        for _ in range(3):
+            controller.record_failure(TRANSIENT)
+        self.assertEqual(controller.stats()['breaker_trips'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
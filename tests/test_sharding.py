@@ -0,0 +1,162 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+PACKAGE_DIR = os.path.join(SRC_DIR, 'yt_data_extractor')
+sys.path.insert(0, PACKAGE_DIR)
+
+from sharding import merge_records, shard_of  # noqa: E402
+
+# Stands in for yt-dlp: every URL is a video, except that the video FAILING_ID
+# has its connection reset while the file named by $FAKE_FAIL_FLAG exists
+FAKE_YT_DLP = '''
+import os
+
+FAILING_ID = 'failingvid1'
+
+
+class DownloadError(Exception):
+    pass
+
+
+class utils:
+    DownloadError = DownloadError
+
+
+class YoutubeDL:
+    def __init__(self, opts=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False, process=True):
+        video_id = url.split('v=')[-1]
+        if video_id == FAILING_ID and os.path.exists(os.environ['FAKE_FAIL_FLAG']):
+            raise ConnectionResetError('connection reset by peer')
+        return {'id': video_id, 'title': 'Video ' + video_id, 'upload_date': '20240101',
+                'view_count': 1, 'like_count': 1, 'duration': 1, 'tags': [], 'category': 'Music',
+                'description': 'd'}
+'''
+
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+class MergeRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        for number in range(60):
+            # Every third video was scraped twice; the later snapshot must win
+            self.records.append({'video_id': f"v{number:03d}", 'scrape_timestamp': '2024-01-01', 'title': 'old'})
+            if number % 3 == 0:
+                self.records.append({'video_id': f"v{number:03d}", 'scrape_timestamp': '2024-02-01', 'title': 'new'})
+
+    def merged(self, files, run_size):
+        return [record for record, _ in merge_records(files, run_size=run_size)]
+
+    def test_result_does_not_depend_on_sharding_or_input_order(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            outputs = []
+            for count in (1, 3, 4):
+                files = []
+                for index in range(count):
+                    path = os.path.join(work_dir, f"{count}-{index}.jsonl")
+                    write_jsonl(path, [record for record in self.records
+                                       if shard_of(record['video_id'], count) == index])
+                    files.append(path)
+                # Small runs so every merge spills sorted runs to disk
+                outputs.append(self.merged(files, run_size=7))
+                outputs.append(self.merged(list(reversed(files)), run_size=7))
+            for output in outputs[1:]:
+                self.assertEqual(output, outputs[0])
+
+        merged = outputs[0]
+        self.assertEqual([record['video_id'] for record in merged], [f"v{number:03d}" for number in range(60)])
+        for record in merged:
+            expected = 'new' if int(record['video_id'][1:]) % 3 == 0 else 'old'
+            self.assertEqual(record['title'], expected, record['video_id'])
+
+    def test_duplicates_are_counted(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, 'all.jsonl')
+            write_jsonl(path, self.records)
+            duplicates = [duplicates for _, duplicates in merge_records([path], run_size=5)]
+        self.assertEqual(duplicates[-1], 20)
+
+
+class ShardedResumeTest(unittest.TestCase):
+    def setUp(self):
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.work_dir = self._work_dir.name
+        with open(os.path.join(self.work_dir, 'yt_dlp.py'), 'w') as f:
+            f.write(FAKE_YT_DLP)
+        self.fail_flag = os.path.join(self.work_dir, 'fail')
+        open(self.fail_flag, 'w').close()
+        self.video_ids = sorted([f"vid{number:08d}" for number in range(40)] + ['failingvid1'])
+        with open(os.path.join(self.work_dir, 'urls.txt'), 'w') as f:
+            f.write('\n'.join(f"https://www.youtube.com/watch?v={video_id}" for video_id in self.video_ids))
+
+    def tearDown(self):
+        self._work_dir.cleanup()
+
+    def run_extract(self):
+        env = dict(os.environ, FAKE_FAIL_FLAG=self.fail_flag,
+                   PYTHONPATH=os.pathsep.join([self.work_dir, os.path.abspath(SRC_DIR)]))
+        return subprocess.run(
+            [sys.executable, '-m', 'yt_data_extractor', 'extract', '-b', 'urls.txt', '-o', 'out', '-f', 'jsonl',
+             '--processes', '2', '--journal', os.path.join('j', 'run.journal'), '--fetch-retries', '0',
+             '--no-cache'],
+            cwd=self.work_dir, env=env, capture_output=True, text=True
+        )
+
+    def latest_merge(self):
+        paths = sorted(glob.glob(os.path.join(self.work_dir, 'out', '*.jsonl')), key=os.path.getmtime)
+        with open(paths[-1], encoding='utf-8') as f:
+            return sorted(json.loads(line)['video_id'] for line in f if line.strip())
+
+    def test_rerun_resumes_the_failed_shard(self):
+        os.makedirs(os.path.join(self.work_dir, 'j'))
+        first = self.run_extract()
+        self.assertEqual(first.returncode, 1, first.stderr)
+        self.assertEqual(self.latest_merge(), [video_id for video_id in self.video_ids if video_id != 'failingvid1'])
+        # The failed shard's journal points into its output, so the shards are kept
+        self.assertTrue(os.path.isdir(os.path.join(self.work_dir, 'out', 'shards')))
+        self.assertTrue(glob.glob(os.path.join(self.work_dir, 'j', 'run.shard*.journal')))
+
+        os.remove(self.fail_flag)
+        second = self.run_extract()
+        self.assertEqual(second.returncode, 0, second.stderr)
+        self.assertEqual(self.latest_merge(), self.video_ids)
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, 'out', 'shards')))
+        self.assertEqual(glob.glob(os.path.join(self.work_dir, 'j', '*')), [])
+
+    def test_missing_shard_output_is_an_error_not_a_partial_merge(self):
+        os.makedirs(os.path.join(self.work_dir, 'j'))
+        self.assertEqual(self.run_extract().returncode, 1)
+        merges = glob.glob(os.path.join(self.work_dir, 'out', '*.jsonl'))
+        shutil.rmtree(os.path.join(self.work_dir, 'out', 'shards'))
+        rerun = self.run_extract()
+        self.assertEqual(rerun.returncode, 2, rerun.stderr)
+        self.assertIn('Cannot resume', rerun.stderr)
+        self.assertIn('not merging', rerun.stderr)
+        self.assertEqual(glob.glob(os.path.join(self.work_dir, 'out', '*.jsonl')), merges)
+
+
+if __name__ == '__main__':
+    unittest.main()
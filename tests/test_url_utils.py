@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'yt_data_extractor'))
+
+from dedupe import Deduplicator  # noqa: E402
+from url_utils import canonical_url, is_channel_url, is_collection_url, video_id_from_url  # noqa: E402
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+WATCH_URL = f"https://www.youtube.com/watch?v={VIDEO_ID}"
+
+
+class CanonicalURLTest(unittest.TestCase):
+    def test_spellings_of_one_video(self):
+        for url in (VIDEO_ID, f"https://youtu.be/{VIDEO_ID}?si=abc", f"m.youtube.com/watch?v={VIDEO_ID}&t=42",
+                    f"https://music.youtube.com/watch?v={VIDEO_ID}&feature=share",
+                    f"https://www.youtube.com/shorts/{VIDEO_ID}", f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}"):
+            with self.subTest(url=url):
+                self.assertEqual(video_id_from_url(url), VIDEO_ID)
+                self.assertEqual(canonical_url(url), WATCH_URL)
+
+    def test_youtube_collections_lose_tracking_parameters(self):
+        self.assertEqual(canonical_url('https://m.youtube.com/playlist?list=PL1&index=3&si=x#top'),
+                         'https://www.youtube.com/playlist?list=PL1')
+        self.assertEqual(canonical_url(' youtube.com/@channel/ '), 'https://www.youtube.com/@channel')
+
+    def test_other_sites_are_left_alone(self):
+        url = 'http://example.com:8080/a?index=3'
+        self.assertEqual(canonical_url(f"  {url}\n"), url)
+
+    def test_collections_and_channels(self):
+        self.assertTrue(is_collection_url('https://www.youtube.com/playlist?list=PL1'))
+        self.assertTrue(is_collection_url('https://www.youtube.com/@channel/videos'))
+        self.assertFalse(is_collection_url(WATCH_URL))
+        self.assertTrue(is_channel_url('https://www.youtube.com/channel/UC123/videos'))
+        self.assertFalse(is_channel_url('https://www.youtube.com/playlist?list=PL1'))
+        self.assertFalse(is_channel_url('https://example.com/@someone'))
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def test_drops_equivalent_urls_and_passes_originals_on(self):
+        urls = [f"https://youtu.be/{VIDEO_ID}", f"{WATCH_URL}&t=3", 'http://example.com/a?index=3',
+                'http://example.com/a?index=4']
+        for mode in ('memory', 'bloom'):
+            with self.subTest(mode=mode):
+                deduplicator = Deduplicator(mode, expected_items=1000)
+                kept = list(deduplicator.filter(enumerate(urls)))
+                self.assertEqual(kept, [(0, urls[0]), (2, urls[2]), (3, urls[3])])
+                self.assertEqual(deduplicator.dropped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()